@@ -143,6 +143,12 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': ('rest_framework_simplejwt.authentication.JWTAuthentication',)
 }
 
+# 电影列表游标分页配置(默认每页数量、每页数量上限)
+MOVIE_CURSOR_PAGINATION = {
+    'PAGE_SIZE': 20,
+    'MAX_PAGE_SIZE': 100,
+}
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
@@ -164,7 +170,97 @@ REDIS_CONFIG = {
     'host': '127.0.0.1',
     'port': 6379,
     'password': '123456',
-    'decode_responses': True
+    'decode_responses': True,
+    'max_connections': 50,  # 每个进程连接池的最大连接数
+    'timeout': 5,  # 连接池耗尽时等待空闲连接的秒数
+    'health_check_interval': 30,  # 连接空闲超过30秒后再次使用前先PING检查
+    'socket_connect_timeout': 3,
+}
+
+# 电影封面代理的服务端磁盘缓存(缓存目录、总大小上限、获取失败url的负缓存时长)
+IMAGE_CACHE = {
+    'DIR': os.path.join(BASE_DIR, '.cache', 'proxy_images'),
+    'MAX_BYTES': 512 * 1024 * 1024,
+    'NEGATIVE_TTL': 300,
+}
+
+# 电影封面代理请求上游的配置(连接/读取超时、连接池大小、并发请求等待同一图片的最长秒数)
+IMAGE_PROXY = {
+    'CONNECT_TIMEOUT': 3,
+    'READ_TIMEOUT': 10,
+    'POOL_MAXSIZE': 20,
+    'WAIT_TIMEOUT': 15,
+}
+
+# 电影榜单分页配置(默认每页数量、每页数量上限)，榜单本身维护在redis有序集合中
+MOVIE_RANKING = {
+    'PAGE_SIZE': 20,
+    'MAX_PAGE_SIZE': 100,
+}
+
+# 热门电影榜配置(redis)：热度半衰期(小时)，评分、评论、浏览详情各计的热度，
+# 重新归一化时移除的热度下限，以及分页的默认每页数量、每页数量上限
+TRENDING = {
+    'HALF_LIFE_HOURS': 72,
+    'RATING_WEIGHT': 3,
+    'COMMENT_WEIGHT': 2,
+    'VIEW_WEIGHT': 1,
+    'MIN_SCORE': 0.01,
+    'PAGE_SIZE': 20,
+    'MAX_PAGE_SIZE': 100,
+}
+
+# 电影搜索内存索引配置(无法从redis读取变更时，索引超过该秒数后整体重建；读取redis变更记录的最短间隔(秒)；
+# 搜索结果的默认每页数量和每页数量上限)
+SEARCH_INDEX = {
+    'MAX_AGE': 600,
+    'POLL_INTERVAL': 0.5,
+    'PAGE_SIZE': 20,
+    'MAX_PAGE_SIZE': 100,
+}
+
+# 电影推荐配置
+# BACKEND: 个性化推荐后端，item_cf(电影近邻协同过滤)或als(矩阵分解，模型未训练时退回item_cf)
+# 电影近邻：每部电影保留的近邻数、相似度收缩系数、离线计算时每批处理的电影数
+# 相似电影(内容相似度，详情页展示)：每部电影保留的相似电影数、电影修改后合并增量更新的等待时间(秒)、
+#     增量更新沿用的特征表和逆文档频率的最长使用时间(秒，超过后整体重新构建)
+# ALS：隐因子维数、正则化系数、迭代次数、模型文件目录
+RECOMMENDATION = {
+    'BACKEND': 'item_cf',
+    'NEIGHBORS_PER_MOVIE': 50,
+    'SIMILARITY_SHRINKAGE': 10,
+    'BLOCK_SIZE': 2000,
+    'SIMILAR_MOVIES_PER_MOVIE': 20,
+    'SIMILAR_MOVIES_DEBOUNCE': 5,
+    'SIMILAR_MOVIES_MODEL_MAX_AGE': 86400,
+    'ALS_FACTORS': 32,
+    'ALS_REGULARIZATION': 0.1,
+    'ALS_ITERATIONS': 10,
+    'ALS_MODEL_DIR': os.path.join(BASE_DIR, '.cache', 'als'),
+}
+
+# 推荐结果缓存(redis)：个性化推荐列表和共享推荐列表(匿名用户及没有评分的用户)的有效期(秒)
+RECOMMENDATION_CACHE = {
+    'USER_TTL': 1800,
+    'SHARED_TTL': 600,
+}
+
+# 评分写缓冲(redis)：开启后用户评分先写入redis并立即返回，由后台线程每隔 FLUSH_INTERVAL 秒批量写入数据库
+RATING_BUFFER = {
+    'ENABLED': False,
+    'FLUSH_INTERVAL': 2,
+}
+
+# 批量查询用户评分：一次最多查询的电影数，以及用户评分缓存(redis)的有效期(秒)
+MY_RATINGS = {
+    'MAX_IDS': 500,
+    'CACHE_TTL': 86400,
+}
+
+# 批量提交评分：接口一次最多提交的评分数，以及每个事务写入的评分数
+BULK_RATINGS = {
+    'MAX_ROWS': 5000,
+    'CHUNK_SIZE': 1000,
 }
 
 # 阿里云OSS存储配置
@@ -22,7 +22,8 @@ from bandou.views import proxy_bouban_movie_image, UserRegisterView, UserLoginVi
     UserAvatarUploadView, UserPasswordChangeView, MovieRankingView, UserRatingListCreateView, \
     MovieRatingListView, MovieRatingStatsView, UserCommentListCreateView, MovieCommentListView, \
     CurrentUserRatingView, CommentDeleteView, CommentReplyView, MovieRecommendationView, PasswordResetRequestView, \
-    PasswordResetConfirmView, MovieSearchView
+    PasswordResetConfirmView, MovieSearchView, MovieSuggestView, SimilarMovieListView, \
+    RecommendationCacheStatsView, MovieTrendingView, MyRatingsView, BulkRatingView
 
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
@@ -34,7 +35,9 @@ urlpatterns = [
                   path("proxy_image/", proxy_bouban_movie_image),  # 获取电影图片
                   path("bandou/", include("bandou.urls")),  # 电影增删改查
                   path("movies/ranking/", MovieRankingView.as_view()),  # 电影榜单
+                  path("movies/trending/", MovieTrendingView.as_view()),  # 热门电影榜
                   path('movies/search/', MovieSearchView.as_view()),  # 电影搜索
+                  path('movies/suggest/', MovieSuggestView.as_view()),  # 电影搜索补全
                   path("api/user/register/", UserRegisterView.as_view()),  # 用户注册
                   path("api/user/login/", UserLoginView.as_view()),  # 用户登录
                   path("api/user/logout/", UserLogoutView.as_view()),  # 用户注销
@@ -47,11 +50,15 @@ urlpatterns = [
                   path('api/token/refresh/', TokenRefreshView.as_view()),  # 用户认证
                   path('api/user/ratings/', UserRatingListCreateView.as_view()),  # todo："我评分过的电影"
                   path('api/movies/<int:movie_id>/my_rating/', CurrentUserRatingView.as_view(), ),  # 用户对电影评分
+                  path('api/movies/my_ratings/', MyRatingsView.as_view()),  # 用户对多部电影的评分
+                  path('api/ratings/bulk/', BulkRatingView.as_view()),  # 批量提交评分
                   path('api/movies/<int:movie_id>/ratings/', MovieRatingListView.as_view()),  # todo:"最新评分"
                   path('api/movies/<int:movie_id>/rating_stats/', MovieRatingStatsView.as_view()),  # 电影评分统计
                   path('api/user/comments/', UserCommentListCreateView.as_view()),  # 用户对电影评论
                   path('api/comments/<int:pk>/', CommentDeleteView.as_view()),  # 用户评论删除
                   path('api/comments/<int:pk>/reply/', CommentReplyView.as_view()),  # 评论回复
                   path('api/movies/<int:movie_id>/comments/', MovieCommentListView.as_view()),  # 对应电影的评论列表
+                  path('api/movies/<int:movie_id>/similar/', SimilarMovieListView.as_view()),  # 相似电影
                   path('api/movies/recommend/', MovieRecommendationView.as_view()),  # 电影推荐
+                  path('api/movies/recommend/cache_stats/', RecommendationCacheStatsView.as_view()),  # 推荐缓存命中率
               ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
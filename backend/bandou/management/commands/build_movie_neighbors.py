@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from bandou.utils.item_cf import build_movie_neighbors
+
+
+class Command(BaseCommand):
+    help = "根据评分表重新计算电影近邻(物品协同过滤)，供个性化推荐使用"
+
+    def handle(self, *args, **options):
+        count = build_movie_neighbors()
+        self.stdout.write(self.style.SUCCESS(f"计算完成，写入 {count} 条电影近邻"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from bandou.utils.content_similarity import build_similar_movies
+
+
+class Command(BaseCommand):
+    help = "根据电影简介、导演、主演和类别重新计算全部电影的相似电影"
+
+    def handle(self, *args, **options):
+        count = build_similar_movies()
+        self.stdout.write(self.style.SUCCESS(f"计算完成，写入 {count} 条相似电影"))
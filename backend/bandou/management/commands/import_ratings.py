@@ -0,0 +1,22 @@
+import csv
+
+from django.core.management.base import BaseCommand
+
+from bandou.utils.rating_import import import_ratings
+
+
+class Command(BaseCommand):
+    help = "从CSV文件批量导入评分，文件首行为表头，包含 user_id、movie_id、rating 三列"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV文件路径")
+        parser.add_argument('--chunk-size', type=int, default=None, help="每个事务写入的评分数")
+
+    def handle(self, *args, **options):
+        with open(options['path'], newline='', encoding='utf-8-sig') as f:
+            rows = ((row.get('user_id'), row.get('movie_id'), row.get('rating')) for row in csv.DictReader(f))
+            result = import_ratings(rows, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"导入完成：新增 {result['created']} 条，修改 {result['updated']} 条，未变化 {result['unchanged']} 条，"
+            f"跳过 {result['skipped']} 条，涉及 {result['movies']} 部电影"
+        ))
@@ -0,0 +1,23 @@
+import redis
+from django.core.management.base import BaseCommand
+
+from bandou.utils.movie_ranking import rebuild_movie_rankings
+from bandou.utils.rating_aggregates import rebuild_movie_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = "根据评分表重建电影的评分总和、评分人数和综合评分"
+
+    def add_arguments(self, parser):
+        parser.add_argument('movie_ids', nargs='*', type=int, help="需要重建的电影id，不指定时重建全部电影")
+
+    def handle(self, *args, **options):
+        movie_ids = options['movie_ids'] or None
+        changed = rebuild_movie_rating_aggregates(movie_ids)
+        # 批量更新不触发信号，评分修正后整体重建redis中的电影榜单
+        if changed:
+            try:
+                rebuild_movie_rankings()
+            except redis.RedisError as e:
+                self.stderr.write(self.style.WARNING(f"重建电影榜单失败，将由每日定时任务重建: {str(e)}"))
+        self.stdout.write(self.style.SUCCESS(f"重建完成，修正了 {changed} 部电影的评分统计"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from bandou.utils.rating_aggregates import rebuild_rating_rollups
+
+
+class Command(BaseCommand):
+    help = "根据评分表回填或重建电影的每日评分汇总，并修正与评分表不一致的记录"
+
+    def add_arguments(self, parser):
+        parser.add_argument('movie_ids', nargs='*', type=int, help="需要重建的电影id，不指定时重建全部电影")
+
+    def handle(self, *args, **options):
+        changed = rebuild_rating_rollups(options['movie_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f"重建完成，修正了 {changed} 条每日评分汇总"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from bandou.utils.als import train_als_model
+
+
+class Command(BaseCommand):
+    help = "根据评分表训练ALS矩阵分解推荐模型并发布新版本，服务进程会自动加载"
+
+    def handle(self, *args, **options):
+        version = train_als_model()
+        if version is None:
+            self.stdout.write(self.style.WARNING("评分表为空，未训练模型"))
+            return
+        self.stdout.write(self.style.SUCCESS(f"训练完成，模型版本 {version}"))
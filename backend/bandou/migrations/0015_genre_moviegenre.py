@@ -0,0 +1,97 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bandou", "0014_movie_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Genre",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(
+                        max_length=32, unique=True, verbose_name="类别名称"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "电影类别",
+                "verbose_name_plural": "电影类别",
+                "db_table": "genre",
+            },
+        ),
+        migrations.CreateModel(
+            name="MovieGenre",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "genre",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="movie_genres",
+                        to="bandou.genre",
+                        verbose_name="类别",
+                    ),
+                ),
+                (
+                    "movie",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="movie_genres",
+                        to="bandou.movie",
+                        verbose_name="电影",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "电影类别关联",
+                "verbose_name_plural": "电影类别关联",
+                "db_table": "movie_genre",
+            },
+        ),
+        migrations.AddField(
+            model_name="movie",
+            name="genres",
+            field=models.ManyToManyField(
+                blank=True,
+                related_name="movies",
+                through="bandou.MovieGenre",
+                to="bandou.genre",
+                verbose_name="类别",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="moviegenre",
+            index=models.Index(
+                fields=["genre", "movie"], name="movie_genre_genre_movie_idx"
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="moviegenre",
+            unique_together={("movie", "genre")},
+        ),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+
+def populate_movie_genres(apps, schema_editor):
+    """将已有电影的type字符串拆分为规范化的类别关联"""
+    Movie = apps.get_model('bandou', 'Movie')
+    Genre = apps.get_model('bandou', 'Genre')
+    MovieGenre = apps.get_model('bandou', 'MovieGenre')
+
+    movie_genre_names = {}
+    all_names = set()
+    for movie_id, movie_type in Movie.objects.values_list('id', 'type').iterator():
+        names = {name.strip() for name in (movie_type or '').split('/') if name.strip()}
+        if names:
+            movie_genre_names[movie_id] = names
+            all_names |= names
+
+    Genre.objects.bulk_create([Genre(name=name) for name in sorted(all_names)], ignore_conflicts=True)
+    genre_ids = dict(Genre.objects.values_list('name', 'id'))
+
+    MovieGenre.objects.bulk_create(
+        [
+            MovieGenre(movie_id=movie_id, genre_id=genre_ids[name])
+            for movie_id, names in movie_genre_names.items()
+            for name in names
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+def clear_movie_genres(apps, schema_editor):
+    apps.get_model('bandou', 'MovieGenre').objects.all().delete()
+    apps.get_model('bandou', 'Genre').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("bandou", "0015_genre_moviegenre"),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_movie_genres, clear_movie_genres),
+    ]
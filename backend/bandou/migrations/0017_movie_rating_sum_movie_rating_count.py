@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:44
+
+from django.db import migrations, models
+from django.db.models import Sum, Count
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    """根据已有评分初始化电影的评分总和与人数"""
+    Movie = apps.get_model("bandou", "Movie")
+    Rating = apps.get_model("bandou", "Rating")
+
+    stats = Rating.objects.values("movie_id").annotate(total=Sum("rating"), count=Count("id"))
+    movies = [
+        Movie(id=item["movie_id"], rating_sum=item["total"], rating_count=item["count"])
+        for item in stats
+    ]
+    Movie.objects.bulk_update(movies, ["rating_sum", "rating_count"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bandou", "0016_populate_movie_genres"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="movie",
+            name="rating_count",
+            field=models.PositiveIntegerField(default=0, verbose_name="用户评分人数"),
+        ),
+        migrations.AddField(
+            model_name="movie",
+            name="rating_sum",
+            field=models.FloatField(default=0, verbose_name="用户评分总和"),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bandou", "0017_movie_rating_sum_movie_rating_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="movie",
+            name="douban_id",
+            field=models.CharField(
+                blank=True, max_length=16, null=True, unique=True, verbose_name="豆瓣id"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="movie",
+            name="title",
+            field=models.CharField(db_index=True, max_length=128, verbose_name="片名"),
+        ),
+    ]
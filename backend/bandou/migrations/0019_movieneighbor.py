@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bandou", "0018_movie_douban_id_alter_movie_title"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MovieNeighbor",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("similarity", models.FloatField(verbose_name="相似度")),
+                (
+                    "movie",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="neighbors",
+                        to="bandou.movie",
+                        verbose_name="电影",
+                    ),
+                ),
+                (
+                    "neighbor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="bandou.movie",
+                        verbose_name="相似电影",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "电影近邻",
+                "verbose_name_plural": "电影近邻",
+                "db_table": "movie_neighbor",
+                "unique_together": {("movie", "neighbor")},
+            },
+        ),
+    ]
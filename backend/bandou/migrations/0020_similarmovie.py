@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bandou", "0019_movieneighbor"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SimilarMovie",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("similarity", models.FloatField(verbose_name="相似度")),
+                (
+                    "movie",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="similar_movies",
+                        to="bandou.movie",
+                        verbose_name="电影",
+                    ),
+                ),
+                (
+                    "similar",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="bandou.movie",
+                        verbose_name="相似电影",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "相似电影",
+                "verbose_name_plural": "相似电影",
+                "db_table": "similar_movie",
+                "unique_together": {("movie", "similar")},
+            },
+        ),
+    ]
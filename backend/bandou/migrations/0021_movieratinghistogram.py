@@ -0,0 +1,96 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_rating_histograms(apps, schema_editor):
+    """根据已有评分初始化电影的评分分布"""
+    MovieRatingHistogram = apps.get_model("bandou", "MovieRatingHistogram")
+    Rating = apps.get_model("bandou", "Rating")
+
+    histograms = {}
+    stats = Rating.objects.values("movie_id", "rating").annotate(count=Count("id"))
+    for item in stats:
+        bucket = min(max(int(item["rating"] * 2 + 0.5), 0), 10)
+        histogram = histograms.setdefault(item["movie_id"], MovieRatingHistogram(movie_id=item["movie_id"]))
+        field = f"bucket_{bucket}"
+        setattr(histogram, field, getattr(histogram, field) + item["count"])
+    MovieRatingHistogram.objects.bulk_create(histograms.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bandou", "0020_similarmovie"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MovieRatingHistogram",
+            fields=[
+                (
+                    "movie",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="rating_histogram",
+                        serialize=False,
+                        to="bandou.movie",
+                        verbose_name="电影",
+                    ),
+                ),
+                (
+                    "bucket_0",
+                    models.PositiveIntegerField(default=0, verbose_name="0分人数"),
+                ),
+                (
+                    "bucket_1",
+                    models.PositiveIntegerField(default=0, verbose_name="0.5分人数"),
+                ),
+                (
+                    "bucket_2",
+                    models.PositiveIntegerField(default=0, verbose_name="1分人数"),
+                ),
+                (
+                    "bucket_3",
+                    models.PositiveIntegerField(default=0, verbose_name="1.5分人数"),
+                ),
+                (
+                    "bucket_4",
+                    models.PositiveIntegerField(default=0, verbose_name="2分人数"),
+                ),
+                (
+                    "bucket_5",
+                    models.PositiveIntegerField(default=0, verbose_name="2.5分人数"),
+                ),
+                (
+                    "bucket_6",
+                    models.PositiveIntegerField(default=0, verbose_name="3分人数"),
+                ),
+                (
+                    "bucket_7",
+                    models.PositiveIntegerField(default=0, verbose_name="3.5分人数"),
+                ),
+                (
+                    "bucket_8",
+                    models.PositiveIntegerField(default=0, verbose_name="4分人数"),
+                ),
+                (
+                    "bucket_9",
+                    models.PositiveIntegerField(default=0, verbose_name="4.5分人数"),
+                ),
+                (
+                    "bucket_10",
+                    models.PositiveIntegerField(default=0, verbose_name="5分人数"),
+                ),
+            ],
+            options={
+                "verbose_name": "电影评分分布",
+                "verbose_name_plural": "电影评分分布",
+                "db_table": "movie_rating_histogram",
+            },
+        ),
+        migrations.RunPython(backfill_rating_histograms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum, Count
+from django.db.models.functions import TruncDate
+
+
+def backfill_rating_rollups(apps, schema_editor):
+    """根据已有评分初始化每日评分汇总，也可以之后执行 rebuild_rating_rollups 命令回填"""
+    RatingDailyRollup = apps.get_model("bandou", "RatingDailyRollup")
+    Rating = apps.get_model("bandou", "Rating")
+
+    stats = Rating.objects.annotate(day=TruncDate("rating_time")).values("movie_id", "day").annotate(
+        total=Sum("rating"), count=Count("id"))
+    rollups = (
+        RatingDailyRollup(movie_id=item["movie_id"], day=item["day"], rating_sum=item["total"],
+                          rating_count=item["count"])
+        for item in stats.iterator(chunk_size=2000)
+    )
+    RatingDailyRollup.objects.bulk_create(rollups, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bandou", "0021_movieratinghistogram"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RatingDailyRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField(verbose_name="日期")),
+                ("rating_sum", models.FloatField(default=0, verbose_name="评分总和")),
+                (
+                    "rating_count",
+                    models.IntegerField(default=0, verbose_name="评分人数"),
+                ),
+                (
+                    "movie",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rating_rollups",
+                        to="bandou.movie",
+                        verbose_name="电影",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "每日评分汇总",
+                "verbose_name_plural": "每日评分汇总",
+                "db_table": "rating_daily_rollup",
+                "unique_together": {("movie", "day")},
+            },
+        ),
+        migrations.RunPython(backfill_rating_rollups, migrations.RunPython.noop),
+    ]
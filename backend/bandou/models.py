@@ -48,18 +48,39 @@ class LoginRecord(models.Model):
         return f"{self.user.username} - {formatted_time} - {self.login_ip}"
 
 
+class Genre(models.Model):
+    """
+    电影类别表
+    """
+    name = models.CharField(verbose_name="类别名称", max_length=32, unique=True)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        db_table = "genre"
+        verbose_name = "电影类别"
+        verbose_name_plural = verbose_name
+
+
 class Movie(models.Model):
     """
     电影表
     """
-    title = models.CharField(verbose_name="片名", max_length=128)
+    title = models.CharField(verbose_name="片名", max_length=128, db_index=True)
+    douban_id = models.CharField(verbose_name="豆瓣id", max_length=16, unique=True, null=True, blank=True)  # 爬虫入库去重键
     brief_introduction = models.CharField(verbose_name="简介", max_length=512)
     cover_url = models.CharField(verbose_name="封面url", max_length=255)
     score = models.FloatField(verbose_name="评分", null=True, blank=True)  # 这是综合了每个user的对该movie的综合评分
+    rating_sum = models.FloatField(verbose_name="用户评分总和", default=0)  # 随评分增删改增量维护
+    rating_count = models.PositiveIntegerField(verbose_name="用户评分人数", default=0)
     release_time = models.DateField(verbose_name="上映时间")
     director = models.CharField(verbose_name="导演", max_length=32)
     starring = models.CharField(verbose_name="主演", max_length=255)
-    type = models.CharField(verbose_name="电影类别", max_length=32)
+    type = models.CharField(verbose_name="电影类别", max_length=32)  # " / "拼接的类别名，用于展示
+    # 由type拆分得到的规范化类别，分类筛选和类别统计走索引关联查询
+    genres = models.ManyToManyField(Genre, through='MovieGenre', related_name='movies', blank=True,
+                                    verbose_name="类别")
 
     def __str__(self):
         return self.title
@@ -68,6 +89,29 @@ class Movie(models.Model):
         db_table = "movie"
         verbose_name = "电影信息"
         verbose_name_plural = verbose_name
+        indexes = [
+            # 游标分页的排序键
+            models.Index(fields=['score', 'id'], name='movie_score_id_idx'),
+            models.Index(fields=['release_time', 'id'], name='movie_release_time_id_idx'),
+        ]
+
+
+class MovieGenre(models.Model):
+    """
+    电影-类别关联表
+    """
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, verbose_name="电影", related_name="movie_genres")
+    genre = models.ForeignKey(Genre, on_delete=models.CASCADE, verbose_name="类别", related_name="movie_genres")
+
+    class Meta:
+        unique_together = ['movie', 'genre']
+        db_table = "movie_genre"
+        verbose_name = "电影类别关联"
+        verbose_name_plural = verbose_name
+        indexes = [
+            # 按类别查电影
+            models.Index(fields=['genre', 'movie'], name='movie_genre_genre_movie_idx'),
+        ]
 
 
 class Rating(models.Model):
@@ -86,6 +130,46 @@ class Rating(models.Model):
         verbose_name_plural = verbose_name
 
 
+class MovieRatingHistogram(models.Model):
+    """
+    电影评分分布表：按半星分档(bucket_N 为评分 N/2 的人数)，随评分增删改增量维护
+    """
+    movie = models.OneToOneField(Movie, on_delete=models.CASCADE, primary_key=True, verbose_name="电影",
+                                 related_name="rating_histogram")
+    bucket_0 = models.PositiveIntegerField(verbose_name="0分人数", default=0)
+    bucket_1 = models.PositiveIntegerField(verbose_name="0.5分人数", default=0)
+    bucket_2 = models.PositiveIntegerField(verbose_name="1分人数", default=0)
+    bucket_3 = models.PositiveIntegerField(verbose_name="1.5分人数", default=0)
+    bucket_4 = models.PositiveIntegerField(verbose_name="2分人数", default=0)
+    bucket_5 = models.PositiveIntegerField(verbose_name="2.5分人数", default=0)
+    bucket_6 = models.PositiveIntegerField(verbose_name="3分人数", default=0)
+    bucket_7 = models.PositiveIntegerField(verbose_name="3.5分人数", default=0)
+    bucket_8 = models.PositiveIntegerField(verbose_name="4分人数", default=0)
+    bucket_9 = models.PositiveIntegerField(verbose_name="4.5分人数", default=0)
+    bucket_10 = models.PositiveIntegerField(verbose_name="5分人数", default=0)
+
+    class Meta:
+        db_table = "movie_rating_histogram"
+        verbose_name = "电影评分分布"
+        verbose_name_plural = verbose_name
+
+
+class RatingDailyRollup(models.Model):
+    """
+    电影每日评分汇总表：按评分时间所在日期汇总评分总和与人数，随评分增删改增量维护，供评分趋势查询
+    """
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, verbose_name="电影", related_name="rating_rollups")
+    day = models.DateField(verbose_name="日期")
+    rating_sum = models.FloatField(verbose_name="评分总和", default=0)
+    rating_count = models.IntegerField(verbose_name="评分人数", default=0)
+
+    class Meta:
+        unique_together = ['movie', 'day']
+        db_table = "rating_daily_rollup"
+        verbose_name = "每日评分汇总"
+        verbose_name_plural = verbose_name
+
+
 class Comments(models.Model):
     """
     评论表
@@ -102,3 +186,33 @@ class Comments(models.Model):
         db_table = "comments"
         verbose_name = "评论信息"
         verbose_name_plural = verbose_name
+
+
+class MovieNeighbor(models.Model):
+    """
+    电影近邻表(基于用户评分的物品协同过滤，离线计算)
+    """
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, verbose_name="电影", related_name="neighbors")
+    neighbor = models.ForeignKey(Movie, on_delete=models.CASCADE, verbose_name="相似电影", related_name="+")
+    similarity = models.FloatField(verbose_name="相似度")
+
+    class Meta:
+        unique_together = ['movie', 'neighbor']
+        db_table = "movie_neighbor"
+        verbose_name = "电影近邻"
+        verbose_name_plural = verbose_name
+
+
+class SimilarMovie(models.Model):
+    """
+    相似电影表(基于简介、导演、主演和类别的内容相似度，离线计算并在新增电影时增量更新)
+    """
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, verbose_name="电影", related_name="similar_movies")
+    similar = models.ForeignKey(Movie, on_delete=models.CASCADE, verbose_name="相似电影", related_name="+")
+    similarity = models.FloatField(verbose_name="相似度")
+
+    class Meta:
+        unique_together = ['movie', 'similar']
+        db_table = "similar_movie"
+        verbose_name = "相似电影"
+        verbose_name_plural = verbose_name
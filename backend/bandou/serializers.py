@@ -10,7 +10,7 @@ from django.utils import timezone
 import os
 import time
 from bandou.models import Movie, User, Rating, Comments
-from bandou.utils.get_redis_instance import get_redis_instance
+from bandou.utils.reset_code_store import get_reset_code
 from bandou.utils.validate_image_file import validate_image_file
 
 # 使用Django的默认存储后端（已配置为OSS）
@@ -29,7 +29,8 @@ class MovieModelSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Movie
-        fields = "__all__"
+        exclude = ['genres']  # 类别关联由type字段自动同步
+        read_only_fields = ['rating_sum', 'rating_count', 'douban_id']  # 由评分信号和爬虫维护
 
     def validate_cover(self, value):  # noqa
         """电影封面图片文件校验"""
@@ -271,15 +272,13 @@ class PasswordResetConfirmSerializer(serializers.Serializer):
     def validate(self, attrs):
         email = attrs['email']
         code = attrs['code']
-        redis_client = get_redis_instance()
         # 检查用户是否存在
         User = get_user_model()
         if not User.objects.filter(email=email).exists():
             raise serializers.ValidationError({'email': '该邮箱未注册'})
 
         # 从 Redis 获取验证码和生成时间
-        stored_code = redis_client.get(f"reset_code:{email}")
-        stored_timestamp = float(redis_client.get(f"reset_timestamp:{email}"))
+        stored_code, stored_timestamp = get_reset_code(email)
 
         if not stored_code or not stored_timestamp:
             raise serializers.ValidationError({'code': '验证码无效或已过期'})
@@ -377,12 +376,17 @@ class CommentSerializer(serializers.ModelSerializer):
 
     def get_rating(self, obj):  # noqa
         """获取该评论用户对该电影的评分"""
+        ratings = self.context.get('ratings')  # 评论树批量加载时预先查好的{用户id: 评分}
+        if ratings is not None:
+            return ratings.get(obj.user_id)
         rating = Rating.objects.filter(user=obj.user, movie=obj.movie).first()
         return rating.rating if rating else None
 
     def get_replies(self, obj):  # noqa
         """获取该评论的回复"""
-        replies = obj.replies.all()
+        replies = getattr(obj, 'thread_replies', None)  # 评论树批量加载时已在内存中组装好的回复
+        if replies is None:
+            replies = obj.replies.all()
         return CommentSerializer(replies, many=True, context=self.context).data
 
     def get_parent_comment_user(self, obj):  # noqa
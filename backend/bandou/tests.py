@@ -1,3 +1,1717 @@
-from django.test import TestCase
+import asyncio
+import base64
+import importlib
+import json
+import os
+import tempfile
+import math
+import re
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import numpy as np
+import redis
+import requests
+from scipy import sparse
+
+from django.apps import apps as django_apps
+from django.core import mail
+from django.db import connection
+from django.http import HttpResponse
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+try:
+    import fakeredis
+except ImportError:  # 未安装fakeredis时跳过依赖redis的测试
+    fakeredis = None
+
+from bandou.views import MovieRankingView, MovieRecommendationView
+from bandou.models import Movie, User, Rating, Comments, MovieRatingHistogram, MovieNeighbor, SimilarMovie, \
+    RatingDailyRollup, Genre, MovieGenre
+from bandou.utils.genres import split_movie_type, sync_genres_for_movies
+from bandou.utils.image_cache import CachedImage
+from bandou.utils.image_proxy import image_flights
+from bandou.utils.item_cf import compute_item_neighbors
+from bandou.utils.rating_aggregates import rebuild_rating_histograms, rebuild_rating_rollups
+from bandou.utils.rating_import import import_ratings
+from bandou.utils.recommenders import recommend_from_item_neighbors
+from bandou.utils.score_buckets import SCORE_BUCKETS, NO_SCORE_BUCKET, score_bucket
+from bandou.utils import als, content_similarity, live_index, movie_ranking, rating_buffer, recommendation_cache, \
+    reset_code_store, search_index, suggest_index, trending, user_rating_cache
+from bandou.utils.suggest_index import MovieSuggestIndex, pinyin_keys
+
+real_async_sleep = asyncio.sleep
+
+
+def create_movie(**kwargs):
+    defaults = {
+        'title': '测试电影',
+        'brief_introduction': '简介',
+        'cover_url': 'https://example.com/cover.jpg',
+        'release_time': date(2025, 1, 1),
+        'director': '导演',
+        'starring': '主演',
+        'type': '剧情',
+    }
+    defaults.update(kwargs)
+    return Movie.objects.create(**defaults)
+
+
+class MovieCommentThreadTests(TestCase):
+    """电影评论树加载"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.movie = create_movie()
+        self.comment_time = timezone.now()
+        self.user_count = 0
+
+    def add_comments(self, count):
+        """添加count个用户，每人一条顶级评论、一条回复和一条楼中楼回复，并对电影评分"""
+        for _ in range(count):
+            i = self.user_count
+            self.user_count += 1
+            user = User.objects.create(username=f'user{i}', email=f'user{i}@example.com')
+            Rating.objects.create(user=user, movie=self.movie, rating=(i % 5) + 1)
+            root = Comments.objects.create(user=user, movie=self.movie, comment=f'评论{i}',
+                                           comment_time=self.comment_time + timedelta(seconds=i))
+            reply = Comments.objects.create(user=user, movie=self.movie, comment=f'回复{i}',
+                                            comment_time=self.comment_time, parent_comment=root)
+            Comments.objects.create(user=user, movie=self.movie, comment=f'楼中楼{i}',
+                                    comment_time=self.comment_time, parent_comment=reply)
+
+    def get_thread(self):
+        response = self.client.get(f'/api/movies/{self.movie.id}/comments/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_thread_structure(self):
+        self.add_comments(2)
+        thread = self.get_thread()
+
+        self.assertEqual([item['comment'] for item in thread], ['评论0', '评论1'])
+        reply = thread[1]['replies'][0]
+        self.assertEqual(reply['comment'], '回复1')
+        self.assertEqual(reply['parent_comment_user'], thread[1]['username'])
+        self.assertEqual(reply['rating'], 2)
+        self.assertEqual(reply['replies'][0]['comment'], '楼中楼1')
+        self.assertEqual(thread[0]['movie_title'], self.movie.title)
+
+    def test_query_count_does_not_grow_with_thread(self):
+        self.add_comments(3)
+        with self.assertNumQueries(2):
+            self.get_thread()
+
+        self.add_comments(30)
+        with self.assertNumQueries(2):
+            thread = self.get_thread()
+        self.assertEqual(len(thread), 33)
+
+
+class RatingDistributionTests(TestCase):
+    """后台各分类评分分布统计"""
+
+    def setUp(self):
+        self.client = APIClient()
+        admin = User.objects.create(username='admin', email='admin@example.com', is_staff=True)
+        self.client.force_authenticate(admin)
+
+    def add_movies(self, count):
+        types = ['喜剧', '动作 / 喜剧', '剧情 / 动作 / 科幻']
+        scores = [None, 0.5, 1.0, 2.4, 3.9, 4.5, 5.0]
+        for i in range(count):
+            create_movie(title=f'电影{Movie.objects.count()}', type=types[i % len(types)],
+                         score=scores[i % len(scores)])
+
+    def expected_distribution(self):
+        """逐部电影统计的参照结果，分段与搜索分面相同"""
+        labels = [label for label, _, _ in SCORE_BUCKETS] + [NO_SCORE_BUCKET]
+        expected = {}
+        for movie in Movie.objects.all():
+            for name in {t.strip() for t in movie.type.split('/')}:
+                counts = expected.setdefault(name, [0] * len(labels))
+                counts[labels.index(score_bucket(movie.score))] += 1
+        return expected
+
+    def get_distribution(self):
+        response = self.client.get('/bandou/admin/movies/rating_distribution/')
+        self.assertEqual(response.status_code, 200)
+        return {
+            item['category']: [bucket['count'] for bucket in item['distribution']]
+            for item in response.json()
+        }
+
+    def test_distribution_matches_per_movie_counts(self):
+        self.add_movies(20)
+        response = self.client.get('/bandou/admin/movies/rating_distribution/').json()
+        self.assertEqual([bucket['range'] for bucket in response[0]['distribution']],
+                         ['0-1', '1-2', '2-3', '3-4', '4-5', '无评分'])
+        self.assertEqual(self.get_distribution(), self.expected_distribution())
+        # 满分电影计入4-5分段
+        top_rated = Movie.objects.filter(type__contains='喜剧', score__gte=4).count()
+        self.assertEqual(self.get_distribution()['喜剧'][4], top_rated)
+
+    def test_single_query_regardless_of_movie_count(self):
+        for count in (10, 100, 500):
+            self.add_movies(count)
+            with self.assertNumQueries(1):
+                distribution = self.get_distribution()
+            self.assertEqual(distribution, self.expected_distribution())
+
+
+class RatingHistogramTests(TestCase):
+    """电影评分分布的增量维护"""
+
+    def setUp(self):
+        self.movie = create_movie()
+        self.user = User.objects.create(username='rater', email='rater@example.com')
+
+    def buckets(self):
+        histogram = MovieRatingHistogram.objects.filter(movie=self.movie).first()
+        if histogram is None:
+            return {}
+        return {bucket: getattr(histogram, f'bucket_{bucket}') for bucket in range(11)
+                if getattr(histogram, f'bucket_{bucket}')}
+
+    def test_create_update_delete(self):
+        rating = Rating.objects.create(user=self.user, movie=self.movie, rating=4)
+        self.assertEqual(self.buckets(), {8: 1})
+
+        rating.rating = 2.5
+        rating.save()
+        self.assertEqual(self.buckets(), {5: 1})
+
+        rating.delete()
+        self.assertEqual(self.buckets(), {})
+
+    def test_stats_endpoint_reads_histogram(self):
+        other = User.objects.create(username='other', email='other@example.com')
+        Rating.objects.create(user=self.user, movie=self.movie, rating=4)
+        Rating.objects.create(user=other, movie=self.movie, rating=3)
+
+        response = APIClient().get(f'/api/movies/{self.movie.id}/rating_stats/').json()
+        self.assertEqual(response['avg_rating'], 3.5)
+        self.assertEqual(response['rating_count'], 2)
+        counts = {item['rating']: item['count'] for item in response['distribution'] if item['count']}
+        self.assertEqual(counts, {3.0: 1, 4.0: 1})
+
+    def test_deleting_movie_with_ratings(self):
+        Rating.objects.create(user=self.user, movie=self.movie, rating=4)
+        movie_id = self.movie.id
+        self.movie.delete()
+        self.assertFalse(MovieRatingHistogram.objects.filter(movie_id=movie_id).exists())
+        self.assertFalse(Rating.objects.filter(movie_id=movie_id).exists())
+
+    def test_drift_does_not_break_updates(self):
+        rating = Rating.objects.create(user=self.user, movie=self.movie, rating=4)
+        MovieRatingHistogram.objects.filter(movie=self.movie).update(bucket_8=0)
+
+        rating.rating = 3
+        rating.save()
+        self.assertEqual(self.buckets(), {6: 1})
+        rating.delete()
+        self.assertEqual(self.buckets(), {})
+
+        Rating.objects.create(user=self.user, movie=self.movie, rating=5)
+        MovieRatingHistogram.objects.filter(movie=self.movie).update(bucket_10=0, bucket_2=3)
+        self.assertEqual(rebuild_rating_histograms([self.movie.id]), 1)
+        self.assertEqual(self.buckets(), {10: 1})
+
+
+class CurrentUserRatingTests(TestCase):
+    """当前用户对电影评分"""
+
+    def setUp(self):
+        self.movie = create_movie()
+        self.user = User.objects.create(username='rater', email='rater@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/movies/{self.movie.id}/my_rating/'
+
+    def test_form_encoded_rerating(self):
+        self.assertEqual(self.client.post(self.url, {'rating': '4'}).status_code, 201)
+        self.assertEqual(self.client.post(self.url, {'rating': '3'}).status_code, 200)
+
+        self.movie.refresh_from_db()
+        self.assertEqual((self.movie.rating_sum, self.movie.rating_count, self.movie.score), (3, 1, 3))
+        self.assertEqual(self.client.get(self.url).json()['rating'], 3)
+
+    def test_invalid_rating(self):
+        for value in ('abc', '6', '-1', ''):
+            self.assertEqual(self.client.post(self.url, {'rating': value}).status_code, 400)
+        self.assertFalse(Rating.objects.exists())
+
+
+class SaveMoviesTests(TestCase):
+    """爬虫批量入库电影"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='rater', email='rater@example.com')
+
+    def scraped(self, douban_id, **kwargs):
+        movie = {
+            'douban_id': douban_id,
+            'title': f'电影{douban_id}',
+            'brief_introduction': '新简介',
+            'cover_url': 'https://example.com/new.jpg',
+            'score': 4.5,
+            'release_time': date(2025, 1, 1),
+            'director': '导演',
+            'starring': '主演',
+            'type': '剧情',
+        }
+        movie.update(kwargs)
+        return movie
+
+    def test_user_score_not_overwritten(self):
+        from bandou.utils.spider_for_movies import save_movies
+
+        rated = create_movie(douban_id='1', title='电影1', score=4.5)
+        Rating.objects.create(user=self.user, movie=rated, rating=2)
+        # 读取已有电影之后、upsert之前才收到首个用户评分
+        racing = create_movie(douban_id='2', title='电影2', score=4.5)
+        bulk_create = Movie.objects.bulk_create
+
+        def rate_then_bulk_create(objs, **kwargs):
+            if not Rating.objects.filter(movie=racing).exists():
+                Rating.objects.create(user=self.user, movie=racing, rating=3)
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Movie.objects, 'bulk_create', side_effect=rate_then_bulk_create):
+            save_movies([self.scraped('1'), self.scraped('2'), self.scraped('3')])
+
+        rated.refresh_from_db()
+        racing.refresh_from_db()
+        self.assertEqual((rated.score, rated.brief_introduction), (2, '新简介'))
+        self.assertEqual((racing.score, racing.brief_introduction), (3, '新简介'))
+        self.assertEqual(Movie.objects.get(douban_id='3').score, 4.5)
+
+    def test_content_changed_ids(self):
+        from bandou.utils.signals import movies_bulk_saved
+        from bandou.utils.spider_for_movies import save_movies
+
+        unchanged = create_movie(douban_id='1', title='电影1', brief_introduction='新简介')
+        changed = create_movie(douban_id='2', title='电影2', brief_introduction='新简介', director='旧导演')
+        receiver = mock.Mock()
+        movies_bulk_saved.connect(receiver, sender=Movie)
+        self.addCleanup(movies_bulk_saved.disconnect, receiver, sender=Movie)
+
+        other_cover = 'https://example.com/other.jpg'
+        save_movies([self.scraped('1', cover_url=other_cover), self.scraped('2'), self.scraped('3')])
+        kwargs = receiver.call_args.kwargs
+        created = Movie.objects.get(douban_id='3')
+        self.assertEqual(set(kwargs['movie_ids']), {unchanged.id, changed.id, created.id})
+        self.assertEqual(set(kwargs['content_changed_ids']), {changed.id, created.id})
+
+    def test_missing_douban_id_logged(self):
+        from bandou.utils.spider_for_movies import save_movies
+
+        with self.assertLogs('bandou.utils.spider_for_movies', 'WARNING') as logs:
+            save_movies([self.scraped(None, title='无id电影')])
+        self.assertIn('无id电影', logs.output[0])
+        self.assertFalse(Movie.objects.exists())
+
+
+class MovieSuggestIndexTests(TestCase):
+    """片名、导演、演员的前缀补全"""
+
+    def setUp(self):
+        self.interstellar = create_movie(title='星际穿越', director='克里斯托弗·诺兰', starring='马修·麦康纳 / 安妮·海瑟薇',
+                                         score=4.5)
+        self.inception = create_movie(title='盗梦空间', director='克里斯托弗·诺兰', starring='莱昂纳多', score=4.8)
+        self.index = MovieSuggestIndex()
+
+    def texts(self, prefix, limit=10):
+        return [(item['text'], item['type']) for item in self.index.suggest(prefix, limit)]
+
+    def test_sorted_entries(self):
+        self.index.rebuild()
+        self.assertEqual(self.index._keys, sorted(self.index._keys))
+        self.assertEqual(len(self.index._keys), len(self.index._entries))
+        self.assertIn(('诺兰', self.inception.id, 'director', '克里斯托弗·诺兰'),
+                      [(key, *entry) for key, entry in zip(self.index._keys, self.index._entries)])
+
+    def test_prefix_and_person_merge(self):
+        self.assertEqual(self.texts('星际'), [('星际穿越', 'title')])
+        self.assertEqual(self.texts('诺兰'), [('克里斯托弗·诺兰', 'director')])
+        self.assertEqual(self.index.suggest('诺兰')[0]['movie_id'], self.inception.id)
+        self.assertEqual(self.texts('海瑟'), [('安妮·海瑟薇', 'actor')])
+        self.assertEqual(self.texts(''), [])
+
+    @skipUnless(pinyin_keys('星际穿越'), '未安装pypinyin')
+    def test_pinyin_keys(self):
+        self.assertEqual(pinyin_keys('星际穿越'), ('xingjichuanyue', 'xjcy'))
+        self.assertEqual(pinyin_keys('Inception'), ())
+        self.assertEqual(self.texts('xjcy'), [('星际穿越', 'title')])
+        self.assertEqual(self.texts('daomeng'), [('盗梦空间', 'title')])
+
+    def test_delta_merge(self):
+        self.index.rebuild()
+        Movie.objects.filter(pk=self.interstellar.pk).update(title='星际迷航', score=5)
+        new = create_movie(title='星球大战', director='乔治·卢卡斯', starring='无', score=4)
+        self.index.mark_changed({self.interstellar.id, new.id})
+
+        self.assertEqual(self.texts('星'), [('星际迷航', 'title'), ('星球大战', 'title')])
+        self.assertEqual(self.texts('星际穿'), [])
+        self.assertEqual(self.index._removed, {self.interstellar.id, new.id})
+        self.assertEqual(self.index._delta_keys, sorted(self.index._delta_keys))
+
+        self.index.mark_changed({new.id})
+        self.assertEqual(self.texts('星球'), [('星球大战', 'title')])
+        self.index.rebuild()
+        self.assertEqual((self.index._removed, self.index._delta_keys), (set(), []))
+        self.assertEqual(self.texts('星'), [('星际迷航', 'title'), ('星球大战', 'title')])
+
+    def test_heavy_prefixes(self):
+        for number in range(6):
+            create_movie(title=f'诺言{number}', director='无', starring='无', score=number / 2)
+        with mock.patch.object(suggest_index, 'HEAVY_PREFIX_RANGE', 3):
+            self.index.rebuild()
+        self.assertIn('诺', self.index._heavy_prefixes)
+        expected = [('克里斯托弗·诺兰', 'director'), ('诺言5', 'title'), ('诺言4', 'title')]
+        self.assertEqual(self.texts('诺', 3), expected)
+
+        # 预先计算的排名中被移除的电影由增量条目补上
+        Movie.objects.filter(title='诺言5').update(score=0)
+        self.index.mark_changed(set(Movie.objects.filter(title='诺言5').values_list('id', flat=True)))
+        self.assertEqual(self.texts('诺', 3), [expected[0], expected[2], ('诺言3', 'title')])
+
+
+@skipUnless(fakeredis, '未安装fakeredis')
+class RatingBufferFlushTests(TestCase):
+    """缓冲评分批量写入数据库"""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        for patcher in (mock.patch.object(rating_buffer, 'get_redis_instance', return_value=self.redis),
+                        mock.patch.object(rating_buffer, 'rating_flusher')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.movie = create_movie()
+        self.users = [User.objects.create(username=f'rater{i}', email=f'rater{i}@example.com') for i in range(2)]
+
+    def movie_stats(self):
+        self.movie.refresh_from_db()
+        return self.movie.rating_sum, self.movie.rating_count, self.movie.score
+
+    def buckets(self):
+        histogram = MovieRatingHistogram.objects.get(movie=self.movie)
+        return {bucket: getattr(histogram, f'bucket_{bucket}') for bucket in range(11)
+                if getattr(histogram, f'bucket_{bucket}')}
+
+    def test_flush_is_idempotent(self):
+        Rating.objects.create(user=self.users[1], movie=self.movie, rating=1)
+        rating_buffer.buffer_rating(self.users[0].id, self.movie.id, 4)
+        rating_buffer.buffer_rating(self.users[1].id, self.movie.id, 3)
+        batch = self.redis.hgetall(rating_buffer.PENDING_KEY)
+
+        self.assertEqual(rating_buffer.flush_rating_buffer(), 2)
+        self.assertEqual(self.movie_stats(), (7, 2, 3.5))
+        self.assertFalse(self.redis.exists(rating_buffer.FLUSHING_KEY, rating_buffer.FLUSH_LOCK_KEY))
+
+        # 写入成功后删除批次前失败，下次重新写入同一批
+        self.redis.hset(rating_buffer.FLUSHING_KEY, mapping=batch)
+        self.assertEqual(rating_buffer.flush_rating_buffer(), 2)
+        self.assertEqual(self.movie_stats(), (7, 2, 3.5))
+        self.assertEqual(self.buckets(), {6: 1, 8: 1})
+
+    def test_failed_flush_is_retried(self):
+        rating_buffer.buffer_rating(self.users[0].id, self.movie.id, 4)
+        with mock.patch.object(rating_buffer, '_write_ratings', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                rating_buffer.flush_rating_buffer()
+        self.assertFalse(Rating.objects.exists())
+        self.assertFalse(self.redis.exists(rating_buffer.FLUSH_LOCK_KEY))
+
+        # 失败期间的新评分留在待写入哈希中，先写入上一批
+        rating_buffer.buffer_rating(self.users[1].id, self.movie.id, 2)
+        self.assertEqual(rating_buffer.flush_rating_buffer(), 1)
+        self.assertEqual(rating_buffer.flush_rating_buffer(), 1)
+        self.assertEqual(self.movie_stats(), (6, 2, 3))
+
+    def test_newer_direct_write_kept(self):
+        rating_buffer.buffer_rating(self.users[0].id, self.movie.id, 4)
+        # redis故障期间直接写入数据库的更新评分
+        Rating.objects.create(user=self.users[0], movie=self.movie, rating=2)
+        self.assertEqual(rating_buffer.flush_rating_buffer(), 1)
+        self.assertEqual(Rating.objects.get().rating, 2)
+        self.assertEqual(self.movie_stats(), (2, 1, 2))
+
+    def test_lock(self):
+        rating_buffer.buffer_rating(self.users[0].id, self.movie.id, 4)
+        other = self.redis.lock(rating_buffer.FLUSH_LOCK_KEY, timeout=rating_buffer.FLUSH_LOCK_TTL)
+        self.assertTrue(other.acquire(blocking=False))
+        self.assertEqual(rating_buffer.flush_rating_buffer(), 0)
+        other.release()
+
+        # 写入超过锁的有效期、锁已被其他进程持有时，不删除其他进程的锁
+        def expire_lock(entries):
+            self.redis.set(rating_buffer.FLUSH_LOCK_KEY, 'other')
+            return [], [], []
+
+        with mock.patch.object(rating_buffer, '_write_ratings', side_effect=expire_lock):
+            with self.assertLogs('bandou.utils.rating_buffer', 'WARNING'):
+                rating_buffer.flush_rating_buffer()
+        self.assertEqual(self.redis.get(rating_buffer.FLUSH_LOCK_KEY), 'other')
+
+
+@skipUnless(fakeredis, '未安装fakeredis')
+class UserRatingCacheTests(TestCase):
+    """用户评分缓存的读取与写回"""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch.object(user_rating_cache, 'get_redis_instance', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(username='rater', email='rater@example.com')
+        self.rated, self.unrated = create_movie(), create_movie()
+        Rating.objects.create(user=self.user, movie=self.rated, rating=4)
+        self.key = user_rating_cache.USER_KEY.format(self.user.id)
+
+    def test_backfill(self):
+        movie_ids = [self.rated.id, self.unrated.id]
+        self.assertEqual(user_rating_cache.get_user_ratings(self.user.id, movie_ids), {self.rated.id: 4})
+        self.assertEqual(self.redis.hgetall(self.key), {str(self.rated.id): '4.0', str(self.unrated.id): ''})
+        with self.assertNumQueries(0):
+            self.assertEqual(user_rating_cache.get_user_ratings(self.user.id, movie_ids), {self.rated.id: 4})
+
+    def test_no_backfill_after_invalidate(self):
+        # 读取数据库之后、写回之前缓存被删除，旧评分不能写回缓存
+        def load_then_invalidate(*args, **kwargs):
+            user_rating_cache.invalidate_user_ratings([self.user.id])
+            return [(self.rated.id, 1.0)]
+
+        with mock.patch.object(user_rating_cache, 'Rating') as rating_model:
+            rating_model.objects.filter.return_value.values_list.side_effect = load_then_invalidate
+            self.assertEqual(user_rating_cache.get_user_ratings(self.user.id, [self.rated.id]), {self.rated.id: 1})
+        self.assertFalse(self.redis.exists(self.key))
+
+        self.assertEqual(user_rating_cache.get_user_ratings(self.user.id, [self.rated.id]), {self.rated.id: 4})
+        self.assertEqual(self.redis.hgetall(self.key), {str(self.rated.id): '4.0'})
+
+
+@skipUnless(fakeredis, '未安装fakeredis')
+class MovieRankingTests(TestCase):
+    """redis榜单与数据库排序一致"""
+
+    def setUp(self):
+        patcher = mock.patch.object(movie_ranking, 'get_redis_instance',
+                                    return_value=fakeredis.FakeRedis(decode_responses=True))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        scores = [4.5, None, 3, 4.5, None, 0, 2]
+        for number, score in enumerate(scores):
+            create_movie(title=f'电影{number}', score=score, release_time=date(2020, 1, 1) + timedelta(days=number % 3))
+
+    def test_pages_match_database(self):
+        movie_ranking.rebuild_movie_rankings()
+        total = Movie.objects.count()
+        for ordering in ('score', '-score', 'release_time', '-release_time'):
+            for offset, limit in ((0, total), (0, 3), (3, 3), (5, 4)):
+                movies, count = MovieRankingView().get_ranking_from_db(ordering, offset, limit)
+                self.assertEqual(movie_ranking.get_ranking_page(ordering, offset, limit),
+                                 ([movie.id for movie in movies], count), (ordering, offset, limit))
+
+    def test_missing_values_last(self):
+        self.assertEqual(movie_ranking._ranking_scores(None, None),
+                         {'score': movie_ranking.NO_SCORE, 'release_time': movie_ranking.NO_RELEASE_TIME})
+        movie_ranking.rebuild_movie_rankings()
+        movie_ids, _ = movie_ranking.get_ranking_page('score', 0, 10)
+        self.assertEqual([Movie.objects.get(pk=movie_id).score for movie_id in movie_ids[-2:]], [None, None])
+
+
+@skipUnless(fakeredis, '未安装fakeredis')
+class RecommendationCacheTests(TestCase):
+    """推荐缓存的版本校验"""
+
+    url = '/api/movies/recommend/'
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch.object(recommendation_cache, 'get_redis_instance', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.movie = create_movie()
+        self.user = User.objects.create(username='rater', email='rater@example.com')
+        Rating.objects.create(user=self.user, movie=self.movie, rating=4)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.key = recommendation_cache.USER_KEY.format(self.user.id)
+
+    def test_cached_until_invalidated(self):
+        with mock.patch.object(MovieRecommendationView, 'get_personalized_recommendations', return_value=[]) as compute:
+            self.client.get(self.url)
+            self.client.get(self.url)
+            self.assertEqual(compute.call_count, 1)
+            recommendation_cache.invalidate_user_recommendations(self.user.id)
+            self.client.get(self.url)
+            self.assertEqual(compute.call_count, 2)
+        self.assertTrue(self.redis.exists(self.key))
+
+    def test_stale_result_not_cached(self):
+        # 计算推荐期间用户评分发生变化，按旧评分计算的结果不写入缓存
+        def rate_while_computing(user):
+            recommendation_cache.invalidate_user_recommendations(user.id)
+            return [self.movie]
+
+        with mock.patch.object(MovieRecommendationView, 'get_personalized_recommendations',
+                               side_effect=rate_while_computing):
+            response = self.client.get(self.url)
+        self.assertEqual([movie['id'] for movie in response.json()], [self.movie.id])
+        self.assertFalse(self.redis.exists(self.key))
+
+
+class ItemNeighborTests(TestCase):
+    """基于评分的电影近邻计算与推荐"""
+
+    ratings = np.array([
+        [5, 4, 0, 1, 0],
+        [4, 5, 1, 0, 2],
+        [2, 1, 0, 0, 0],  # 整体打分偏低的用户
+        [0, 2, 5, 4, 5],
+        [1, 0, 4, 5, 4],
+    ], dtype=np.float64)
+
+    def neighbors(self, neighbors=10, shrinkage=2, block_size=2):
+        sources, targets, similarities = compute_item_neighbors(
+            sparse.csr_matrix(self.ratings), neighbors, shrinkage, block_size
+        )
+        return {(source, target): similarity for source, target, similarity in zip(sources, targets, similarities)}
+
+    def expected(self, shrinkage=2):
+        mask = self.ratings > 0
+        means = self.ratings.sum(axis=1) / mask.sum(axis=1)
+        centered = (self.ratings - means[:, None]) * mask
+        norms = np.linalg.norm(centered, axis=0)
+        co_counts = mask.T.astype(float) @ mask
+        similarity = centered.T @ centered / np.outer(norms, norms) * co_counts / (co_counts + shrinkage)
+        return {(i, j): similarity[i, j] for i in range(5) for j in range(5) if i != j and similarity[i, j] > 0}
+
+    def test_adjusted_cosine(self):
+        result = self.neighbors()
+        expected = self.expected()
+        self.assertEqual(set(result), set(expected))
+        for pair, similarity in expected.items():
+            self.assertAlmostEqual(result[pair], similarity)
+        # 打分偏低的用户不会让所有电影都相似
+        self.assertNotIn((0, 2), result)
+        self.assertEqual(self.neighbors(block_size=5), result)
+
+    def test_top_neighbors(self):
+        result = self.neighbors(neighbors=1)
+        expected = self.expected()
+        for source in {source for source, _ in expected}:
+            targets = [target for (movie, target) in result if movie == source]
+            self.assertEqual(len(targets), 1)
+            best = max((similarity, target) for (movie, target), similarity in expected.items() if movie == source)
+            self.assertEqual(targets[0], best[1])
+
+    def test_recommend_from_neighbors(self):
+        movies = [create_movie(title=f'电影{number}') for number in range(4)]
+        MovieNeighbor.objects.bulk_create([
+            MovieNeighbor(movie=movies[0], neighbor=movies[2], similarity=0.9),
+            MovieNeighbor(movie=movies[0], neighbor=movies[1], similarity=0.5),
+            MovieNeighbor(movie=movies[1], neighbor=movies[3], similarity=0.8),
+            MovieNeighbor(movie=movies[1], neighbor=movies[2], similarity=0.2),
+        ])
+        # 喜欢电影0、不喜欢电影1：与电影1相似的电影3得分为负，不推荐
+        user_ratings = [(movies[0].id, 5), (movies[1].id, 1)]
+        self.assertEqual(recommend_from_item_neighbors(user_ratings), [movies[2].id])
+        self.assertEqual(recommend_from_item_neighbors([(movies[0].id, 5)], limit=1), [movies[2].id])
+        self.assertEqual(recommend_from_item_neighbors([]), [])
+
+
+class ALSTests(TestCase):
+    """ALS矩阵分解的训练与新用户的即时求解"""
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        users, movies, factors = 40, 30, 3
+        self.dense = 3 + rng.normal(scale=0.6, size=(users, factors)) @ rng.normal(scale=0.6, size=(factors, movies))
+        self.mask = rng.random((users, movies)) < 0.6
+        self.matrix = sparse.csr_matrix(self.dense * self.mask)
+
+    @staticmethod
+    def loss(matrix, user_factors, item_factors, mean, regularization):
+        """ALS的目标函数：已评分位置的平方误差 + 按评分数加权的L2正则"""
+        coo = matrix.tocoo()
+        errors = coo.data - mean - np.sum(user_factors[coo.row] * item_factors[coo.col], axis=1)
+        user_counts, item_counts = np.diff(matrix.tocsr().indptr), np.diff(matrix.tocsc().indptr)
+        penalty = user_counts @ np.sum(user_factors ** 2, axis=1) + item_counts @ np.sum(item_factors ** 2, axis=1)
+        return float(errors @ errors + regularization * penalty)
+
+    def test_loss_decreases(self):
+        losses = [self.loss(self.matrix, *als.train_als(self.matrix, 3, 0.01, iterations), 0.01)
+                  for iterations in (1, 2, 5, 15)]
+        self.assertEqual(losses, sorted(losses, reverse=True))
+        self.assertLess(losses[-1], losses[0] / 2)
+        # 同一种子的训练结果确定
+        first, second = als.train_als(self.matrix, 3, 0.01, 2), als.train_als(self.matrix, 3, 0.01, 2)
+        np.testing.assert_array_equal(first[0], second[0])
+
+    def test_chunked_solve_matches(self):
+        fixed = np.random.default_rng(0).normal(size=(self.matrix.shape[1], 3))
+        expected = als._solve_factors(self.matrix, fixed, 0.1)
+        with mock.patch.object(als, 'SOLVE_CHUNK_RATINGS', 7), mock.patch.object(als, 'LARGE_ROW_RATINGS', 15):
+            np.testing.assert_allclose(als._solve_factors(self.matrix, fixed, 0.1), expected)
+
+    def test_fold_in_unseen_user(self):
+        # 最后一位用户不参与训练，按其评分即时求解用户因子
+        train = self.matrix[:-1]
+        user_factors, item_factors, mean = als.train_als(train, 3, 0.01, 15)
+        with tempfile.TemporaryDirectory() as model_dir:
+            user_ids, movie_ids = np.arange(1, train.shape[0] + 1), np.arange(1, train.shape[1] + 1)
+            version = als.save_model(model_dir, user_ids, movie_ids, user_factors, item_factors, mean, 0.01)
+            with open(os.path.join(model_dir, als.MANIFEST_NAME), encoding='utf-8') as f:
+                model = als.ALSModel(os.path.join(model_dir, version), json.load(f))
+
+            np.testing.assert_allclose(model.user_vector(1, {}), user_factors[0], rtol=1e-5)
+            self.assertIsNone(model.user_vector(999, {999: 5}))
+
+            rated = np.flatnonzero(self.mask[-1])
+            ratings = {int(movie_ids[column]): float(self.dense[-1, column]) for column in rated}
+            vector = model.user_vector(999, ratings)
+            unrated = np.flatnonzero(~self.mask[-1])
+            predicted = mean + np.asarray(model.item_factors)[unrated] @ vector
+            rmse = np.sqrt(np.mean((predicted - self.dense[-1, unrated]) ** 2))
+            self.assertLess(rmse, 0.3)
+
+            recommended = model.recommend(999, ratings, 5)
+            self.assertEqual(len(recommended), 5)
+            self.assertFalse(set(recommended) & set(ratings))
+            self.assertEqual(recommended[0], int(movie_ids[unrated[np.argmax(predicted)]]))
+
+
+class SearchIndexTests(TestCase):
+    """全文搜索的切词与BM25排序"""
+
+    def setUp(self):
+        self.index = search_index.MovieSearchIndex()
+
+    def search(self, query):
+        return [movie_id for movie_id, _ in self.index.search(query).hits]
+
+    def test_tokenize(self):
+        tokenize = search_index.tokenize
+        self.assertEqual(list(tokenize('Spider-Man 2')), ['spider', 'man', '2'])
+        self.assertEqual(list(tokenize('ＳＰＩＤＥＲ')), ['spider'])
+        self.assertEqual(list(tokenize('星际穿越')), ['星', '际', '穿', '越', '星际', '际穿', '穿越'])
+        self.assertEqual(list(tokenize('星际穿越', unigrams=False)), ['星际', '际穿', '穿越'])
+        self.assertEqual(list(tokenize('爱 Love', unigrams=False)), ['爱', 'love'])
+        self.assertEqual(search_index.tokenize_query('穿越 穿越者'), ['穿越', '越者'])
+
+    def test_whole_words_and_synopsis_unigrams(self):
+        spider = create_movie(title='Spider-Man', brief_introduction='蜘蛛侠')
+        star = create_movie(title='星际穿越', brief_introduction='宇宙')
+        synopsis = create_movie(title='火星救援', brief_introduction='宇航员被困在星球上')
+        # 英文按整词索引，不做前缀匹配
+        self.assertEqual(self.search('spider'), [spider.id])
+        self.assertEqual(self.search('spi'), [])
+        # 简介不索引单字：单字查询只命中片名等短字段
+        self.assertEqual(self.search('星'), [star.id, synopsis.id])
+        self.assertEqual(self.search('球'), [])
+        self.assertEqual(self.search('星球'), [synopsis.id])
+        # 要求命中全部查询词
+        self.assertEqual(self.search('星际 宇宙'), [star.id])
+
+    def test_bm25_ranking(self):
+        in_synopsis = create_movie(title='归途', brief_introduction='一段关于时间旅行的故事')
+        in_title = create_movie(title='时间旅行者', brief_introduction='故事')
+        long_title = create_movie(title='时间旅行者的妻子与漫长的告别', brief_introduction='故事')
+        create_movie(title='无关', brief_introduction='故事')
+        hits = self.index.search('时间旅行').hits
+        # 片名权重高于简介，较短的片名得分更高
+        self.assertEqual([movie_id for movie_id, _ in hits], [in_title.id, long_title.id, in_synopsis.id])
+
+        movies = list(Movie.objects.values_list('id', *search_index.INDEX_COLUMNS[:len(search_index.SEARCH_FIELDS)]))
+        terms = search_index.tokenize_query('时间旅行')
+        for movie_id, score in hits:
+            self.assertAlmostEqual(score, self.reference_score(movies, movie_id, terms))
+
+    def test_paging(self):
+        movies = [create_movie(title=f'时间旅行{"者" * number}', brief_introduction='故事') for number in range(7)]
+        create_movie(title='无关', brief_introduction='故事')
+        full = self.index.search('时间旅行')
+        self.assertEqual(full.total, 7)
+        self.assertEqual({movie_id for movie_id, _ in full.hits}, {movie.id for movie in movies})
+        for offset, limit in ((0, 3), (3, 3), (6, 3), (9, 3)):
+            result = self.index.search('时间旅行', offset=offset, limit=limit)
+            self.assertEqual(result.hits, full.hits[offset:offset + limit])
+            self.assertEqual(result.total, 7)
+
+    def test_search_view_pages(self):
+        movies = [create_movie(title=f'时间旅行{"者" * number}', director=f'导演{number % 2}') for number in range(5)]
+        client = APIClient()
+        with mock.patch('bandou.views.movie_search_index', search_index.MovieSearchIndex()):
+            response = client.get('/movies/search/', {'keyword': '时间旅行', 'page_size': 2, 'facets': 1}).json()
+            self.assertEqual(response['count'], 5)
+            self.assertEqual(response['facets']['director'][0], {'value': '导演0', 'count': 3})
+            movie_ids = [movie['id'] for movie in response['results']]
+            while response['next']:
+                response = client.get(response['next']).json()
+                movie_ids += [movie['id'] for movie in response['results']]
+                self.assertEqual(response['count'], 5)
+            self.assertEqual(movie_ids, self.search('时间旅行'))
+            self.assertEqual(sorted(movie_ids), [movie.id for movie in movies])
+
+            response = client.get('/movies/search/', {'keyword': '不存在'}).json()
+            self.assertEqual((response['count'], response['results'], response['next']), (0, [], None))
+            response = client.get('/movies/search/', {'page_size': 4}).json()
+            self.assertEqual((response['count'], len(response['results'])), (5, 4))
+
+    def test_change_feed_polled_without_lock(self):
+        movie = create_movie(title='星际穿越')
+        clock = mock.Mock(return_value=100.0)
+        polls = []
+
+        def poll():
+            # 读取redis变更记录时不持有索引锁
+            self.assertFalse(self.index._lock._is_owned())
+            polls.append(clock())
+            return {movie.id}
+
+        self.assertEqual(self.search('星际'), [movie.id])
+        Movie.objects.filter(pk=movie.pk).update(title='火星救援')  # 模拟其他进程的修改
+        self.index._next_poll_at = 0
+        with mock.patch.object(live_index.time, 'monotonic', clock), \
+                mock.patch.object(self.index._cursor, 'poll', side_effect=poll):
+            self.assertEqual(self.search('火星'), [movie.id])
+            # 读取间隔内的查询不再读取
+            clock.return_value += self.index.poll_interval() / 2
+            self.assertEqual(self.search('火星'), [movie.id])
+            self.assertEqual(polls, [100.0])
+            clock.return_value += self.index.poll_interval()
+            self.search('火星')
+            self.assertEqual(len(polls), 2)
+
+    @staticmethod
+    def reference_score(movies, movie_id, terms):
+        """逐字段按BM25公式计算的参照得分"""
+        fields, k1, b = search_index.SEARCH_FIELDS, search_index.BM25_K1, search_index.BM25_B
+        counts = {row[0]: [Counter(search_index.tokenize(value, unigrams)) for value, (_, _, unigrams)
+                           in zip(row[1:], fields)] for row in movies}
+        averages = [max(sum(sum(doc[index].values()) for doc in counts.values()) / len(movies), 1.0)
+                    for index in range(len(fields))]
+        score = 0.0
+        for term in terms:
+            df = sum(1 for doc in counts.values() if any(term in field for field in doc))
+            idf = math.log(1 + (len(movies) - df + 0.5) / (df + 0.5))
+            for index, (_, boost, _) in enumerate(fields):
+                freq = counts[movie_id][index][term]
+                norm = 1 - b + b * sum(counts[movie_id][index].values()) / averages[index]
+                score += idf * boost * freq * (k1 + 1) / (freq + k1 * norm)
+        return score
+
+
+class SimilarMoviesTests(TestCase):
+    """基于内容的相似电影计算与增量更新"""
+
+    def setUp(self):
+        patcher = mock.patch.object(content_similarity, '_content_model', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def similar(self, movie):
+        return dict(SimilarMovie.objects.filter(movie=movie).values_list('similar_id', 'similarity'))
+
+    def test_compute_matches_dense(self):
+        rng = np.random.default_rng(7)
+        dense = rng.random((9, 6)) * (rng.random((9, 6)) < 0.4)
+        dense /= np.maximum(np.linalg.norm(dense, axis=1, keepdims=True), 1e-12)
+        matrix = sparse.csr_matrix(dense.astype(np.float32))
+        expected = dense @ dense.T
+        np.fill_diagonal(expected, 0)
+
+        positions = np.array([0, 3, 4, 8])
+        with mock.patch.object(content_similarity, 'BLOCK_ENTRIES', 20):  # 每块2行
+            (rows, columns, values), (all_rows, all_columns, all_values) = \
+                content_similarity.compute_similar_movies(matrix, positions, 3, reverse=True)
+        for position in positions:
+            top = sorted((-value, column) for column, value in enumerate(expected[position]) if value > 0)[:3]
+            self.assertEqual(sorted(columns[rows == position]), sorted(column for _, column in top))
+        np.testing.assert_allclose(values, expected[rows, columns], rtol=1e-5)
+        # reverse返回这些行与全部电影的全部正相似度
+        self.assertEqual(len(all_values), int((expected[positions] > 0).sum()))
+        np.testing.assert_allclose(all_values, expected[all_rows, all_columns], rtol=1e-5)
+
+    def test_incremental_update(self):
+        nolan = [create_movie(title=f'诺兰{number}', brief_introduction='', director='诺兰',
+                              starring=f'演员{number} / 凯恩', type='科幻') for number in range(3)]
+        others = [create_movie(title=f'喜剧{number}', brief_introduction='', director='周星驰',
+                               starring=f'吴孟达 / 演员{number + 3}', type='喜剧') for number in range(3)]
+        with self.settings(RECOMMENDATION={'SIMILAR_MOVIES_PER_MOVIE': 3}):
+            content_similarity.build_similar_movies()
+            self.assertIn(others[1].id, self.similar(others[0]))
+
+            # 喜剧0改为诺兰执导的科幻片：它自己的列表重新计算，诺兰电影的列表补入它，喜剧电影的列表去掉它
+            Movie.objects.filter(pk=others[0].pk).update(director='诺兰', starring='凯恩', type='科幻')
+            content_similarity.update_similar_movies([others[0].id])
+
+        # 增量更新沿用整体构建时的特征表和逆文档频率
+        model = content_similarity._content_model
+        matrix, movie_ids = model.matrix, model.movie_ids
+        position = int(np.flatnonzero(movie_ids == others[0].id)[0])
+        rows, columns, values = content_similarity.compute_similar_movies(matrix, np.array([position]), 3)
+        expected = {int(movie_ids[column]): value for column, value in zip(columns, values)}
+        self.assertEqual(self.similar(others[0]).keys(), expected.keys())
+        for movie_id, similarity in self.similar(others[0]).items():
+            self.assertAlmostEqual(similarity, expected[movie_id], places=5)
+        self.assertTrue(set(self.similar(others[0])) <= {movie.id for movie in nolan})
+        for movie in nolan:
+            self.assertIn(others[0].id, self.similar(movie))
+            self.assertLessEqual(len(self.similar(movie)), 3)
+        for movie in others[1:]:
+            self.assertNotIn(others[0].id, self.similar(movie))
+
+    def test_incremental_update_vectorizes_only_changed_movies(self):
+        movies = [create_movie(title=f'诺兰{number}', brief_introduction='梦境盗贼潜入梦境', director='诺兰',
+                               starring=f'演员{number} / 凯恩', type='科幻') for number in range(4)]
+        with self.settings(RECOMMENDATION={'SIMILAR_MOVIES_PER_MOVIE': 3}):
+            content_similarity.build_similar_movies()
+            built = content_similarity._content_model
+            # 同样的特征表和逆文档频率下，单独计算的特征向量与整体构建的结果一致
+            rows = Movie.objects.filter(pk=movies[1].pk).values_list('id', *content_similarity.CONTENT_FIELDS)
+            matrix, _ = built.vectorize(rows)
+            position = int(np.flatnonzero(built.movie_ids == movies[1].id)[0])
+            np.testing.assert_allclose(matrix.toarray(), built.matrix[position].toarray(), rtol=1e-6)
+
+            Movie.objects.filter(pk=movies[0].pk).update(starring='凯恩')
+            movies[3].delete()
+            added = create_movie(title='诺兰4', brief_introduction='梦境', director='诺兰', starring='凯恩', type='科幻')
+            with mock.patch.object(content_similarity, 'movie_features',
+                                   wraps=content_similarity.movie_features) as features, \
+                    mock.patch.object(content_similarity, 'load_content_model') as load:
+                content_similarity.update_similar_movies([movies[0].id])
+            load.assert_not_called()
+            # 只切分变更的电影和模型中还没有的电影
+            self.assertEqual(features.call_count, 2)
+
+        model = content_similarity._content_model
+        self.assertIsNot(model, built)
+        self.assertIs(model.vocabulary, built.vocabulary)
+        self.assertEqual(list(model.movie_ids), [movies[0].id, movies[1].id, movies[2].id, added.id])
+        self.assertIn(added.id, self.similar(movies[0]))
+        self.assertIn(movies[0].id, self.similar(added))
+        self.assertFalse(SimilarMovie.objects.filter(similar_id=movies[3].id).exists())
+
+    def test_incremental_update_rebuilds_stale_model(self):
+        movies = [create_movie(title=f'电影{number}', director='诺兰') for number in range(2)]
+        with mock.patch.object(content_similarity, 'load_content_model',
+                               wraps=content_similarity.load_content_model) as load:
+            content_similarity.update_similar_movies([movies[0].id])  # 本进程还没有模型
+            self.assertEqual(load.call_count, 1)
+            content_similarity.update_similar_movies([movies[0].id])
+            self.assertEqual(load.call_count, 1)
+            with self.settings(RECOMMENDATION={'SIMILAR_MOVIES_MODEL_MAX_AGE': 0}):
+                content_similarity.update_similar_movies([movies[0].id])
+            self.assertEqual(load.call_count, 2)
+        self.assertIn(movies[1].id, self.similar(movies[0]))
+
+    def test_save_schedules_only_content_changes(self):
+        movie = create_movie()
+        with mock.patch('bandou.utils.signals.similar_movies_updater') as updater:
+            with self.captureOnCommitCallbacks(execute=True):
+                movie.cover_url = 'https://example.com/other.jpg'
+                movie.save()
+                movie.director = '导演'  # 值未变化
+                movie.save()
+                movie.save(update_fields=['score'])
+            updater.schedule.assert_not_called()
+
+            with self.captureOnCommitCallbacks(execute=True):
+                movie.director = '新导演'
+                movie.save()
+                created = create_movie()
+            self.assertEqual([call.args[0] for call in updater.schedule.call_args_list], [[movie.id], [created.id]])
+
+    def test_updater_debounce(self):
+        updater = content_similarity.SimilarMoviesUpdater()
+        with mock.patch.object(content_similarity, 'update_similar_movies') as update, \
+                self.settings(RECOMMENDATION={'SIMILAR_MOVIES_DEBOUNCE': 0.05}):
+            updater.schedule([1])
+            updater.schedule([2, 1])
+            for _ in range(100):
+                if not updater._running:
+                    break
+                time.sleep(0.01)
+        update.assert_called_once_with({1, 2})
+
+
+class RatingImportTests(TestCase):
+    """批量导入评分"""
+
+    def setUp(self):
+        self.movies = [create_movie(title=f'电影{number}') for number in range(2)]
+        self.users = [User.objects.create(username=f'rater{i}', email=f'rater{i}@example.com') for i in range(3)]
+        Rating.objects.create(user=self.users[0], movie=self.movies[0], rating=2)
+        Rating.objects.create(user=self.users[1], movie=self.movies[0], rating=3)
+
+    def ratings(self):
+        return {(user_id, movie_id): rating
+                for user_id, movie_id, rating in Rating.objects.values_list('user_id', 'movie_id', 'rating')}
+
+    def test_import(self):
+        users, movies = self.users, self.movies
+        rows = [
+            (users[0].id, movies[0].id, '4'),  # 修改
+            (users[1].id, movies[0].id, 3),  # 未变化
+            (users[2].id, movies[0].id, 5),  # 新增
+            (users[2].id, movies[1].id, 1),
+            (users[2].id, movies[1].id, 2),  # 同一用户对同一电影以最后一条为准
+            (users[2].id, 999, 4),  # 电影不存在
+            (users[2].id, movies[1].id, 6),  # 评分无效
+            ('abc', movies[1].id, 3),
+        ]
+        result = import_ratings(rows, chunk_size=3)
+        self.assertEqual(result, {'created': 2, 'updated': 1, 'unchanged': 1, 'skipped': 3, 'movies': 2})
+        self.assertEqual(self.ratings(), {
+            (users[0].id, movies[0].id): 4, (users[1].id, movies[0].id): 3,
+            (users[2].id, movies[0].id): 5, (users[2].id, movies[1].id): 2,
+        })
+        movies[0].refresh_from_db()
+        self.assertEqual((movies[0].rating_sum, movies[0].rating_count, movies[0].score), (12, 3, 4))
+        self.assertEqual(MovieRatingHistogram.objects.get(movie=movies[0]).bucket_10, 1)
+
+        # 重复导入同一批评分没有变化
+        self.assertEqual(import_ratings(rows)['unchanged'], 4)
+
+    def test_concurrent_insert_is_upserted(self):
+        # 读取已有评分之后、写入之前，其他请求新增了同一用户对同一电影的评分
+        bulk_create = Rating.objects.bulk_create
+
+        def insert_then_bulk_create(objs, **kwargs):
+            Rating.objects.create(user=self.users[2], movie=self.movies[1], rating=1)
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Rating.objects, 'bulk_create', side_effect=insert_then_bulk_create):
+            import_ratings([(self.users[2].id, self.movies[1].id, 4)])
+        self.assertEqual(self.ratings()[(self.users[2].id, self.movies[1].id)], 4)
+        self.movies[1].refresh_from_db()
+        self.assertEqual((self.movies[1].rating_sum, self.movies[1].rating_count), (4, 1))
+
+    def test_bulk_rating_view(self):
+        client = APIClient()
+        client.force_authenticate(self.users[2])
+        response = client.post('/api/ratings/bulk/', {'ratings': [{'movie': self.movies[1].id, 'rating': 4}]},
+                               format='json')
+        self.assertEqual(response.json()['created'], 1)
+        other_user = {'user': self.users[0].id, 'movie': self.movies[1].id, 'rating': 4}
+        response = client.post('/api/ratings/bulk/', {'ratings': [other_user]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class ProxyImageTests(TestCase):
+    """电影封面代理"""
+
+    def test_evicted_cache_falls_back_to_upstream(self):
+        # 读取缓存元数据之后图片文件被淘汰
+        evicted = CachedImage(path='/nonexistent/cover.img', content_type='image/jpeg', etag='"abc"', size=1)
+        url = 'https://img.example.com/cover.jpg'
+        self.addCleanup(image_flights.end, url)  # 上游请求被替换，不会结束本次获取
+        with mock.patch('bandou.views.image_cache') as cache, \
+                mock.patch('bandou.views._stream_upstream_image', return_value=HttpResponse(b'upstream')) as stream:
+            cache.get.return_value = evicted
+            cache.is_failed.return_value = False
+            response = self.client.get('/proxy_image/', {'url': url})
+            self.assertEqual(response.content, b'upstream')
+            stream.assert_called_once()
+
+            # 客户端已有同一图片时仍返回304
+            response = self.client.get('/proxy_image/', {'url': url}, HTTP_IF_NONE_MATCH='"abc"')
+            self.assertEqual(response.status_code, 304)
+
+
+class RatingTrendTests(TestCase):
+    """后台电影评分趋势与每日评分汇总的增量维护"""
+
+    today = date(2025, 6, 10)
+
+    def setUp(self):
+        self.client = APIClient()
+        admin = User.objects.create(username='admin', email='admin@example.com', is_staff=True)
+        self.client.force_authenticate(admin)
+        self.movie = create_movie()
+        self.users = [User.objects.create(username=f'rater{i}', email=f'rater{i}@example.com') for i in range(2)]
+
+    def on_day(self, days_ago):
+        """把当前时间固定为days_ago天前的中午，评分时间和趋势窗口都以此为准"""
+        now = datetime.combine(self.today - timedelta(days=days_ago), datetime.min.time()) + timedelta(hours=12)
+        return mock.patch('django.utils.timezone.now', return_value=now)
+
+    def rollups(self):
+        return {
+            (self.today - day).days: (total, count)
+            for day, total, count in RatingDailyRollup.objects.filter(movie=self.movie).values_list(
+                'day', 'rating_sum', 'rating_count') if count
+        }
+
+    def get_trend(self, days=None, days_ago=0):
+        params = {} if days is None else {'days': days}
+        with self.on_day(days_ago):
+            return self.client.get(f'/bandou/admin/movies/{self.movie.id}/rating_trend/', params)
+
+    def series(self, days=None, days_ago=0):
+        response = self.get_trend(days, days_ago)
+        self.assertEqual(response.status_code, 200)
+        return [(item['date'], item['avg_rating'], item['rating_count']) for item in response.json()]
+
+    def expected(self, values, days_ago=0):
+        """values按日期从早到晚排列，每项为 (平均评分, 人数)"""
+        end = self.today - timedelta(days=days_ago)
+        return [
+            ((end - timedelta(days=len(values) - 1 - offset)).strftime('%Y-%m-%d'), avg_rating, count)
+            for offset, (avg_rating, count) in enumerate(values)
+        ]
+
+    def test_days_windows(self):
+        for days in (7, 30, 90, 365):
+            self.assertEqual(len(self.series(days)), days)
+        self.assertEqual(len(self.series()), 7)
+        for days in ('14', '0', '-7', 'abc', ''):
+            self.assertEqual(self.get_trend(days).status_code, 400, days)
+
+    def test_no_ratings(self):
+        self.assertEqual(self.series(), self.expected([(None, 0)] * 7))
+
+    def test_trend_follows_rating_changes(self):
+        with self.on_day(3):
+            first = Rating.objects.create(user=self.users[0], movie=self.movie, rating=4)
+            second = Rating.objects.create(user=self.users[1], movie=self.movie, rating=2)
+        self.assertEqual(self.rollups(), {3: (6, 2)})
+
+        # 重新评分后评分时间变为当天，评分从原日期的汇总移到新日期
+        with self.on_day(1):
+            first.rating = 5
+            first.save()
+        self.assertEqual(self.rollups(), {3: (2, 1), 1: (5, 1)})
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.score, 3.5)
+
+        # 窗口内第一个有评分的日期之前使用电影当前评分，没有评分的日期沿用前一天，最后一天使用电影当前评分
+        self.assertEqual(self.series(days_ago=1), self.expected(
+            [(3.5, 0)] * 4 + [(2.0, 1), (2.0, 0), (3.5, 1)], days_ago=1))
+        self.assertEqual(self.series(), self.expected(
+            [(3.5, 0)] * 3 + [(2.0, 1), (2.0, 0), (5.0, 1), (3.5, 0)]))
+
+        with self.on_day(0):
+            second.delete()
+        self.assertEqual(self.rollups(), {1: (5, 1)})
+        self.assertEqual(self.series(), self.expected([(5.0, 0)] * 5 + [(5.0, 1), (5.0, 0)]))
+
+    def test_window_without_ratings(self):
+        with self.on_day(20):
+            Rating.objects.create(user=self.users[0], movie=self.movie, rating=4)
+        with self.on_day(10):
+            Rating.objects.create(user=self.users[1], movie=self.movie, rating=3)
+        self.assertEqual(self.rollups(), {20: (4, 1), 10: (3, 1)})
+
+        self.assertEqual(self.series(), self.expected([(3.5, 0)] * 7))
+        self.assertEqual(self.series(30), self.expected(
+            [(3.5, 0)] * 9 + [(4.0, 1)] + [(4.0, 0)] * 9 + [(3.0, 1)] + [(3.0, 0)] * 9 + [(3.5, 0)]))
+
+    def test_rebuild_matches_incremental(self):
+        with self.on_day(2):
+            rating = Rating.objects.create(user=self.users[0], movie=self.movie, rating=4)
+            Rating.objects.create(user=self.users[1], movie=self.movie, rating=1)
+        with self.on_day(0):
+            rating.rating = 2
+            rating.save()
+        expected = self.rollups()
+        self.assertEqual(expected, {2: (1, 1), 0: (2, 1)})
+        self.assertEqual(rebuild_rating_rollups([self.movie.id]), 0)
+
+        RatingDailyRollup.objects.filter(movie=self.movie).update(rating_sum=9, rating_count=3)
+        self.assertEqual(rebuild_rating_rollups([self.movie.id]), 2)
+        self.assertEqual(self.rollups(), expected)
+
+
+class MovieListPaginationTests(TestCase):
+    """电影列表游标分页"""
+
+    url = '/bandou/movies/'
+
+    def setUp(self):
+        self.client = APIClient()
+        types = ['喜剧', '动作 / 喜剧', '剧情', '科幻']
+        scores = [4.5, None, 3, 4.5, None, 3, 4.5, 2, None, 3, 4.5, None, 0]
+        for number, score in enumerate(scores):
+            create_movie(title=f'电影{number}', score=score, type=types[number % len(types)],
+                         release_time=date(2020, 1, 1) + timedelta(days=number % 3))
+
+    def expected(self, ordering, movies=None):
+        """逐部电影排序的参照结果：空值排在最后，并列时按id"""
+        field, descending = ordering.lstrip('-'), ordering.startswith('-')
+        movies = list(Movie.objects.all() if movies is None else movies)
+        present = sorted((movie for movie in movies if getattr(movie, field) is not None),
+                         key=lambda movie: (getattr(movie, field), movie.id), reverse=descending)
+        missing = sorted((movie for movie in movies if getattr(movie, field) is None),
+                         key=lambda movie: movie.id, reverse=descending)
+        return [movie.id for movie in present + missing]
+
+    def get(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def walk(self, **params):
+        """从第一页开始沿next链接翻到最后一页，返回依次得到的电影id"""
+        movie_ids, page = [], self.get(self.url, params)
+        while True:
+            movie_ids += [movie['id'] for movie in page['results']]
+            if page['next'] is None:
+                return movie_ids
+            page = self.get(page['next'])
+
+    def first_cursor(self, **params):
+        return parse_qs(urlparse(self.get(self.url, {'page_size': 2, **params})['next']).query)['cursor'][0]
+
+    def encode(self, position):
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def test_walk_all_pages(self):
+        for ordering in ('-score', 'score', 'release_time', '-release_time'):
+            # 每页1条时每个并列值和空值段的边界都会落在页面之间
+            for page_size in (1, 3, 4, 100):
+                movie_ids = self.walk(ordering=ordering, page_size=page_size)
+                self.assertEqual(movie_ids, self.expected(ordering), (ordering, page_size))
+        self.assertEqual(self.walk(), self.expected('-score'))
+
+    def test_no_count_query(self):
+        next_url = self.get(self.url, {'page_size': 5})['next']
+        with self.assertNumQueries(1):
+            page = self.get(next_url)
+        self.assertEqual(len(page['results']), 5)
+        self.assertEqual(set(page), {'next', 'results'})
+
+    def test_category_paging(self):
+        comedies = Movie.objects.filter(type__contains='喜剧')
+        self.assertEqual(self.walk(category='comedy', page_size=2), self.expected('-score', comedies))
+        others = Movie.objects.exclude(type__contains='喜剧').exclude(type__contains='动作').exclude(
+            type__contains='剧情')
+        self.assertTrue(others)
+        self.assertEqual(self.walk(category='other', ordering='release_time', page_size=1),
+                         self.expected('release_time', others))
+
+    def test_malformed_cursor(self):
+        valid = {'o': '-score', 'q': '', 'v': 4.5, 'id': 1}
+        cursors = [
+            'abc', '!!!', '%%%', base64.urlsafe_b64encode(b'\xff\xfe').decode(), self.encode([1, 2]),
+            self.encode('id'), self.encode({'o': '-score', 'v': 4.5, 'id': 1}),
+            self.encode({**valid, 'id': 'x'}), self.encode({**valid, 'v': 'abc'}), self.encode({**valid, 'v': {}}),
+        ]
+        for cursor in cursors:
+            self.assertEqual(self.client.get(self.url, {'cursor': cursor}).status_code, 400, cursor)
+        tampered = self.encode({**valid, 'o': 'release_time', 'v': 'not-a-date'})
+        self.assertEqual(self.client.get(self.url, {'cursor': tampered, 'ordering': 'release_time'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'cursor': self.encode(valid)}).status_code, 200)
+
+    def test_cursor_bound_to_ordering_and_category(self):
+        cursor = self.first_cursor(ordering='score')
+        self.assertEqual(self.client.get(self.url, {'cursor': cursor, 'ordering': 'score'}).status_code, 200)
+        self.assertEqual(self.client.get(self.url, {'cursor': cursor, 'ordering': '-score'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'cursor': cursor, 'ordering': 'score',
+                                                    'category': 'comedy'}).status_code, 400)
+
+        cursor = self.first_cursor(category='comedy')
+        self.assertEqual(self.client.get(self.url, {'cursor': cursor, 'category': 'comedy',
+                                                    'page_size': 5}).status_code, 200)
+        self.assertEqual(self.client.get(self.url, {'cursor': cursor, 'category': 'action'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'cursor': cursor}).status_code, 400)
+
+
+@skipUnless(fakeredis, '未安装fakeredis')
+class TrendingTests(TestCase):
+    """按时间衰减的热门电影榜"""
+
+    url = '/movies/trending/'
+    half_life = 72 * 3600
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch.object(trending, 'get_redis_instance', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        clock = mock.patch.object(trending, 'time')
+        self.clock = clock.start()
+        self.addCleanup(clock.stop)
+        self.now = 1_700_000_000.0
+        self.clock.time.side_effect = lambda: self.now
+        self.movies = [create_movie(title=f'电影{number}') for number in range(5)]
+
+    def heats(self):
+        entries, _ = trending.get_trending_page(0, 100)
+        return dict(entries)
+
+    def test_event_weights_and_decay(self):
+        first, second, third = (movie.id for movie in self.movies[:3])
+        trending.record_movie_event(first, trending.EVENT_RATING)
+        trending.record_movie_event(second, trending.EVENT_COMMENT)
+        trending.record_movie_event(third, trending.EVENT_VIEW, 3)
+        self.assertEqual(self.heats(), {first: 3, second: 2, third: 3})
+
+        # 经过一个半衰期热度减半，之后发生的事件按原权重累计
+        self.now += self.half_life
+        self.assertEqual(self.heats(), {first: 1.5, second: 1, third: 1.5})
+        trending.record_movie_event(second, trending.EVENT_VIEW)
+        self.assertEqual(self.heats(), {first: 1.5, second: 2, third: 1.5})
+
+        self.now += self.half_life / 2
+        self.assertAlmostEqual(self.heats()[second], 2 / math.sqrt(2), places=3)
+
+    def test_renormalize_drops_cold_movies(self):
+        hot, cold = self.movies[0].id, self.movies[1].id
+        trending.record_movie_event(hot, trending.EVENT_RATING)
+        trending.record_movie_event(cold, trending.EVENT_VIEW)
+
+        # 7个半衰期后热度为 3/128 和 1/128，后者低于最小热度0.01
+        self.now += 7 * self.half_life
+        self.assertEqual(trending.renormalize_trending(), 1)
+        self.assertEqual(float(self.redis.get(trending.EPOCH_KEY)), self.now)
+        self.assertAlmostEqual(self.redis.zscore(trending.TRENDING_KEY, hot), 3 / 128)
+        self.assertEqual(self.heats(), {hot: round(3 / 128, 4)})
+
+        # 重新归一化不改变之后事件的累计方式
+        trending.record_movie_event(hot, trending.EVENT_VIEW)
+        self.assertEqual(self.heats(), {hot: round(1 + 3 / 128, 4)})
+
+    def test_paged_view(self):
+        for weight, movie in enumerate(self.movies, 1):
+            trending.record_movie_event(movie.id, trending.EVENT_VIEW, weight)
+        # 已删除的电影仍在榜单中时跳过，但计入总数
+        trending.record_movie_event(999999, trending.EVENT_VIEW, 10)
+
+        response = APIClient().get(self.url, {'page': 2, 'page_size': 2}).json()
+        self.assertEqual(response['count'], 6)
+        self.assertEqual([(item['id'], item['heat']) for item in response['results']],
+                         [(self.movies[3].id, 4), (self.movies[2].id, 3)])
+        self.assertIn('page=3', response['next'])
+        self.assertIn('page=1', response['previous'])
+
+        response = APIClient().get(self.url, {'page_size': 2}).json()
+        self.assertEqual([item['id'] for item in response['results']], [self.movies[4].id])
+        self.assertIsNone(response['previous'])
+
+    def test_detail_view_counts_as_view(self):
+        movie = self.movies[0]
+        APIClient().get(f'/bandou/movies/{movie.id}/')
+        APIClient().get(f'/bandou/movies/{movie.id}/')
+        self.assertEqual(self.heats(), {movie.id: 2})
+
+    def test_redis_unavailable(self):
+        with mock.patch.object(trending, 'get_redis_instance', side_effect=redis.ConnectionError('down')):
+            with self.assertLogs('bandou.utils.trending', 'WARNING') as logs:
+                trending.record_movie_event(self.movies[0].id, trending.EVENT_RATING)
+                self.assertIsNone(trending.renormalize_trending())
+                response = APIClient().get(self.url)
+        self.assertEqual(len(logs.output), 3)
+        self.assertEqual(response.status_code, 503)
+
+
+class GenreTests(TestCase):
+    """电影类别关联的同步、分类筛选与后台统计"""
+
+    def setUp(self):
+        self.client = APIClient()
+        admin = User.objects.create(username='admin', email='admin@example.com', is_staff=True)
+        self.client.force_authenticate(admin)
+
+    def genre_names(self, movie):
+        return set(movie.genres.values_list('name', flat=True))
+
+    def test_split_movie_type(self):
+        self.assertEqual(split_movie_type('剧情 / 动作 / 剧情 '), ['剧情', '动作'])
+        self.assertEqual(split_movie_type(' / 喜剧/ /'), ['喜剧'])
+        self.assertEqual(split_movie_type('科幻/悬疑'), ['科幻', '悬疑'])
+        self.assertEqual(split_movie_type(''), [])
+        self.assertEqual(split_movie_type(None), [])
+
+    def test_resync_on_type_change(self):
+        movie = create_movie(type='剧情 / 动作')
+        self.assertEqual(self.genre_names(movie), {'剧情', '动作'})
+
+        movie.type = '喜剧 / 动作'
+        movie.save()
+        self.assertEqual(self.genre_names(movie), {'喜剧', '动作'})
+        self.assertEqual(MovieGenre.objects.filter(movie=movie).count(), 2)
+
+        # 只修改其他字段时不重新同步
+        Movie.objects.filter(pk=movie.pk).update(type='科幻')
+        movie.title = '新片名'
+        movie.save(update_fields=['title'])
+        self.assertEqual(self.genre_names(movie), {'喜剧', '动作'})
+
+        movie.type = ''
+        movie.save()
+        self.assertEqual(self.genre_names(movie), set())
+
+    def test_bulk_sync_removes_stale_links(self):
+        movies = [create_movie(type='剧情'), create_movie(type='动作 / 剧情'), create_movie(type='喜剧')]
+        Movie.objects.filter(pk=movies[0].pk).update(type='科幻 / 悬疑')
+        Movie.objects.filter(pk=movies[1].pk).update(type='动作')
+        Movie.objects.filter(pk=movies[2].pk).update(type='')
+
+        with CaptureQueriesContext(connection) as queries:
+            sync_genres_for_movies([movie.id for movie in movies])
+        self.assertEqual([self.genre_names(movie) for movie in movies], [{'科幻', '悬疑'}, {'动作'}, set()])
+        self.assertEqual(Genre.objects.filter(name='科幻').count(), 1)
+
+        # 语句数与电影数量无关
+        more = [create_movie(type=f'类别{number} / 剧情') for number in range(30)]
+        with self.assertNumQueries(len(queries)):
+            sync_genres_for_movies([movie.id for movie in more])
+        self.assertEqual(self.genre_names(more[-1]), {'类别29', '剧情'})
+
+    def test_category_filter(self):
+        comedy = create_movie(type='喜剧')
+        action_comedy = create_movie(type='动作 / 喜剧')
+        drama = create_movie(type='剧情 / 爱情')
+        others = [create_movie(type='科幻 / 悬疑'), create_movie(type='')]
+
+        def listed(category):
+            response = self.client.get('/bandou/movies/', {'category': category, 'page_size': 100})
+            return {movie['id'] for movie in response.json()['results']}
+
+        self.assertEqual(listed('comedy'), {comedy.id, action_comedy.id})
+        self.assertEqual(listed('action'), {action_comedy.id})
+        self.assertEqual(listed('drama'), {drama.id})
+        self.assertEqual(listed('other'), {movie.id for movie in others})
+        # 未知分类不做筛选
+        self.assertEqual(len(listed('unknown')), 5)
+
+    def test_admin_aggregates(self):
+        create_movie(type='喜剧')
+        create_movie(type='动作 / 喜剧')
+        movie = create_movie(type='剧情')
+        movie.type = '科幻'
+        movie.save()  # 剧情不再有关联的电影，不出现在统计中
+
+        response = self.client.get('/bandou/admin/movies/category_stats/').json()
+        self.assertEqual(response[0], {'category': '喜剧', 'count': 2})
+        self.assertEqual(sorted((item['category'], item['count']) for item in response),
+                         [('动作', 1), ('喜剧', 2), ('科幻', 1)])
+        self.assertEqual(self.client.get('/bandou/admin/movies/movie_types/').json(), sorted(['动作', '喜剧', '科幻']))
+
+    def test_populate_migration(self):
+        movies = [create_movie(type='剧情 / 动作'), create_movie(type=' 喜剧 /  /剧情'), create_movie(type='')]
+        expected = [self.genre_names(movie) for movie in movies]
+        MovieGenre.objects.all().delete()
+        Genre.objects.all().delete()
+
+        migration = importlib.import_module('bandou.migrations.0016_populate_movie_genres')
+        migration.populate_movie_genres(django_apps, None)
+        self.assertEqual([self.genre_names(movie) for movie in movies], expected)
+        self.assertEqual(expected, [{'剧情', '动作'}, {'喜剧', '剧情'}, set()])
+        self.assertEqual(Genre.objects.count(), 3)
+
+
+class TopRatedByCategoryTests(TestCase):
+    """冷启动推荐：各分类高分电影"""
+
+    def test_single_query_with_ties(self):
+        # 同分时按id，属于多个类别的电影只保留一次
+        both = create_movie(title='双类别', type='剧情 / 动作', score=5)
+        drama = create_movie(title='剧情', type='剧情', score=4.5)
+        action = create_movie(title='动作', type='动作', score=4.5)
+        comedy_first = create_movie(title='喜剧1', type='喜剧', score=4.5)
+        comedy_second = create_movie(title='喜剧2', type='喜剧', score=4.5)
+        create_movie(title='喜剧3', type='喜剧', score=4.5)
+        create_movie(title='无评分', type='剧情 / 喜剧', score=None)
+        create_movie(title='低分', type='剧情', score=1)
+
+        view = MovieRecommendationView()
+        with self.assertNumQueries(1):
+            movies = view.get_top_rated_by_category()
+        # 先取各类别的第1名，再取第2名，同一名次按评分降序、同分按id
+        self.assertEqual([movie.id for movie in movies],
+                         [both.id, comedy_first.id, drama.id, action.id, comedy_second.id])
+
+        with self.assertNumQueries(1):
+            movies = view.get_top_rated_by_category(limit=3)
+        self.assertEqual([movie.id for movie in movies], [both.id, comedy_first.id, drama.id])
+
+        with self.assertNumQueries(1):
+            movies = view.get_top_rated_by_category(per_genre=1)
+        self.assertEqual([movie.id for movie in movies], [both.id, comedy_first.id])
+
+
+class FakeClock:
+    """爬虫限速和退避使用的假时钟：sleep只推进时间，不真正等待"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        await real_async_sleep(0)
+
+
+class AsyncCrawlerTests(TestCase):
+    """并发爬虫的限速、代理分配、重试与入库"""
+
+    detail_html = """
+    <html><body>
+    <span property="v:itemreviewed">{title}</span><img rel="v:image" src="https://example.com/{douban_id}.jpg"/>
+    <strong property="v:average">8.0</strong><a rel="v:directedBy">导演</a><a rel="v:starring">主演</a>
+    <span property="v:genre">剧情</span><span property="v:initialReleaseDate">2025-01-01(中国大陆)</span>
+    <span property="v:summary">简介</span>
+    </body></html>
+    """
+
+    def setUp(self):
+        from bandou.utils import spider_for_movies
+        self.spider = spider_for_movies
+        self.clock = FakeClock()
+        for patcher in (mock.patch.object(spider_for_movies, 'time', self.clock),
+                        mock.patch('asyncio.sleep', self.clock.sleep),
+                        mock.patch('random.uniform', lambda low, high: high)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def responses(self, *items):
+        """依次返回的响应：整数为状态码，异常实例直接抛出"""
+        responses = [item if isinstance(item, Exception) else mock.Mock(status_code=item, text=f'HTTP {item}')
+                     for item in items]
+        return mock.patch('requests.get', side_effect=responses)
+
+    def fetch(self, proxies=None):
+        limiter = self.spider.HostRateLimiter(100, 100)
+        proxies = proxies or self.spider.ProxyAllocator(['p1', 'p2'], 1)
+        return asyncio.run(self.spider.fetch_with_retry('https://movie.douban.com/subject/1/', {}, limiter, proxies))
+
+    def test_token_bucket_burst_and_refill(self):
+        async def acquire_times(bucket, count):
+            times = []
+            for _ in range(count):
+                await bucket.acquire()
+                times.append(self.clock.now - start)
+            return times
+
+        start = self.clock.now
+        bucket = self.spider.TokenBucket(rate=2, capacity=3)
+        # 先用完突发的3个令牌，之后每0.5秒补充一个
+        self.assertEqual(asyncio.run(acquire_times(bucket, 5)), [0, 0, 0, 0.5, 1.0])
+
+        # 空闲很久也最多积攒capacity个令牌
+        self.clock.now += 100
+        start = self.clock.now
+        self.assertEqual(asyncio.run(acquire_times(bucket, 4)), [0, 0, 0, 0.5])
+
+    def test_rate_limit_per_host(self):
+        async def acquire_all():
+            limiter = self.spider.HostRateLimiter(1, 1)
+            for url in ('https://a.com/1', 'https://b.com/1', 'https://a.com/2', 'https://b.com/2'):
+                await limiter.acquire(url)
+
+        asyncio.run(acquire_all())
+        self.assertEqual(self.clock.sleeps, [1.0])
+        self.assertEqual(self.clock.now, 1001.0)
+
+    def test_proxy_rotation_and_ban(self):
+        async def allocate():
+            allocator = self.spider.ProxyAllocator(['p1', 'p2'], max_per_proxy=1, ban_seconds=60)
+            used = []
+            # 同时占用时分配到不同的代理，都达到并发上限时等待释放
+            async def acquire_later():
+                async with allocator.acquire() as proxy:
+                    used.append(proxy)
+
+            async with allocator.acquire() as first, allocator.acquire() as second:
+                used.append({first, second})
+                waiting = asyncio.ensure_future(acquire_later())
+                await real_async_sleep(0)
+                self.assertFalse(waiting.done())
+            await waiting
+
+            allocator.ban('p1')
+            for _ in range(5):
+                async with allocator.acquire() as proxy:
+                    used.append(proxy)
+            # 全部被暂停时仍可使用，暂停到期后恢复
+            allocator.ban('p2')
+            async with allocator.acquire() as proxy:
+                used.append(proxy)
+            self.clock.now += 61
+            async with allocator.acquire() as proxy, allocator.acquire() as other:
+                used.append({proxy, other})
+            return used
+
+        with self.assertLogs('bandou.utils.spider_for_movies', 'WARNING'):
+            used = asyncio.run(allocate())
+        self.assertEqual(used[0], {'p1', 'p2'})
+        self.assertIn(used[1], ('p1', 'p2'))
+        self.assertEqual(used[2:7], ['p2'] * 5)
+        self.assertIn(used[7], ('p1', 'p2'))
+        self.assertEqual(used[8], {'p1', 'p2'})
+
+    def test_retry_with_backoff(self):
+        with self.responses(500, 503, 200):
+            self.assertEqual(self.fetch(), 'HTTP 200')
+        self.assertEqual(self.clock.sleeps, [1.0, 2.0])
+
+    def test_give_up_after_retries(self):
+        with self.responses(*[502] * (self.spider.ASYNC_MAX_RETRIES + 1)) as get:
+            with self.assertRaisesMessage(requests.HTTPError, 'HTTP 502'):
+                self.fetch()
+        self.assertEqual(get.call_count, self.spider.ASYNC_MAX_RETRIES + 1)
+        self.assertEqual(self.clock.sleeps, [1.0, 2.0, 4.0])
+
+    def test_client_error_not_retried(self):
+        with self.responses(404) as get:
+            with self.assertRaisesMessage(requests.HTTPError, 'HTTP 404'):
+                self.fetch()
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_failed_proxy_banned_and_rotated(self):
+        proxies = self.spider.ProxyAllocator(['p1', 'p2'], 1)
+        with self.responses(requests.ConnectionError('refused'), 200) as get:
+            with self.assertLogs('bandou.utils.spider_for_movies', 'WARNING'):
+                self.assertEqual(self.fetch(proxies), 'HTTP 200')
+        failed, retried = (call.kwargs['proxies']['https'] for call in get.call_args_list)
+        self.assertNotEqual(failed, retried)
+        self.assertEqual(list(proxies.banned_until), [failed])
+
+    def test_fetch_movies_async_keeps_user_score(self):
+        user = User.objects.create(username='rater', email='rater@example.com')
+        rated = create_movie(douban_id='1', title='电影1', score=4)
+        Rating.objects.create(user=user, movie=rated, rating=2)
+        listing = ''.join(
+            f'<li class="poster"><a class="ticket-btn" href="https://movie.douban.com/subject/{douban_id}/"></a></li>'
+            for douban_id in ('1', '2')
+        )
+
+        def get(url, **kwargs):
+            douban_id = self.spider.extract_douban_id(url)
+            if douban_id is None:
+                return mock.Mock(status_code=200, text=f'<html><body><ul>{listing}</ul></body></html>')
+            return mock.Mock(status_code=200, text=self.detail_html.format(title=f'电影{douban_id}',
+                                                                            douban_id=douban_id))
+
+        with mock.patch('requests.get', side_effect=get), self.assertLogs('bandou.utils.spider_for_movies'):
+            self.spider.fetch_movies_async()
+
+        rated.refresh_from_db()
+        self.assertEqual((rated.score, rated.cover_url), (2, 'https://example.com/1.jpg'))
+        self.assertEqual(Movie.objects.get(douban_id='2').score, 4)
+
+
+@skipUnless(fakeredis, '未安装fakeredis')
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])  # 加快密码哈希
+class PasswordResetTests(TestCase):
+    """密码重置验证码的发送冷却、有效期和一次性使用"""
+
+    request_url = '/api/user/reset_password/request/'
+    confirm_url = '/api/user/reset_password/confirm/'
+    email = 'reset@example.com'
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch.object(reset_code_store, 'get_redis_instance', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(username='reset', email=self.email)
+        self.user.set_password('old-password')
+        self.user.save()
+        self.client = APIClient()
+
+    def request_code(self):
+        return self.client.post(self.request_url, {'email': self.email})
+
+    def sent_code(self):
+        return re.search(r'验证码是: (\d{6})', mail.outbox[-1].body).group(1)
+
+    def confirm(self, code, password='new-password'):
+        return self.client.post(self.confirm_url, {'email': self.email, 'code': code, 'new_password': password})
+
+    def password_changed(self, password='new-password'):
+        self.user.refresh_from_db()
+        return self.user.check_password(password)
+
+    def test_cooldown(self):
+        self.assertEqual(self.request_code().status_code, 200)
+        code = self.sent_code()
+        self.assertEqual(self.request_code().status_code, 429)
+        self.assertEqual(len(mail.outbox), 1)
+
+        cooldown_key, code_key, timestamp_key = reset_code_store._reset_keys(self.email)
+        self.assertAlmostEqual(self.redis.ttl(cooldown_key), reset_code_store.RESET_COOLDOWN_TTL, delta=1)
+        self.assertAlmostEqual(self.redis.ttl(code_key), reset_code_store.RESET_CODE_TTL, delta=1)
+        self.assertAlmostEqual(self.redis.ttl(timestamp_key), reset_code_store.RESET_CODE_TTL, delta=1)
+        # 冷却期内的请求不覆盖已发送的验证码
+        self.assertEqual(self.redis.get(code_key), code)
+
+        # 冷却结束后可以重新发送，新验证码替换旧验证码
+        self.redis.delete(cooldown_key)
+        self.assertEqual(self.request_code().status_code, 200)
+        self.assertEqual(self.redis.get(code_key), self.sent_code())
+
+    def test_code_used_once(self):
+        self.request_code()
+        code = self.sent_code()
+        wrong = '000000' if code != '000000' else '111111'
+        self.assertEqual(self.confirm(wrong).status_code, 400)
+        self.assertFalse(self.password_changed())
+
+        self.assertEqual(self.confirm(code).status_code, 200)
+        self.assertTrue(self.password_changed())
+        self.assertEqual(reset_code_store.get_reset_code(self.email), (None, None))
+
+        response = self.confirm(code, 'another-password')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('code', response.json())
+        self.assertFalse(self.password_changed('another-password'))
+
+    def test_concurrent_use(self):
+        # 校验通过之后、删除之前验证码已被另一个请求使用
+        self.request_code()
+
+        def used_by_other_request(email):
+            reset_code_store.clear_reset_code(email)
+            return reset_code_store.clear_reset_code(email)
+
+        with mock.patch('bandou.views.clear_reset_code', side_effect=used_by_other_request):
+            self.assertEqual(self.confirm(self.sent_code()).status_code, 400)
+        self.assertFalse(self.password_changed())
+
+    def test_code_expires(self):
+        self.request_code()
+        code = self.sent_code()
+        expired = timezone.now() + timedelta(seconds=reset_code_store.RESET_CODE_TTL + 1)
+        with mock.patch('django.utils.timezone.now', return_value=expired):
+            response = self.confirm(code)
+        self.assertEqual(response.json(), {'code': ['验证码已过期']})
+
+        # redis中的验证码到期后被删除
+        _, code_key, timestamp_key = reset_code_store._reset_keys(self.email)
+        self.redis.delete(code_key, timestamp_key)
+        self.assertEqual(self.confirm(code).json(), {'code': ['验证码无效或已过期']})
+        self.assertFalse(self.password_changed())
+
+    def test_redis_unavailable(self):
+        with mock.patch.object(reset_code_store, 'get_redis_instance', side_effect=redis.ConnectionError('down')):
+            with self.assertLogs('bandou.utils.reset_code_store', 'WARNING'):
+                self.assertEqual(self.request_code().status_code, 503)
+                self.assertEqual(self.confirm('123456').status_code, 503)
+        self.assertEqual(mail.outbox, [])
+        self.assertFalse(self.password_changed())
+
+        # 校验通过后删除验证码时redis不可用，不修改密码
+        self.request_code()
+        code = self.sent_code()
+        with mock.patch.object(self.redis, 'pipeline', side_effect=redis.ConnectionError('down')):
+            with self.assertLogs('bandou.utils.reset_code_store', 'WARNING'):
+                self.assertEqual(self.confirm(code).status_code, 503)
+        self.assertFalse(self.password_changed())
+        self.assertEqual(self.confirm(code).status_code, 200)
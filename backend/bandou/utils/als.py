@@ -0,0 +1,245 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from bandou.utils.item_cf import load_rating_matrix
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'current.json'
+KEEP_VERSIONS = 3  # 保留的模型版本数(包括当前版本)，正在使用旧版本的进程仍可读取
+RELOAD_CHECK_INTERVAL = 30  # 服务进程检查新模型的间隔(秒)
+SOLVE_CHUNK_RATINGS = 2000  # 每批求解时涉及的评分数上限，控制批量外积占用的内存
+LARGE_ROW_RATINGS = 2000  # 评分数超过该值的行单独求解
+
+
+def get_als_config():
+    config = getattr(settings, 'RECOMMENDATION', {})
+    return {
+        'factors': config.get('ALS_FACTORS', 32),
+        'regularization': config.get('ALS_REGULARIZATION', 0.1),
+        'iterations': config.get('ALS_ITERATIONS', 10),
+        'model_dir': config.get('ALS_MODEL_DIR', os.path.join(settings.BASE_DIR, '.cache', 'als')),
+    }
+
+
+def _solve_factors(matrix, fixed, regularization):
+    """
+    固定一侧因子，求解另一侧每一行的最小二乘(带按评分数加权的L2正则)
+    对第u行：(Yᵀ Y + λ·n_u·I) x_u = Yᵀ r_u，其中Y为该行评过的列对应的因子。
+    评分较少的行分批处理，用外积的分段求和一次构造整批的法方程再批量求解；评分很多的行(热门电影)单独用矩阵乘法构造
+    :param matrix: csr矩阵，行对应待求解的一侧
+    """
+    rows, factors = matrix.shape[0], fixed.shape[1]
+    solved = np.zeros((rows, factors), dtype=np.float64)
+    identity = np.eye(factors)
+    counts = np.diff(matrix.indptr)
+    large_rows = np.flatnonzero(counts > LARGE_ROW_RATINGS)
+
+    start = 0
+    while start < rows:
+        if counts[start] > LARGE_ROW_RATINGS:
+            low, high = matrix.indptr[start], matrix.indptr[start + 1]
+            vectors = fixed[matrix.indices[low:high]]
+            gram = vectors.T @ vectors + regularization * counts[start] * identity
+            solved[start] = np.linalg.solve(gram, vectors.T @ matrix.data[low:high])
+            start += 1
+            continue
+
+        # 取评分数合计不超过 SOLVE_CHUNK_RATINGS 的若干行(至少一行)，遇到评分很多的行时截止
+        end = int(np.searchsorted(matrix.indptr, matrix.indptr[start] + SOLVE_CHUNK_RATINGS, side='right')) - 1
+        next_large = np.searchsorted(large_rows, start)
+        if next_large < len(large_rows):
+            end = min(end, int(large_rows[next_large]))
+        end = min(max(end, start + 1), rows)
+
+        chunk_rows = np.arange(start, end)[counts[start:end] > 0]
+        if len(chunk_rows):
+            low, high = matrix.indptr[start], matrix.indptr[end]
+            vectors = fixed[matrix.indices[low:high]]
+            values = matrix.data[low:high]
+            segments = matrix.indptr[chunk_rows] - low
+            gram = np.add.reduceat(vectors[:, :, None] * vectors[:, None, :], segments, axis=0)
+            rhs = np.add.reduceat(vectors * values[:, None], segments, axis=0)
+            gram += regularization * counts[chunk_rows][:, None, None] * identity
+            solved[chunk_rows] = np.linalg.solve(gram, rhs[:, :, None])[:, :, 0]
+        start = end
+    return solved
+
+
+def train_als(matrix, factors, regularization, iterations, seed=0):
+    """
+    显式评分的交替最小二乘矩阵分解：评分减去全局均值后分解为 用户因子 × 电影因子ᵀ
+    :return: (用户因子, 电影因子, 全局均值)
+    """
+    matrix = matrix.tocsr().astype(np.float64)
+    mean = float(matrix.data.mean()) if matrix.nnz else 0.0
+    centered = matrix.copy()
+    centered.data = centered.data - mean
+    centered_t = centered.T.tocsr()
+
+    rng = np.random.default_rng(seed)
+    item_factors = rng.normal(scale=0.1, size=(matrix.shape[1], factors))
+    user_factors = np.zeros((matrix.shape[0], factors))
+    for iteration in range(iterations):
+        user_factors = _solve_factors(centered, item_factors, regularization)
+        item_factors = _solve_factors(centered_t, user_factors, regularization)
+    return user_factors, item_factors, mean
+
+
+def save_model(model_dir, user_ids, movie_ids, user_factors, item_factors, mean, regularization):
+    """
+    保存一个新版本的模型并原子地切换清单文件，服务进程下次检查时加载新版本
+    :return: 版本号
+    """
+    # 版本目录一旦发布就不再修改，其他进程可能正以内存映射方式读取其中的文件
+    os.makedirs(model_dir, exist_ok=True)
+    version_dir = tempfile.mkdtemp(prefix=time.strftime('%Y%m%d%H%M%S-'), dir=model_dir)
+    version = os.path.basename(version_dir)
+    np.save(os.path.join(version_dir, 'user_ids.npy'), user_ids.astype(np.int64))
+    np.save(os.path.join(version_dir, 'movie_ids.npy'), movie_ids.astype(np.int64))
+    np.save(os.path.join(version_dir, 'user_factors.npy'), user_factors.astype(np.float32))
+    np.save(os.path.join(version_dir, 'item_factors.npy'), item_factors.astype(np.float32))
+
+    manifest = {'version': version, 'mean': mean, 'regularization': regularization}
+    tmp_path = os.path.join(model_dir, MANIFEST_NAME + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(model_dir, MANIFEST_NAME))
+
+    # 清理较早的版本
+    versions = sorted(name for name in os.listdir(model_dir) if os.path.isdir(os.path.join(model_dir, name)))
+    for name in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(model_dir, name), ignore_errors=True)
+    return version
+
+
+def train_als_model():
+    """
+    离线任务：根据全部评分训练ALS模型并发布新版本
+    :return: 版本号，没有评分数据时返回None
+    """
+    started_at = time.monotonic()
+    config = get_als_config()
+    matrix, user_ids, movie_ids = load_rating_matrix()
+    if not matrix.nnz:
+        logger.info("评分表为空，跳过ALS模型训练")
+        return None
+    user_factors, item_factors, mean = train_als(
+        matrix, config['factors'], config['regularization'], config['iterations']
+    )
+    version = save_model(
+        config['model_dir'], user_ids, movie_ids, user_factors, item_factors, mean, config['regularization']
+    )
+    logger.info(
+        f"ALS模型 {version} 训练完成：{matrix.shape[0]} 位用户，{matrix.shape[1]} 部电影，"
+        f"耗时 {time.monotonic() - started_at:.1f} 秒"
+    )
+    return version
+
+
+class ALSModel:
+    """
+    一个版本的ALS模型：因子矩阵以只读内存映射方式打开，同一台机器上的所有进程共享操作系统的页缓存，不复制数据
+    """
+
+    def __init__(self, version_dir, manifest):
+        self.version = manifest['version']
+        self.mean = manifest['mean']
+        self.regularization = manifest['regularization']
+        self.user_ids = np.load(os.path.join(version_dir, 'user_ids.npy'), mmap_mode='r')
+        self.movie_ids = np.load(os.path.join(version_dir, 'movie_ids.npy'), mmap_mode='r')
+        self.user_factors = np.load(os.path.join(version_dir, 'user_factors.npy'), mmap_mode='r')
+        self.item_factors = np.load(os.path.join(version_dir, 'item_factors.npy'), mmap_mode='r')
+
+    def movie_positions(self, movie_ids):
+        """电影id对应的因子行号，模型中不存在的电影返回-1"""
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        positions = np.searchsorted(self.movie_ids, movie_ids)
+        positions = np.minimum(positions, len(self.movie_ids) - 1)
+        return np.where(self.movie_ids[positions] == movie_ids, positions, -1)
+
+    def user_vector(self, user_id, ratings):
+        """
+        用户因子：训练时已有该用户则直接读取，否则根据其当前评分即时求解(fold-in)
+        :param ratings: {电影id: 评分}
+        """
+        position = int(np.searchsorted(self.user_ids, user_id))
+        if position < len(self.user_ids) and self.user_ids[position] == user_id:
+            return np.asarray(self.user_factors[position])
+
+        positions = self.movie_positions(list(ratings))
+        known = positions >= 0
+        if not known.any():
+            return None
+        vectors = np.asarray(self.item_factors[positions[known]], dtype=np.float64)
+        values = np.array(list(ratings.values()), dtype=np.float64)[known] - self.mean
+        gram = vectors.T @ vectors + self.regularization * len(values) * np.eye(vectors.shape[1])
+        return np.linalg.solve(gram, vectors.T @ values).astype(np.float32)
+
+    def recommend(self, user_id, ratings, limit):
+        """
+        用户因子与全部电影因子点积，排除已评分的电影后用argpartition取前limit个
+        :return: 按预测评分降序的电影id列表
+        """
+        vector = self.user_vector(user_id, ratings)
+        if vector is None:
+            return []
+        scores = self.item_factors @ vector
+        rated = self.movie_positions(list(ratings))
+        scores[rated[rated >= 0]] = -np.inf
+        limit = min(limit, len(scores))
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [int(self.movie_ids[position]) for position in top if np.isfinite(scores[position])]
+
+
+class ALSModelStore:
+    """
+    读取当前发布的ALS模型，定期检查清单文件，发现新版本时加载，无需重启服务
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._model = None
+        self._checked_at = 0.0
+        self._manifest_mtime = None
+
+    def get_model(self):
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return self._model
+        with self._lock:
+            if now - self._checked_at >= RELOAD_CHECK_INTERVAL:
+                self._reload_if_changed()
+                self._checked_at = now
+        return self._model
+
+    def _reload_if_changed(self):
+        model_dir = get_als_config()['model_dir']
+        manifest_path = os.path.join(model_dir, MANIFEST_NAME)
+        try:
+            mtime = os.path.getmtime(manifest_path)
+            if mtime == self._manifest_mtime:
+                return
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            self._model = ALSModel(os.path.join(model_dir, manifest['version']), manifest)
+            self._manifest_mtime = mtime
+            logger.info(f"已加载ALS模型 {manifest['version']}")
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"加载ALS模型失败: {str(e)}")
+
+
+als_model_store = ALSModelStore()
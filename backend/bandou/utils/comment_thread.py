@@ -0,0 +1,32 @@
+from bandou.models import Comments, Rating
+
+
+def load_movie_comment_thread(movie_id):
+    """
+    一次性加载电影的全部评论(含各级回复)及评论用户对该电影的评分，在内存中组装评论树
+    无论评论和回复有多少，都只执行固定数量(2次)的查询
+    :return: (按评论时间排序的顶级评论列表, {用户id: 评分})
+    """
+    comments = list(
+        Comments.objects.filter(movie_id=movie_id).select_related('user', 'movie').order_by('comment_time', 'id')
+    )
+
+    comments_by_id = {comment.id: comment for comment in comments}
+    top_level = []
+    for comment in comments:
+        comment.thread_replies = []
+    for comment in comments:
+        parent = comments_by_id.get(comment.parent_comment_id)
+        if parent is None:
+            if comment.parent_comment_id is None:
+                top_level.append(comment)
+            continue
+        comment.parent_comment = parent  # 填充外键缓存，避免再次查询父评论
+        parent.thread_replies.append(comment)
+
+    user_ids = {comment.user_id for comment in comments}
+    ratings = dict(
+        Rating.objects.filter(movie_id=movie_id, user_id__in=user_ids).values_list('user_id', 'rating')
+    ) if user_ids else {}
+
+    return top_level, ratings
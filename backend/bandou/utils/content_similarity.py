@@ -0,0 +1,351 @@
+import logging
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q, Count, Min
+from scipy import sparse
+
+from bandou.models import Movie, SimilarMovie
+from bandou.utils.genres import split_movie_type
+from bandou.utils.search_index import tokenize
+from bandou.utils.suggest_index import split_names
+
+logger = logging.getLogger(__name__)
+
+# 参与计算内容相似度的电影字段，其中任一字段修改后需要重新计算该电影的相似电影
+CONTENT_FIELDS = ('brief_introduction', 'director', 'starring', 'type')
+
+# 特征前缀及其权重：简介切分为双字词(无前缀)，导演、演员、类别整体作为一个特征
+DIRECTOR_PREFIX = 'd:'
+ACTOR_PREFIX = 'a:'
+GENRE_PREFIX = 'g:'
+FEATURE_WEIGHTS = {DIRECTOR_PREFIX: 2.0, ACTOR_PREFIX: 1.5, GENRE_PREFIX: 1.0, '': 1.0}
+
+MIN_DOCUMENT_FREQUENCY = 2  # 只出现在一部电影中的特征对相似度没有贡献，不参与计算
+BLOCK_ENTRIES = 20000000  # 分块计算时每块相似度矩阵的元素数上限
+SAVE_BATCH_SIZE = 5000
+
+
+def get_similarity_config():
+    config = getattr(settings, 'RECOMMENDATION', {})
+    return {
+        'neighbors': config.get('SIMILAR_MOVIES_PER_MOVIE', 20),
+        'debounce': config.get('SIMILAR_MOVIES_DEBOUNCE', 5),
+        'model_max_age': config.get('SIMILAR_MOVIES_MODEL_MAX_AGE', 86400),
+    }
+
+
+def movie_features(brief_introduction, director, starring, movie_type):
+    """一部电影的特征及出现次数：简介的中文双字词和英文单词、导演、主演、类别"""
+    features = Counter(tokenize(brief_introduction, unigrams=False))
+    features.update(DIRECTOR_PREFIX + name for name in split_names(director))
+    features.update(ACTOR_PREFIX + name for name in split_names(starring))
+    features.update(GENRE_PREFIX + name for name in split_movie_type(movie_type))
+    return features
+
+
+def feature_weight(feature):
+    return FEATURE_WEIGHTS[feature[:2]] if feature[1:2] == ':' else FEATURE_WEIGHTS['']
+
+
+class ContentModel:
+    """
+    一次整体构建得到的特征表、各特征列的缩放系数(逆文档频率 × 字段权重)和全部电影的归一化特征矩阵
+    增量更新时只按这份特征表和缩放系数对变更的电影计算特征向量，不必重新切分全部电影的简介
+    """
+
+    def __init__(self, vocabulary, column_scale, matrix, movie_ids):
+        self.vocabulary = vocabulary
+        self.column_scale = column_scale
+        self.matrix = matrix
+        self.movie_ids = movie_ids
+        self.built_at = time.monotonic()
+
+    def vectorize(self, rows):
+        """
+        按已有的特征表计算若干电影的归一化特征向量，特征表中没有的特征(上次构建后新出现的)忽略
+        :param rows: (电影id, *CONTENT_FIELDS) 的可迭代对象
+        :return: (csr矩阵, 电影id数组)
+        """
+        movie_ids, indptr, indices, counts = [], [0], [], []
+        for movie_id, *fields in rows:
+            movie_ids.append(movie_id)
+            for feature, count in movie_features(*fields).items():
+                column = self.vocabulary.get(feature)
+                if column is not None:
+                    indices.append(column)
+                    counts.append(count)
+            indptr.append(len(indices))
+        matrix = sparse.csr_matrix(
+            (np.array(counts, dtype=np.float32), np.array(indices, dtype=np.int32),
+             np.array(indptr, dtype=np.int64)),
+            shape=(len(movie_ids), len(self.vocabulary))
+        )
+        return _weight_and_normalize(matrix, self.column_scale), np.array(movie_ids, dtype=np.int64)
+
+    def replace_rows(self, existing_ids, matrix, movie_ids):
+        """
+        返回用新的特征向量替换(或补入)对应电影后的模型，已删除的电影(不在existing_ids中)同时去掉，各行仍按id升序
+        """
+        keep = np.isin(self.movie_ids, existing_ids) & ~np.isin(self.movie_ids, movie_ids)
+        combined_ids = np.concatenate([self.movie_ids[keep], movie_ids])
+        order = np.argsort(combined_ids, kind='stable')
+        combined = sparse.vstack([self.matrix[np.flatnonzero(keep)], matrix], format='csr')[order]
+        model = ContentModel(self.vocabulary, self.column_scale, combined, combined_ids[order])
+        model.built_at = self.built_at
+        return model
+
+
+# 本进程最近一次整体构建(或在其基础上增量更新)的内容特征模型
+_content_model = None
+_content_model_lock = threading.Lock()
+
+
+def _weight_and_normalize(matrix, column_scale):
+    """把词频矩阵转换为 TF-IDF(对数词频 × 列缩放系数)，并把每行归一化为单位向量"""
+    matrix.data = ((1 + np.log(matrix.data)) * column_scale[matrix.indices]).astype(np.float32)
+    matrix.eliminate_zeros()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    inverse_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return sparse.csr_matrix(sparse.diags(inverse_norms.astype(np.float32)) @ matrix)
+
+
+def load_content_model():
+    """
+    对全部电影的内容特征计算TF-IDF(对数词频 × 逆文档频率 × 字段权重)，每行归一化为单位向量
+    构建结果同时保存为本进程的模型，供之后的增量更新使用
+    :return: ContentModel
+    """
+    global _content_model
+    vocabulary = {}
+    movie_ids, indptr, indices, counts = [], [0], [], []
+    rows = Movie.objects.order_by('id').values_list('id', *CONTENT_FIELDS)
+    for movie_id, *fields in rows.iterator(chunk_size=2000):
+        features = movie_features(*fields)
+        movie_ids.append(movie_id)
+        indices.extend(vocabulary.setdefault(feature, len(vocabulary)) for feature in features)
+        counts.extend(features.values())
+        indptr.append(len(indices))
+
+    indices = np.array(indices, dtype=np.int32)
+    matrix = sparse.csr_matrix(
+        (np.array(counts, dtype=np.float32), indices, np.array(indptr, dtype=np.int64)),
+        shape=(len(movie_ids), len(vocabulary))
+    )
+    document_frequency = np.bincount(indices, minlength=len(vocabulary))
+    idf = np.log((1 + len(movie_ids)) / (1 + document_frequency)) + 1
+    weights = np.fromiter(map(feature_weight, vocabulary), dtype=np.float64, count=len(vocabulary))
+    column_scale = np.where(document_frequency >= MIN_DOCUMENT_FREQUENCY, idf * weights, 0)
+
+    model = ContentModel(
+        vocabulary, column_scale, _weight_and_normalize(matrix, column_scale), np.array(movie_ids, dtype=np.int64)
+    )
+    with _content_model_lock:
+        _content_model = model
+    return model
+
+
+def load_content_matrix():
+    """
+    :return: (csr矩阵, 按id升序的电影id数组)，两行的点积即两部电影的余弦相似度
+    """
+    model = load_content_model()
+    return model.matrix, model.movie_ids
+
+
+def update_content_model(changed_ids):
+    """
+    只对变更的电影(以及模型中还没有的电影)计算特征向量，替换进最近一次构建的模型；
+    本进程还没有模型或模型已超过 SIMILAR_MOVIES_MODEL_MAX_AGE 秒时整体重新构建
+    :return: (更新后的模型, 重新计算了特征向量的电影id集合)
+    """
+    global _content_model
+    with _content_model_lock:
+        model = _content_model
+    if model is None or time.monotonic() - model.built_at > get_similarity_config()['model_max_age']:
+        return load_content_model(), set(changed_ids)
+
+    # 只读取id列，用于去掉已删除的电影、补入没有经过增量更新写入的电影
+    existing_ids = np.fromiter(Movie.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+    changed_ids = set(changed_ids) | {int(movie_id) for movie_id in np.setdiff1d(existing_ids, model.movie_ids)}
+    rows = Movie.objects.filter(id__in=changed_ids).order_by('id').values_list('id', *CONTENT_FIELDS)
+    matrix, movie_ids = model.vectorize(rows)
+    updated = model.replace_rows(existing_ids, matrix, movie_ids)
+    with _content_model_lock:
+        # 计算期间整体构建已经完成时以整体构建的结果为准
+        if _content_model is model:
+            _content_model = updated
+    return updated, {int(movie_id) for movie_id in movie_ids}
+
+
+def compute_similar_movies(matrix, positions, neighbors, reverse=False):
+    """
+    分块计算指定行与全部电影的相似度，保留每行相似度最高的neighbors部电影
+    类别等常见特征使得大多数电影两两之间相似度都不为0，因此每块的结果按稠密矩阵计算，
+    每块的行数按 BLOCK_ENTRIES 控制内存占用，并且只取该块电影用到的特征列参与计算
+    :param reverse: 同时返回这些行与全部电影的全部正相似度(不截断)，供增量更新其他电影的相似列表
+    :return: (行下标数组, 相似电影下标数组, 相似度数组)，reverse为True时额外返回同样格式的完整结果
+    """
+    columns_matrix = matrix.tocsc()
+    movie_count = matrix.shape[0]
+    block_rows = max(1, BLOCK_ENTRIES // max(movie_count, 1))
+    top_parts, all_parts = [], []
+    for start in range(0, len(positions), block_rows):
+        rows = positions[start:start + block_rows]
+        block = matrix[rows]
+        used = np.unique(block.indices)
+        scores = (columns_matrix[:, used] @ block[:, used].T.toarray()).T  # 行数 × 电影数
+        scores[np.arange(len(rows)), rows] = 0  # 去掉电影自身
+
+        if reverse:
+            block_index, columns = np.nonzero(scores > 0)
+            all_parts.append((rows[block_index], columns, scores[block_index, columns]))
+        if movie_count > neighbors:
+            top = np.argpartition(-scores, neighbors - 1, axis=1)[:, :neighbors]
+        else:
+            top = np.broadcast_to(np.arange(movie_count), (len(rows), movie_count))
+        values = np.take_along_axis(scores, top, axis=1)
+        keep = values > 0
+        top_parts.append((np.repeat(rows, keep.sum(axis=1)), top[keep], values[keep]))
+
+    def concat(parts):
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    return (concat(top_parts), concat(all_parts)) if reverse else concat(top_parts)
+
+
+def _save_pairs(movie_ids, similar_ids, similarities):
+    for offset in range(0, len(movie_ids), SAVE_BATCH_SIZE):
+        SimilarMovie.objects.bulk_create([
+            SimilarMovie(movie_id=int(movie_id), similar_id=int(similar_id), similarity=float(similarity))
+            for movie_id, similar_id, similarity in zip(
+                movie_ids[offset:offset + SAVE_BATCH_SIZE],
+                similar_ids[offset:offset + SAVE_BATCH_SIZE],
+                similarities[offset:offset + SAVE_BATCH_SIZE],
+            )
+        ])
+
+
+def build_similar_movies():
+    """
+    离线任务：重新计算全部电影的相似电影，在一个事务中整体替换旧数据
+    :return: 写入的相似电影记录数
+    """
+    started_at = time.monotonic()
+    config = get_similarity_config()
+    model = load_content_model()
+    matrix, movie_ids = model.matrix, model.movie_ids
+    sources, targets, similarities = compute_similar_movies(
+        matrix, np.arange(len(movie_ids)), config['neighbors']
+    )
+    with transaction.atomic():
+        SimilarMovie.objects.all().delete()
+        _save_pairs(movie_ids[sources], movie_ids[targets], similarities)
+
+    logger.info(
+        f"相似电影计算完成：{len(movie_ids)} 部电影，{matrix.shape[1]} 个特征，"
+        f"{len(sources)} 条记录，耗时 {time.monotonic() - started_at:.1f} 秒"
+    )
+    return len(sources)
+
+
+def update_similar_movies(changed_ids):
+    """
+    增量更新：重新计算指定电影(新增或内容修改)的相似电影，并把它们补入其他电影的相似列表
+    只对这些电影按上次整体构建的特征表计算特征向量，并只计算它们与全部电影的相似度，
+    其他电影之间的相似度沿用上次的结果(新出现的特征和逆文档频率的变化留给每日的整体重建)
+    :return: 写入的相似电影记录数
+    """
+    config = get_similarity_config()
+    neighbors = config['neighbors']
+    model, changed_ids = update_content_model(changed_ids)
+    matrix, movie_ids = model.matrix, model.movie_ids
+    positions = np.flatnonzero(np.isin(movie_ids, list(changed_ids)))
+    (sources, targets, similarities), (changed_rows, other_rows, other_similarities) = \
+        compute_similar_movies(matrix, positions, neighbors, reverse=True)
+
+    # 其他电影的候选：相似度是对称的，变更电影与全部电影的相似度即其他电影对变更电影的相似度
+    candidates = defaultdict(list)
+    for movie_id, similar_id, similarity in zip(
+            movie_ids[other_rows], movie_ids[changed_rows], other_similarities):
+        if movie_id not in changed_ids:
+            candidates[int(movie_id)].append((float(similarity), int(similar_id)))
+
+    with transaction.atomic():
+        # 变更电影在其他电影列表中的旧记录以新的相似度为准
+        SimilarMovie.objects.filter(Q(movie_id__in=changed_ids) | Q(similar_id__in=changed_ids)).delete()
+        _save_pairs(movie_ids[sources], movie_ids[targets], similarities)
+
+        # 只有相似度能进入前neighbors的候选才需要改写该电影的列表，先按各电影当前的记录数和最低相似度筛选
+        thresholds = {
+            movie_id: lowest if count >= neighbors else -math.inf
+            for movie_id, count, lowest in SimilarMovie.objects.filter(movie_id__in=list(candidates)).values(
+                'movie_id').annotate(count=Count('id'), lowest=Min('similarity')).values_list(
+                'movie_id', 'count', 'lowest')
+        }
+        rewritten = {
+            movie_id: additions for movie_id, additions in candidates.items()
+            if any(similarity > thresholds.get(movie_id, -math.inf) for similarity, _ in additions)
+        }
+        for movie_id, similar_id, similarity in SimilarMovie.objects.filter(
+                movie_id__in=list(rewritten)).values_list('movie_id', 'similar_id', 'similarity'):
+            rewritten[movie_id].append((similarity, similar_id))
+        for movie_id, items in rewritten.items():
+            rewritten[movie_id] = sorted(items, reverse=True)[:neighbors]
+
+        SimilarMovie.objects.filter(movie_id__in=list(rewritten)).delete()
+        rows = [(movie_id, similar_id, similarity)
+                for movie_id, kept in rewritten.items() for similarity, similar_id in kept]
+        if rows:
+            _save_pairs(*zip(*rows))
+
+    logger.info(f"已增量更新 {len(changed_ids)} 部电影的相似电影，影响 {len(rewritten)} 部其他电影的相似列表")
+    return len(sources) + len(rows)
+
+
+class SimilarMoviesUpdater:
+    """
+    在后台线程中增量更新相似电影，不阻塞保存电影的请求或爬虫
+    每次更新前等待 SIMILAR_MOVIES_DEBOUNCE 秒，把连续编辑多部电影(或同一部电影多次保存)合并为一次更新；
+    更新进行期间新增的电影先记录下来，当前更新完成后合并为下一次更新
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._running = False
+
+    def schedule(self, movie_ids):
+        with self._lock:
+            self._pending.update(movie_ids)
+            if self._running or not self._pending:
+                return
+            self._running = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        debounce = get_similarity_config()['debounce']
+        try:
+            while True:
+                time.sleep(debounce)
+                with self._lock:
+                    movie_ids, self._pending = self._pending, set()
+                    if not movie_ids:
+                        self._running = False
+                        return
+                try:
+                    update_similar_movies(movie_ids)
+                except Exception as e:
+                    logger.error(f"增量更新相似电影失败: {str(e)}")
+        finally:
+            connection.close()
+
+
+similar_movies_updater = SimilarMoviesUpdater()
@@ -0,0 +1,51 @@
+from django.db import transaction
+
+from bandou.models import Genre, Movie, MovieGenre
+
+
+def split_movie_type(movie_type):
+    """将" / "拼接的电影类别字符串拆分为去重后的类别名列表"""
+    if not movie_type:
+        return []
+    names = []
+    for name in movie_type.split('/'):
+        name = name.strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def sync_movie_genres(movie):
+    """根据电影的type字段同步其关联的类别"""
+    names = split_movie_type(movie.type)
+    if not names:
+        movie.genres.clear()
+        return
+
+    # 补齐尚不存在的类别(并发写入时依赖唯一约束去重)
+    existing = set(Genre.objects.filter(name__in=names).values_list('name', flat=True))
+    missing = [Genre(name=name) for name in names if name not in existing]
+    if missing:
+        Genre.objects.bulk_create(missing, ignore_conflicts=True)
+
+    movie.genres.set(Genre.objects.filter(name__in=names))
+
+
+def sync_genres_for_movies(movie_ids):
+    """批量同步多部电影与类别的关联，语句数与电影数量无关(用于爬虫批量入库等不触发post_save的场景)"""
+    movie_types = dict(Movie.objects.filter(pk__in=movie_ids).values_list('id', 'type'))
+    names_by_movie = {movie_id: split_movie_type(movie_type) for movie_id, movie_type in movie_types.items()}
+    all_names = {name for names in names_by_movie.values() for name in names}
+
+    genre_ids = {}
+    if all_names:
+        Genre.objects.bulk_create([Genre(name=name) for name in sorted(all_names)], ignore_conflicts=True)
+        genre_ids = dict(Genre.objects.filter(name__in=all_names).values_list('name', 'id'))
+
+    with transaction.atomic():
+        MovieGenre.objects.filter(movie_id__in=movie_types.keys()).delete()
+        MovieGenre.objects.bulk_create([
+            MovieGenre(movie_id=movie_id, genre_id=genre_ids[name])
+            for movie_id, names in names_by_movie.items()
+            for name in names
+        ], batch_size=1000)
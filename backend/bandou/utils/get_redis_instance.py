@@ -1,8 +1,40 @@
+import os
+import threading
+
 import redis
 from django.conf import settings
+from redis.commands.core import Script
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_redis_pool():
+    """
+    获取进程内共享的redis连接池
+    连接池在首次使用时创建；若进程被fork(如gunicorn预加载后派生worker)，子进程会重新创建自己的连接池，
+    避免父子进程共用同一批TCP连接
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                # 连接数达到上限时阻塞等待空闲连接，而不是直接报错
+                _pool = redis.BlockingConnectionPool(**settings.REDIS_CONFIG)
+                _pool_pid = pid
+    return _pool
 
 
 def get_redis_instance():
-    """从redis连接池中获取redis实例"""
-    pool = redis.ConnectionPool(**settings.REDIS_CONFIG)
-    return redis.Redis(connection_pool=pool)
+    """从共享的redis连接池中获取redis实例"""
+    return redis.Redis(connection_pool=get_redis_pool())
+
+
+def register_script(script):
+    """
+    在模块加载时注册lua脚本，sha1只计算一次；脚本不绑定连接池，
+    执行时通过 client 参数传入redis实例或pipeline，fork出的子进程使用各自的连接池
+    """
+    return Script(None, script.encode('utf-8'))
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedImage:
+    path: str
+    content_type: str
+    etag: str
+    size: int
+
+
+class DiskImageCache:
+    """
+    电影封面磁盘缓存
+    以图片url的sha256为key，图片内容和元数据(content_type、etag)分别存放；
+    总大小超过上限时按最近访问时间(文件mtime，命中时刷新)淘汰最久未使用的图片；
+    上游获取失败的url会写入负缓存，在有效期内不再重复请求上游
+    """
+    DATA_SUFFIX = '.img'
+    META_SUFFIX = '.json'
+    FAILED_SUFFIX = '.failed'
+
+    def __init__(self, directory, max_bytes, negative_ttl):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.negative_ttl = negative_ttl
+        self._total_bytes = None  # 当前进程估算的缓存总大小，首次写入时扫描目录初始化
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'IMAGE_CACHE', {})
+        return cls(
+            directory=config.get('DIR', os.path.join(settings.BASE_DIR, '.cache', 'proxy_images')),
+            max_bytes=config.get('MAX_BYTES', 512 * 1024 * 1024),
+            negative_ttl=config.get('NEGATIVE_TTL', 300),
+        )
+
+    def _base_path(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, url):
+        """读取缓存的图片，未命中返回None"""
+        base_path = self._base_path(url)
+        data_path = base_path + self.DATA_SUFFIX
+        try:
+            with open(base_path + self.META_SUFFIX, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            os.utime(data_path)  # 刷新最近访问时间
+        except (OSError, ValueError):
+            return None
+        return CachedImage(path=data_path, content_type=meta['content_type'], etag=meta['etag'], size=meta['size'])
+
+    def put(self, url, content, content_type, etag=None):
+        """写入图片，返回缓存项；etag缺失时以内容摘要生成"""
+        writer = self.open_writer(url)
+        if writer is None:
+            return None
+        writer.write(content)
+        return writer.commit(content_type, etag)
+
+    def open_writer(self, url):
+        """打开一个逐块写入图片的写入器，用于边下载边缓存"""
+        try:
+            return CacheWriter(self, url, self._base_path(url))
+        except OSError as e:
+            logger.error(f"写入图片缓存失败: {url}, 错误: {str(e)}")
+            return None
+
+    def is_failed(self, url):
+        """url是否处于负缓存有效期内"""
+        try:
+            failed_at = os.path.getmtime(self._base_path(url) + self.FAILED_SUFFIX)
+        except OSError:
+            return False
+        return time.time() - failed_at < self.negative_ttl
+
+    def mark_failed(self, url):
+        """记录上游获取失败的url"""
+        base_path = self._base_path(url)
+        try:
+            os.makedirs(os.path.dirname(base_path), exist_ok=True)
+            with open(base_path + self.FAILED_SUFFIX, 'wb'):
+                pass
+        except OSError as e:
+            logger.error(f"写入图片负缓存失败: {url}, 错误: {str(e)}")
+
+    def _discard_failure(self, base_path):  # noqa
+        _remove_quietly(base_path + self.FAILED_SUFFIX)
+
+    def _atomic_write(self, path, data):  # noqa
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            _remove_quietly(tmp_path)
+            raise
+
+    def _add_bytes(self, size):
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(entry[2] for entry in self._scan())
+            else:
+                self._total_bytes += size
+            over_limit = self._total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def _scan(self):
+        """列出缓存中的全部图片: (mtime, 路径前缀, 大小)"""
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith(self.DATA_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, entry.path[:-len(self.DATA_SUFFIX)], stat.st_size))
+        return entries
+
+    def evict(self):
+        """按最近访问时间淘汰图片，直到总大小降至上限的90%"""
+        with self._lock:
+            entries = sorted(self._scan())
+            total = sum(entry[2] for entry in entries)
+            target = self.max_bytes * 0.9
+            for _, base_path, size in entries:
+                if total <= target:
+                    break
+                for suffix in (self.META_SUFFIX, self.DATA_SUFFIX):
+                    _remove_quietly(base_path + suffix)
+                total -= size
+            self._total_bytes = total
+
+
+class CacheWriter:
+    """
+    逐块写入一张图片到临时文件，commit时原子替换为正式缓存，abort时丢弃
+    写入过程中内存占用与图片大小无关
+    """
+
+    def __init__(self, cache, url, base_path):
+        self.cache = cache
+        self.url = url
+        self.base_path = base_path
+        self.size = 0
+        self._digest = hashlib.sha1()
+        os.makedirs(os.path.dirname(base_path), exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=os.path.dirname(base_path), suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self._digest.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self, content_type, etag=None):
+        """完成写入，返回缓存项；etag缺失时以内容摘要生成"""
+        if not etag:
+            etag = '"%s"' % self._digest.hexdigest()
+        data_path = self.base_path + self.cache.DATA_SUFFIX
+        meta = {'url': self.url, 'content_type': content_type, 'etag': etag, 'size': self.size}
+        try:
+            self._file.close()
+            os.replace(self._tmp_path, data_path)
+            self.cache._atomic_write(self.base_path + self.cache.META_SUFFIX, json.dumps(meta).encode('utf-8'))
+            self.cache._discard_failure(self.base_path)
+        except OSError as e:
+            logger.error(f"写入图片缓存失败: {self.url}, 错误: {str(e)}")
+            self.abort()
+            return None
+
+        self.cache._add_bytes(self.size)
+        return CachedImage(path=data_path, content_type=content_type, etag=etag, size=self.size)
+
+    def abort(self):
+        """丢弃未完成的写入"""
+        self._file.close()
+        _remove_quietly(self._tmp_path)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+image_cache = DiskImageCache.from_settings()
@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from bandou.utils.image_cache import image_cache
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36 Edg/133.0.0.0"
+
+CHUNK_SIZE = 64 * 1024
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_proxy_config():
+    config = getattr(settings, 'IMAGE_PROXY', {})
+    return {
+        'connect_timeout': config.get('CONNECT_TIMEOUT', 3),
+        'read_timeout': config.get('READ_TIMEOUT', 10),
+        'pool_maxsize': config.get('POOL_MAXSIZE', 20),
+        'wait_timeout': config.get('WAIT_TIMEOUT', 15),
+    }
+
+
+def get_http_session():
+    """
+    获取进程内共享的HTTP会话，复用到上游图片服务器的keep-alive连接
+    与redis连接池一样，fork后的子进程会重新创建自己的会话
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                pool_maxsize = get_proxy_config()['pool_maxsize']
+                session = requests.Session()
+                session.headers['User-Agent'] = USER_AGENT
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+                _session_pid = pid
+    return _session
+
+
+class SingleFlight:
+    """
+    合并同一进程内对同一key的并发请求：第一个请求(leader)负责实际执行，
+    其余请求等待其完成后直接使用结果(此处为磁盘缓存)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def begin(self, key):
+        """
+        :return: (完成事件, 是否为leader)
+        """
+        with self._lock:
+            event = self._flights.get(key)
+            if event is not None:
+                return event, False
+            event = threading.Event()
+            self._flights[key] = event
+            return event, True
+
+    def end(self, key):
+        """leader完成(无论成功与否)后唤醒所有等待者"""
+        with self._lock:
+            event = self._flights.pop(key, None)
+        if event is not None:
+            event.set()
+
+
+image_flights = SingleFlight()
+
+
+class UpstreamImageError(Exception):
+    """上游图片获取失败"""
+
+    def __init__(self, status_code=502):
+        super().__init__(status_code)
+        self.status_code = status_code
+
+
+def open_upstream_image(image_url):
+    """
+    以流式方式请求上游图片，只读取响应头
+    :raises UpstreamImageError: 网络错误或上游返回非200
+    """
+    config = get_proxy_config()
+    try:
+        response = get_http_session().get(
+            image_url, stream=True, timeout=(config['connect_timeout'], config['read_timeout'])
+        )
+    except requests.RequestException as e:
+        logger.warning(f"获取图片失败: {image_url}, 错误: {str(e)}")
+        raise UpstreamImageError()
+
+    if response.status_code != 200:
+        response.close()
+        raise UpstreamImageError(response.status_code)
+    return response
+
+
+class CachingImageStream:
+    """
+    将上游图片逐块转发给客户端，同时写入磁盘缓存
+    只有完整读完的图片才会进入缓存；客户端中途断开或上游出错时丢弃已写入部分。
+    响应结束时(包括从未开始迭代的情况)由Django调用close()释放上游连接并通知等待者
+    """
+
+    def __init__(self, image_url, upstream, on_finish=None):
+        self.image_url = image_url
+        self.upstream = upstream
+        self.on_finish = on_finish
+        self.content_type = upstream.headers.get('Content-Type', 'image/jpeg')
+        self._writer = image_cache.open_writer(image_url) if self.content_type.startswith('image/') else None
+        self._completed = False
+        self._closed = False
+
+    def __iter__(self):
+        try:
+            for chunk in self.upstream.iter_content(chunk_size=CHUNK_SIZE):
+                if not chunk:
+                    continue
+                if self._writer is not None:
+                    self._writer.write(chunk)
+                yield chunk
+            self._completed = True
+        except requests.RequestException as e:
+            logger.warning(f"读取图片失败: {self.image_url}, 错误: {str(e)}")
+            image_cache.mark_failed(self.image_url)
+        finally:
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._writer is not None:
+            if self._completed:
+                self._writer.commit(self.content_type, self.upstream.headers.get('ETag'))
+            else:
+                self._writer.abort()
+        self.upstream.close()
+        if self.on_finish is not None:
+            self.on_finish()
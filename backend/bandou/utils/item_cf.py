@@ -0,0 +1,119 @@
+import logging
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from scipy import sparse
+
+from bandou.models import Rating, MovieNeighbor
+
+logger = logging.getLogger(__name__)
+
+SAVE_BATCH_SIZE = 5000
+
+
+def get_cf_config():
+    config = getattr(settings, 'RECOMMENDATION', {})
+    return {
+        'neighbors': config.get('NEIGHBORS_PER_MOVIE', 50),
+        'shrinkage': config.get('SIMILARITY_SHRINKAGE', 10),
+        'block_size': config.get('BLOCK_SIZE', 2000),
+    }
+
+
+def load_rating_matrix():
+    """
+    从评分表构建 用户×电影 稀疏矩阵
+    :return: (csr矩阵, 用户id数组, 电影id数组)，矩阵的行列下标与id数组一一对应
+    """
+    ratings = Rating.objects.values_list('user_id', 'movie_id', 'rating').iterator(chunk_size=10000)
+    triples = np.array(list(ratings), dtype=np.float64).reshape(-1, 3)
+    user_ids, user_index = np.unique(triples[:, 0].astype(np.int64), return_inverse=True)
+    movie_ids, movie_index = np.unique(triples[:, 1].astype(np.int64), return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (triples[:, 2], (user_index, movie_index)), shape=(len(user_ids), len(movie_ids))
+    )
+    return matrix, user_ids, movie_ids
+
+
+def compute_item_neighbors(matrix, neighbors, shrinkage, block_size):
+    """
+    计算电影之间的调整余弦相似度(每个用户的评分先减去其平均分，消除用户打分偏高或偏低的影响)，
+    保留相似度为正且最高的neighbors个近邻。
+    相似度乘以 共同评分人数/(共同评分人数+shrinkage)，避免只有一两人同时评过的电影被判为高度相似。
+    按block_size部电影分块计算 电影×电影 的相似度，内存占用与电影总数的平方无关
+    :return: (电影下标数组, 近邻下标数组, 相似度数组)
+    """
+    matrix = sparse.csr_matrix(matrix, dtype=np.float64, copy=True)
+    binary = sparse.csr_matrix((np.ones_like(matrix.data), matrix.indices, matrix.indptr), shape=matrix.shape).tocsc()
+    # 只对已评分的位置中心化，等于平均分的评分变为显式的0，共同评分人数仍由binary统计
+    counts = np.diff(matrix.indptr)
+    means = np.divide(np.asarray(matrix.sum(axis=1)).ravel(), counts, out=np.zeros(matrix.shape[0]), where=counts > 0)
+    matrix.data -= np.repeat(means, counts)
+    matrix = matrix.tocsc()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    inverse_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    transposed = matrix.T.tocsr()
+    binary_transposed = binary.T.tocsr()
+
+    sources, targets, similarities = [], [], []
+    movie_count = matrix.shape[1]
+    for start in range(0, movie_count, block_size):
+        end = min(start + block_size, movie_count)
+        dots = transposed[start:end] @ matrix
+        co_counts = binary_transposed[start:end] @ binary
+        co_counts.data = co_counts.data / (co_counts.data + shrinkage)
+        block = dots.multiply(co_counts).tocsr()
+        block = sparse.diags(inverse_norms[start:end]) @ block @ sparse.diags(inverse_norms)
+        block = sparse.csr_matrix(block)
+
+        for row in range(end - start):
+            row_start, row_end = block.indptr[row], block.indptr[row + 1]
+            values = block.data[row_start:row_end]
+            columns = block.indices[row_start:row_end]
+            keep = (values > 0) & (columns != start + row)  # 去掉电影自身
+            values, columns = values[keep], columns[keep]
+            if len(values) > neighbors:
+                top = np.argpartition(-values, neighbors - 1)[:neighbors]
+                values, columns = values[top], columns[top]
+            sources.append(np.full(len(values), start + row, dtype=np.int64))
+            targets.append(columns.astype(np.int64))
+            similarities.append(values)
+
+    if not sources:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    return np.concatenate(sources), np.concatenate(targets), np.concatenate(similarities)
+
+
+def build_movie_neighbors():
+    """
+    离线任务：根据全部评分重新计算电影近邻表
+    新的近邻在一个事务中整体替换旧数据，计算期间推荐接口继续使用旧的近邻
+    :return: 写入的近邻记录数
+    """
+    started_at = time.monotonic()
+    config = get_cf_config()
+    matrix, _, movie_ids = load_rating_matrix()
+    sources, targets, similarities = compute_item_neighbors(
+        matrix, config['neighbors'], config['shrinkage'], config['block_size']
+    )
+    source_ids, target_ids = movie_ids[sources], movie_ids[targets]
+
+    with transaction.atomic():
+        MovieNeighbor.objects.all().delete()
+        for offset in range(0, len(source_ids), SAVE_BATCH_SIZE):
+            MovieNeighbor.objects.bulk_create([
+                MovieNeighbor(movie_id=int(movie_id), neighbor_id=int(neighbor_id), similarity=float(similarity))
+                for movie_id, neighbor_id, similarity in zip(
+                    source_ids[offset:offset + SAVE_BATCH_SIZE],
+                    target_ids[offset:offset + SAVE_BATCH_SIZE],
+                    similarities[offset:offset + SAVE_BATCH_SIZE],
+                )
+            ])
+
+    logger.info(
+        f"电影近邻计算完成：{matrix.shape[0]} 位用户，{matrix.shape[1]} 部电影，"
+        f"{len(source_ids)} 条近邻，耗时 {time.monotonic() - started_at:.1f} 秒"
+    )
+    return len(source_ids)
@@ -0,0 +1,146 @@
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.db import connection
+
+from bandou.utils.movie_change_feed import ChangeFeedCursor
+
+logger = logging.getLogger(__name__)
+
+
+class LiveMovieIndex(ABC):
+    """
+    随电影变更增量刷新的进程内索引基类
+    子类把索引数据保存在 state_fields 列出的属性中，实现 _build() 从数据库填充这些属性、
+    _apply_changes(movie_ids) 应用一批电影的变更，可覆盖 _needs_rebuild() 在增量数据过多时触发整体重建。
+    查询前在不持有锁的情况下调用 refresh()：本进程的变更由 mark_changed 直接标记，每次查询前应用；
+    其他进程的变更从redis变更记录读取，每 SEARCH_INDEX['POLL_INTERVAL'] 秒最多读取一次，读取时不持有索引锁，
+    同一时刻只有一个线程读取，其余查询不等待网络往返；
+    redis不可用时只应用本进程的变更，索引超过 SEARCH_INDEX['MAX_AGE'] 秒后整体重建。
+    除首次构建外，整体重建在后台线程中进行，完成前查询继续使用旧索引
+    """
+    state_fields = ()
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._cursor = ChangeFeedCursor()
+        self._poll_lock = threading.Lock()
+        self._next_poll_at = 0
+        self._pending = set()  # 本进程内已变更、尚未应用到索引的电影id
+        self._built_at = None
+        self._pid = None
+        self._rebuilding = None  # 后台重建期间已应用到旧索引的电影id，需要在替换后补到新索引上
+
+    @staticmethod
+    def max_age():
+        return getattr(settings, 'SEARCH_INDEX', {}).get('MAX_AGE', 600)
+
+    @staticmethod
+    def poll_interval():
+        return getattr(settings, 'SEARCH_INDEX', {}).get('POLL_INTERVAL', 0.5)
+
+    def mark_changed(self, movie_ids):
+        """记录本进程内变更的电影，下次查询前重新索引"""
+        with self._lock:
+            self._pending.update(movie_ids)
+
+    def rebuild(self):
+        """在当前线程中从数据库整体重建索引"""
+        with self._lock:
+            self._prepare_rebuild()
+            self._pending.clear()  # 持有锁期间不会有新的标记，已标记的变更都包含在新索引中
+            state = self._build_state()
+            self._install(state)
+
+    def refresh(self):
+        """查询前调用，调用方不持有锁"""
+        if self._built_at is None or self._pid != os.getpid():
+            with self._lock:
+                if self._built_at is None or self._pid != os.getpid():
+                    self._rebuilding = None
+                    self.rebuild()
+                    return
+
+        changed = self._poll_changes()
+        with self._lock:
+            if changed is None:
+                if time.monotonic() - self._built_at > self.max_age():
+                    self._start_background_rebuild()
+                changed = set()
+            changed |= self._pending
+            self._pending.clear()
+            if changed:
+                self._apply_changes(changed)
+                if self._rebuilding is not None:
+                    self._rebuilding |= changed
+            if self._needs_rebuild():
+                self._start_background_rebuild()
+
+    def _poll_changes(self):
+        """
+        读取redis变更记录，距上次读取不足 poll_interval() 秒或其他线程正在读取时直接返回空集合
+        :return: 电影id集合；为None表示无法增量同步
+        """
+        now = time.monotonic()
+        if now < self._next_poll_at or not self._poll_lock.acquire(blocking=False):
+            return set()
+        try:
+            self._next_poll_at = now + self.poll_interval()
+            return self._cursor.poll()
+        finally:
+            self._poll_lock.release()
+
+    def _prepare_rebuild(self):
+        # 游标失效时以当前版本作为新索引的起点；游标有效时其后的变更会继续被读取并补到新索引上
+        if self._cursor.version is None or self._built_at is None or self._pid != os.getpid():
+            self._cursor.reset()
+        self._rebuilding = set()
+        self._built_at = time.monotonic()
+
+    def _build_state(self):
+        builder = type(self)()
+        builder._build()
+        return {field: getattr(builder, field) for field in self.state_fields}
+
+    def _install(self, state):
+        for field, value in state.items():
+            setattr(self, field, value)
+        replay, self._rebuilding = self._rebuilding or set(), None
+        self._built_at = time.monotonic()
+        self._pid = os.getpid()
+        if replay:
+            self._apply_changes(replay)
+
+    def _start_background_rebuild(self):
+        if self._rebuilding is not None:
+            return
+        self._prepare_rebuild()
+        threading.Thread(target=self._background_rebuild, daemon=True).start()
+
+    def _background_rebuild(self):
+        try:
+            state = self._build_state()
+        except Exception as e:
+            logger.error(f"重建{type(self).__name__}失败: {str(e)}")
+            with self._lock:
+                self._rebuilding = None
+            return
+        finally:
+            connection.close()
+        with self._lock:
+            self._install(state)
+
+    @abstractmethod
+    def _build(self):
+        """从数据库填充 state_fields 列出的属性"""
+
+    @abstractmethod
+    def _apply_changes(self, movie_ids):
+        """把一批电影的变更应用到索引"""
+
+    def _needs_rebuild(self):  # noqa
+        return False
@@ -0,0 +1,87 @@
+import logging
+
+import redis
+
+from bandou.utils.get_redis_instance import get_redis_instance, register_script
+
+logger = logging.getLogger(__name__)
+
+CHANGES_KEY = "movie_changes"  # 有序集合：成员为电影id，分值为最近一次变更的版本号
+VERSION_KEY = "movie_changes:version"  # 全局变更版本号
+TRIMMED_KEY = "movie_changes:trimmed"  # 已被裁剪掉的最大版本号
+MAX_TRACKED_CHANGES = 10000  # 最多保留的变更记录数
+
+# 递增版本号并记录变更的电影，超出保留数量时裁剪最旧的记录，一次往返完成
+# KEYS: 变更集合、版本号、裁剪版本号；ARGV: 最大保留数量, 电影id...
+MARK_CHANGED_SCRIPT = register_script("""
+local version = redis.call('INCR', KEYS[2])
+for i = 2, #ARGV do
+    redis.call('ZADD', KEYS[1], version, ARGV[i])
+end
+local overflow = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[1])
+if overflow > 0 then
+    local trimmed = redis.call('ZRANGE', KEYS[1], overflow - 1, overflow - 1, 'WITHSCORES')
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, overflow - 1)
+    redis.call('SET', KEYS[3], trimmed[2])
+end
+return version
+""")
+
+
+def mark_movies_changed(movie_ids):
+    """
+    记录电影发生了变更(新增、修改或删除)，供各进程内的内存索引增量刷新
+    redis不可用时只记录日志，各索引会在超过最长存活时间后整体重建
+    """
+    movie_ids = [str(movie_id) for movie_id in movie_ids]
+    if not movie_ids:
+        return
+    try:
+        MARK_CHANGED_SCRIPT(
+            keys=[CHANGES_KEY, VERSION_KEY, TRIMMED_KEY], args=[MAX_TRACKED_CHANGES, *movie_ids],
+            client=get_redis_instance()
+        )
+    except redis.RedisError as e:
+        logger.warning(f"记录电影变更失败: {str(e)}")
+
+
+class ChangeFeedCursor:
+    """
+    变更订阅游标：记录某个内存索引已应用到的版本，每次读取其后发生变更的电影id
+    """
+
+    def __init__(self):
+        self.version = None
+
+    def reset(self):
+        """在索引整体重建之前调用，以当前版本作为起点"""
+        try:
+            version = get_redis_instance().get(VERSION_KEY)
+        except redis.RedisError as e:
+            logger.warning(f"读取电影变更版本失败: {str(e)}")
+            self.version = None
+            return
+        self.version = int(version or 0)
+
+    def poll(self):
+        """
+        读取自上次以来变更的电影id，一次往返
+        :return: 电影id集合；为None表示无法增量同步(redis不可用或变更记录已被裁剪)，需要整体重建
+        """
+        if self.version is None:
+            return None
+        try:
+            pipe = get_redis_instance().pipeline(transaction=False)
+            pipe.get(VERSION_KEY)
+            pipe.get(TRIMMED_KEY)
+            pipe.zrangebyscore(CHANGES_KEY, f"({self.version}", "+inf")
+            version, trimmed, changed = pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"读取电影变更失败: {str(e)}")
+            return None
+
+        if trimmed and int(trimmed) > self.version:
+            return None
+        self.version = int(version or 0)
+        return {int(movie_id) for movie_id in changed}
+
@@ -0,0 +1,165 @@
+import logging
+import threading
+
+import redis
+from django.db import connection
+
+from bandou.models import Movie
+from bandou.utils.get_redis_instance import get_redis_instance
+from bandou.utils.movie_change_feed import ChangeFeedCursor
+
+logger = logging.getLogger(__name__)
+
+# 榜单有序集合：成员为补零到固定宽度的电影id，同分时按成员字典序即按id排列
+RANKING_KEYS = {
+    'score': "movie_ranking:score",  # 分值为评分，无评分的电影为 NO_SCORE，排在最后
+    'release_time': "movie_ranking:release_time",  # 分值为上映日期的序数，无上映日期的电影为 NO_RELEASE_TIME，排在最后
+}
+BUILT_KEY = "movie_ranking:built"  # 整体构建完成的标记，不存在时(首次部署、redis数据丢失)榜单不可用
+REBUILD_LOCK_KEY = "movie_ranking:rebuild_lock"
+REBUILD_LOCK_TTL = 300
+NO_SCORE = -1
+NO_RELEASE_TIME = 0  # 上映日期的序数从1开始
+MISSING_VALUES = {'score': NO_SCORE, 'release_time': NO_RELEASE_TIME}  # 缺失值小于所有有效分值
+MEMBER_WIDTH = 10
+ZADD_BATCH_SIZE = 5000
+
+
+class RankingUnavailable(Exception):
+    """redis不可用或榜单尚未构建，调用方应退回数据库查询"""
+
+
+def _member(movie_id):
+    return str(movie_id).zfill(MEMBER_WIDTH)
+
+
+def _ranking_scores(score, release_time):
+    return {
+        'score': score if score is not None else NO_SCORE,
+        'release_time': release_time.toordinal() if release_time else NO_RELEASE_TIME,
+    }
+
+
+def update_movie_rankings(movie_ids):
+    """
+    电影评分、上映时间变化或电影被删除后，更新其在榜单中的位置，一次查询加一次redis往返
+    """
+    movie_ids = set(movie_ids)
+    if not movie_ids:
+        return
+    rows = Movie.objects.filter(pk__in=movie_ids).values_list('id', 'score', 'release_time')
+    try:
+        pipe = get_redis_instance().pipeline(transaction=False)
+        for movie_id, score, release_time in rows:
+            movie_ids.discard(movie_id)
+            for field, value in _ranking_scores(score, release_time).items():
+                pipe.zadd(RANKING_KEYS[field], {_member(movie_id): value})
+        if movie_ids:  # 已删除的电影
+            for key in RANKING_KEYS.values():
+                pipe.zrem(key, *map(_member, movie_ids))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"更新电影榜单失败: {str(e)}")
+
+
+def rebuild_movie_rankings():
+    """
+    从数据库整体重建榜单：写入临时key后原子地替换，构建期间榜单继续可用
+    构建期间发生变更的电影通过电影变更记录在替换后补齐
+    :return: 榜单中的电影数
+    """
+    redis_client = get_redis_instance()
+    cursor = ChangeFeedCursor()
+    cursor.reset()
+
+    temporary = {field: f"{key}:building" for field, key in RANKING_KEYS.items()}
+    redis_client.delete(*temporary.values())
+    count = 0
+    pipe = redis_client.pipeline(transaction=False)
+    rows = Movie.objects.values_list('id', 'score', 'release_time').iterator(chunk_size=ZADD_BATCH_SIZE)
+    for movie_id, score, release_time in rows:
+        for field, value in _ranking_scores(score, release_time).items():
+            pipe.zadd(temporary[field], {_member(movie_id): value})
+        count += 1
+        if count % ZADD_BATCH_SIZE == 0:
+            pipe.execute()
+    pipe.execute()
+
+    pipe = redis_client.pipeline(transaction=True)
+    for field, key in RANKING_KEYS.items():
+        if count:
+            pipe.rename(temporary[field], key)
+        else:
+            pipe.delete(key)
+    pipe.set(BUILT_KEY, 1)
+    pipe.execute()
+
+    changed = cursor.poll()
+    if changed:
+        update_movie_rankings(changed)
+    logger.info(f"电影榜单重建完成，共 {count} 部电影")
+    return count
+
+
+def _background_rebuild():
+    try:
+        rebuild_movie_rankings()
+    except Exception as e:
+        logger.error(f"重建电影榜单失败: {str(e)}")
+    finally:
+        connection.close()
+        try:
+            get_redis_instance().delete(REBUILD_LOCK_KEY)
+        except redis.RedisError:
+            pass
+
+
+def start_background_rebuild():
+    """榜单尚未构建时在后台线程中构建，多个进程同时发现时只由取得锁的进程构建"""
+    try:
+        if not get_redis_instance().set(REBUILD_LOCK_KEY, 1, nx=True, ex=REBUILD_LOCK_TTL):
+            return
+    except redis.RedisError:
+        return
+    threading.Thread(target=_background_rebuild, daemon=True).start()
+
+
+def get_ranking_page(ordering, offset, limit):
+    """
+    读取榜单的一页，O(log N + limit)
+    :param ordering: score/-score/release_time/-release_time，无评分(或无上映时间)的电影在升序和降序下都排在最后
+    :return: (电影id列表, 榜单总数)
+    :raises RankingUnavailable: redis不可用或榜单尚未构建
+    """
+    field = ordering.lstrip('-')
+    key = RANKING_KEYS[field]
+    descending = ordering.startswith('-')
+    try:
+        redis_client = get_redis_instance()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.exists(BUILT_KEY)
+        pipe.zcard(key)
+        if descending:
+            pipe.zrevrange(key, offset, offset + limit - 1)
+        else:
+            pipe.zcount(key, '-inf', MISSING_VALUES[field])
+        built, total, result = pipe.execute()
+        if not built:
+            raise RankingUnavailable()
+
+        if descending:
+            members = result
+        else:
+            # 升序：有值的电影位于名次 [缺失数, 总数)，缺失值的电影接在其后，与数据库 nulls_last 一致
+            missing = result
+            present = total - missing
+            members = []
+            if offset < present:
+                members += redis_client.zrange(key, missing + offset, min(missing + offset + limit, total) - 1)
+            start, end = max(offset - present, 0), min(offset + limit - present, missing)
+            if end > start:
+                members += redis_client.zrange(key, start, end - 1)
+    except redis.RedisError as e:
+        logger.warning(f"读取电影榜单失败: {str(e)}")
+        raise RankingUnavailable()
+    return [int(member) for member in members], total
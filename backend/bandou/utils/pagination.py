@@ -0,0 +1,150 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class MovieCursorPagination(BasePagination):
+    """
+    电影列表游标(keyset)分页
+    以(排序字段, id)作为稳定排序键，下一页通过 WHERE 条件直接定位，不使用 OFFSET 和 COUNT(*)，
+    查询耗时与翻到第几页、电影总数无关
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering_query_param = 'ordering'
+    ordering_fields = ['score', 'release_time']
+    default_ordering = '-score'
+    invalid_cursor_message = '无效的游标'
+
+    def __init__(self):
+        config = getattr(settings, 'MOVIE_CURSOR_PAGINATION', {})
+        self.default_page_size = config.get('PAGE_SIZE', 20)
+        self.max_page_size = config.get('MAX_PAGE_SIZE', 100)
+        self.base_url = None
+        self.ordering = None
+        self.page = None
+        self.next_position = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request)
+        page_size = self.get_page_size(request)
+
+        field = self.ordering.lstrip('-')
+        descending = self.ordering.startswith('-')
+        queryset = queryset.order_by(*self._order_by(field, descending))
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            cursor['v'] = self._cursor_value(queryset.model, field, cursor['v'])
+            queryset = queryset.filter(self._after(field, descending, cursor))
+
+        # 多取一条用于判断是否还有下一页
+        rows = list(queryset[:page_size + 1])
+        self.page = rows[:page_size]
+        if len(rows) > page_size:
+            last = self.page[-1]
+            value = getattr(last, field)
+            self.next_position = {
+                'o': self.ordering,
+                'q': self.get_filter_params(request),
+                'v': value.isoformat() if hasattr(value, 'isoformat') else value,
+                'id': last.pk
+            }
+        else:
+            self.next_position = None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data
+        })
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_page_size(self, request):
+        """读取请求的每页数量，并限制在配置的上限内"""
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError, TypeError):
+            return self.default_page_size
+        if page_size <= 0:
+            return self.default_page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request):
+        """排序方式：score/-score/release_time/-release_time，默认按评分降序"""
+        ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        if ordering.lstrip('-') not in self.ordering_fields:
+            return self.default_ordering
+        return ordering
+
+    def get_filter_params(self, request):
+        """除游标和每页数量外的查询参数(如分类)，游标只能在生成它的同一筛选条件下使用"""
+        params = sorted(
+            (key, value) for key, values in request.query_params.lists() for value in values
+            if key not in (self.cursor_query_param, self.page_size_query_param, self.ordering_query_param)
+        )
+        return '&'.join(f'{key}={value}' for key, value in params)
+
+    def decode_cursor(self, request):
+        """解析游标，格式错误、被篡改或与当前排序方式、筛选条件不一致时返回400"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            pk = int(position['id'])
+            value = position['v']
+            ordering = position['o']
+            filter_params = position['q']
+        except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError, OverflowError):
+            raise ParseError(self.invalid_cursor_message)
+        if ordering != self.ordering or filter_params != self.get_filter_params(request):
+            raise ParseError(self.invalid_cursor_message)
+        return {'v': value, 'id': pk}
+
+    def encode_cursor(self, position):  # noqa
+        raw = json.dumps(position, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+
+    def _cursor_value(self, model, field, value):
+        """把游标中的排序字段值转换为字段类型，无法转换(被篡改)时返回400，不会在查询时出错"""
+        if value is None:
+            return None
+        try:
+            return model._meta.get_field(field).to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            raise ParseError(self.invalid_cursor_message)
+
+    def _order_by(self, field, descending):  # noqa
+        """无评分(NULL)的电影始终排在最后，id 作为并列时的稳定次序"""
+        if descending:
+            return [F(field).desc(nulls_last=True), F('id').desc()]
+        return [F(field).asc(nulls_last=True), F('id').asc()]
+
+    def _after(self, field, descending, cursor):  # noqa
+        """生成位于游标之后的记录的过滤条件"""
+        value, pk = cursor['v'], cursor['id']
+        pk_lookup = 'id__lt' if descending else 'id__gt'
+        if value is None:
+            # 游标已处于NULL段，只需在NULL段内按id继续
+            return Q(**{f'{field}__isnull': True, pk_lookup: pk})
+        value_lookup = f'{field}__lt' if descending else f'{field}__gt'
+        return (
+                Q(**{value_lookup: value}) |
+                Q(**{field: value, pk_lookup: pk}) |
+                Q(**{f'{field}__isnull': True})
+        )
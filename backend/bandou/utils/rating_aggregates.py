@@ -0,0 +1,220 @@
+from django.db import transaction
+from django.db.models import Case, When, F, Value, FloatField, IntegerField, Sum, Count
+from django.db.models.functions import Round, TruncDate
+from django.utils import timezone
+
+from bandou.models import Movie, Rating, MovieRatingHistogram, RatingDailyRollup
+
+# 由评分总和与人数得到的综合评分(保留1位小数)，无人评分时为空
+MOVIE_SCORE_EXPRESSION = Case(
+    When(rating_count__gt=0, then=Round(F('rating_sum') / F('rating_count'), 1)),
+    default=Value(None),
+    output_field=FloatField()
+)
+
+HISTOGRAM_BUCKETS = 11  # 0到5分按半星分档
+HISTOGRAM_FIELDS = [f'bucket_{bucket}' for bucket in range(HISTOGRAM_BUCKETS)]
+
+
+def histogram_field(rating):
+    """评分所在的半星分档字段，非半星整数倍的评分四舍五入到最近的半星"""
+    return HISTOGRAM_FIELDS[min(max(int(float(rating) * 2 + 0.5), 0), HISTOGRAM_BUCKETS - 1)]
+
+
+def apply_rating_delta(movie_id, sum_delta, count_delta):
+    """
+    以F表达式增量更新电影的评分总和、评分人数和综合评分
+    只涉及该电影的一行记录，耗时与电影已有评分数量无关
+    """
+    with transaction.atomic():
+        updated = Movie.objects.filter(pk=movie_id).update(
+            rating_sum=F('rating_sum') + sum_delta,
+            rating_count=F('rating_count') + count_delta
+        )
+        if updated:
+            Movie.objects.filter(pk=movie_id).update(score=MOVIE_SCORE_EXPRESSION)
+
+
+def rebuild_movie_rating_aggregates(movie_ids=None, batch_size=1000):
+    """
+    根据评分表重新计算电影的评分总和、评分人数和综合评分
+    :param movie_ids: 需要重建的电影id，为None时重建全部电影
+    :return: 与评分表不一致而被修正的电影数量
+    """
+    ratings = Rating.objects.all()
+    movies = Movie.objects.all()
+    if movie_ids is not None:
+        ratings = ratings.filter(movie_id__in=movie_ids)
+        movies = movies.filter(pk__in=movie_ids)
+
+    stats = {
+        item['movie_id']: (item['total'], item['count'])
+        for item in ratings.values('movie_id').annotate(total=Sum('rating'), count=Count('id'))
+    }
+
+    changed = []
+    emptied_ids = []  # 统计有误、实际已无任何评分的电影
+    for movie in movies.only('id', 'rating_sum', 'rating_count').iterator(chunk_size=batch_size):
+        total, count = stats.get(movie.id, (0, 0))
+        if movie.rating_count != count or abs(movie.rating_sum - total) > 1e-6:
+            if count == 0:
+                emptied_ids.append(movie.id)
+            movie.rating_sum = total
+            movie.rating_count = count
+            changed.append(movie)
+
+    with transaction.atomic():
+        Movie.objects.bulk_update(changed, ['rating_sum', 'rating_count'], batch_size=batch_size)
+        # 从未有用户评分的电影保留其原有评分(如爬虫抓取的豆瓣评分)
+        movies.filter(rating_count__gt=0).update(score=MOVIE_SCORE_EXPRESSION)
+        if emptied_ids:
+            Movie.objects.filter(pk__in=emptied_ids).update(score=None)
+
+    return len(changed)
+
+
+def _clamped_increment(field, delta):
+    """
+    人数字段的增量表达式，减少时不低于0：分布与评分表不一致时(如手工改动数据)，删除或修改评分不会因无符号字段越界而失败，
+    不一致留给 rebuild_rating_histograms 修正
+    用CASE而不是GREATEST，MySQL中无符号字段减到负数时整个表达式就会报错
+    """
+    if delta >= 0:
+        return F(field) + delta
+    return Case(
+        When(**{f'{field}__gte': -delta}, then=F(field) + delta),
+        default=Value(0), output_field=IntegerField()
+    )
+
+
+def apply_histogram_deltas(deltas):
+    """
+    以F表达式增量更新电影的评分分布，每部电影一条UPDATE，分布记录不存在时先创建
+    :param deltas: {电影id: {分档字段: 人数增量}}
+    """
+    deltas = {
+        movie_id: {field: delta for field, delta in fields.items() if delta}
+        for movie_id, fields in deltas.items()
+    }
+    deltas = {movie_id: fields for movie_id, fields in deltas.items() if fields}
+
+    def update(movie_id):
+        fields = deltas[movie_id]
+        return MovieRatingHistogram.objects.filter(pk=movie_id).update(
+            **{field: _clamped_increment(field, delta) for field, delta in fields.items()}
+        )
+
+    with transaction.atomic():
+        missing = [movie_id for movie_id in deltas if not update(movie_id)]
+        if missing:
+            MovieRatingHistogram.objects.bulk_create(
+                [MovieRatingHistogram(movie_id=movie_id) for movie_id in missing], ignore_conflicts=True
+            )
+            for movie_id in missing:
+                update(movie_id)
+
+
+def rebuild_rating_histograms(movie_ids=None, batch_size=1000):
+    """
+    根据评分表重新计算电影的评分分布
+    :param movie_ids: 需要重建的电影id，为None时重建全部电影
+    :return: 与评分表不一致而被修正的电影数量
+    """
+    ratings = Rating.objects.all()
+    histograms = MovieRatingHistogram.objects.all()
+    if movie_ids is not None:
+        ratings = ratings.filter(movie_id__in=movie_ids)
+        histograms = histograms.filter(movie_id__in=movie_ids)
+
+    # 按原始评分值分组计数，分档在Python中计算，与增量维护时的取整规则一致
+    expected = {}
+    for movie_id, rating, count in ratings.values('movie_id', 'rating').annotate(
+            count=Count('id')).values_list('movie_id', 'rating', 'count'):
+        counts = expected.setdefault(movie_id, dict.fromkeys(HISTOGRAM_FIELDS, 0))
+        counts[histogram_field(rating)] += count
+
+    changed = []
+    for histogram in histograms.iterator(chunk_size=batch_size):
+        counts = expected.pop(histogram.movie_id, None) or dict.fromkeys(HISTOGRAM_FIELDS, 0)
+        if any(getattr(histogram, field) != count for field, count in counts.items()):
+            for field, count in counts.items():
+                setattr(histogram, field, count)
+            changed.append(histogram)
+    # 有评分但缺少分布记录的电影
+    created = [MovieRatingHistogram(movie_id=movie_id, **counts) for movie_id, counts in expected.items()]
+
+    with transaction.atomic():
+        MovieRatingHistogram.objects.bulk_update(changed, HISTOGRAM_FIELDS, batch_size=batch_size)
+        MovieRatingHistogram.objects.bulk_create(created, batch_size=batch_size, ignore_conflicts=True)
+
+    return len(changed) + len(created)
+
+
+def rating_day(rating_time):
+    """评分时间所在的日期(本地时区)，即评分计入的每日汇总"""
+    return timezone.localdate(rating_time) if timezone.is_aware(rating_time) else rating_time.date()
+
+
+def apply_rollup_deltas(deltas):
+    """
+    以F表达式增量更新每日评分汇总，每个(电影, 日期)一条UPDATE，汇总记录不存在时先创建
+    :param deltas: {(电影id, 日期): (评分总和增量, 人数增量)}
+    """
+    deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+
+    def update(movie_id, day):
+        sum_delta, count_delta = deltas[(movie_id, day)]
+        return RatingDailyRollup.objects.filter(movie_id=movie_id, day=day).update(
+            rating_sum=F('rating_sum') + sum_delta,
+            rating_count=F('rating_count') + count_delta
+        )
+
+    with transaction.atomic():
+        missing = [key for key in deltas if not update(*key)]
+        if missing:
+            RatingDailyRollup.objects.bulk_create(
+                [RatingDailyRollup(movie_id=movie_id, day=day) for movie_id, day in missing], ignore_conflicts=True
+            )
+            for key in missing:
+                update(*key)
+
+
+def rebuild_rating_rollups(movie_ids=None, batch_size=1000):
+    """
+    根据评分表重新计算每日评分汇总，按电影分批进行，内存占用与评分总数无关
+    :param movie_ids: 需要重建的电影id，为None时重建全部电影
+    :return: 与评分表不一致而被修正、补充或删除的汇总记录数
+    """
+    if movie_ids is None:
+        movie_ids = set(Rating.objects.values_list('movie_id', flat=True).distinct())
+        movie_ids |= set(RatingDailyRollup.objects.values_list('movie_id', flat=True).distinct())
+    movie_ids = sorted(set(movie_ids))
+
+    changed = 0
+    for offset in range(0, len(movie_ids), batch_size):
+        batch = movie_ids[offset:offset + batch_size]
+        expected = {
+            (item['movie_id'], item['day']): (item['total'], item['count'])
+            for item in Rating.objects.filter(movie_id__in=batch).annotate(day=TruncDate('rating_time')).values(
+                'movie_id', 'day').annotate(total=Sum('rating'), count=Count('id'))
+        }
+        updated, stale_ids = [], []
+        for rollup in RatingDailyRollup.objects.filter(movie_id__in=batch):
+            total, count = expected.pop((rollup.movie_id, rollup.day), (None, None))
+            if count is None:
+                stale_ids.append(rollup.pk)
+            elif rollup.rating_count != count or abs(rollup.rating_sum - total) > 1e-6:
+                rollup.rating_sum, rollup.rating_count = total, count
+                updated.append(rollup)
+        created = [
+            RatingDailyRollup(movie_id=movie_id, day=day, rating_sum=total, rating_count=count)
+            for (movie_id, day), (total, count) in expected.items()
+        ]
+
+        with transaction.atomic():
+            RatingDailyRollup.objects.filter(pk__in=stale_ids).delete()
+            RatingDailyRollup.objects.bulk_update(updated, ['rating_sum', 'rating_count'], batch_size=batch_size)
+            RatingDailyRollup.objects.bulk_create(created, batch_size=batch_size, ignore_conflicts=True)
+        changed += len(stale_ids) + len(updated) + len(created)
+
+    return changed
@@ -0,0 +1,266 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+import redis
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, When, F, Value, FloatField, IntegerField, DateTimeField
+from django.utils import timezone
+
+from bandou.models import Movie, Rating
+from bandou.utils.get_redis_instance import get_redis_instance, register_script
+from bandou.utils.rating_aggregates import MOVIE_SCORE_EXPRESSION, apply_histogram_deltas, histogram_field, \
+    apply_rollup_deltas, rating_day
+from bandou.utils.signals import ratings_bulk_saved
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "rating_buffer:pending"  # 哈希：字段为 "用户id:电影id"，值为 "评分|时间戳"，同一用户对同一电影只保留最新评分
+FLUSHING_KEY = "rating_buffer:flushing"  # 正在写入数据库的一批评分，写入成功后删除，失败时下次继续写入
+FLUSH_LOCK_KEY = "rating_buffer:flush_lock"
+FLUSH_LOCK_TTL = 60
+
+# 取出待写入的一批评分：上一批未写入成功时继续使用上一批，否则把待写入哈希整体改名为写入中的批次
+# KEYS: 待写入哈希、写入中哈希；返回本批的 [字段, 值, ...]
+TAKE_BATCH_SCRIPT = register_script("""
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return {}
+    end
+    redis.call('RENAME', KEYS[1], KEYS[2])
+end
+return redis.call('HGETALL', KEYS[2])
+""")
+
+
+def get_buffer_config():
+    config = getattr(settings, 'RATING_BUFFER', {})
+    return {
+        'enabled': config.get('ENABLED', False),
+        'flush_interval': config.get('FLUSH_INTERVAL', 2),
+    }
+
+
+def rating_buffer_enabled():
+    return get_buffer_config()['enabled']
+
+
+def _field(user_id, movie_id):
+    return f"{user_id}:{movie_id}"
+
+
+def _rating_time(timestamp):
+    """缓冲区中的时间戳转换为与 Rating.rating_time 一致的时间(USE_TZ 关闭时为本地时间)"""
+    rated_at = datetime.fromtimestamp(float(timestamp), tz=dt_timezone.utc)
+    return rated_at if settings.USE_TZ else timezone.make_naive(rated_at)
+
+
+def buffer_rating(user_id, movie_id, rating):
+    """
+    将评分写入redis缓冲区后立即返回，由后台线程批量写入数据库
+    :return: 评分时间，redis不可用时返回None，调用方应直接写入数据库
+    """
+    rated_at = time.time()
+    try:
+        get_redis_instance().hset(PENDING_KEY, _field(user_id, movie_id), f"{rating}|{rated_at}")
+    except redis.RedisError as e:
+        logger.warning(f"写入评分缓冲区失败: {str(e)}")
+        return None
+    rating_flusher.start()
+    return _rating_time(rated_at)
+
+
+def get_buffered_rating(user_id, movie_id):
+    """
+    读取用户尚未写入数据库的评分(待写入的优先于写入中的)，保证用户能立即看到自己的评分
+    :return: (评分, 评分时间)，缓冲区中没有时返回None
+    """
+    field = _field(user_id, movie_id)
+    try:
+        pipe = get_redis_instance().pipeline(transaction=False)
+        pipe.hget(PENDING_KEY, field)
+        pipe.hget(FLUSHING_KEY, field)
+        pending, flushing = pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"读取评分缓冲区失败: {str(e)}")
+        return None
+    value = pending or flushing
+    if value is None:
+        return None
+    rating, rated_at = value.split('|')
+    return float(rating), _rating_time(rated_at)
+
+
+def get_buffered_ratings(user_id, movie_ids):
+    """
+    批量读取用户对多部电影尚未写入数据库的评分，一次redis往返
+    :return: {电影id: 评分}，redis不可用时返回空字典
+    """
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return {}
+    fields = [_field(user_id, movie_id) for movie_id in movie_ids]
+    try:
+        pipe = get_redis_instance().pipeline(transaction=False)
+        pipe.hmget(PENDING_KEY, fields)
+        pipe.hmget(FLUSHING_KEY, fields)
+        pending, flushing = pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"读取评分缓冲区失败: {str(e)}")
+        return {}
+    return {
+        movie_id: float((first or second).split('|')[0])
+        for movie_id, first, second in zip(movie_ids, pending, flushing) if first or second
+    }
+
+
+def _add_rollup(deltas, movie_id, rating_time, sum_delta, count_delta):
+    delta = deltas[(movie_id, rating_day(rating_time))]
+    delta[0] += sum_delta
+    delta[1] += count_delta
+
+
+def _write_ratings(entries):
+    """
+    在一个事务中批量写入评分，并按电影汇总评分增量后用一条UPDATE更新评分统计，再逐部电影更新评分分布和每日汇总
+    数据库中评分时间不早于缓冲评分的评分(同一批已写入过，或redis故障期间直接写入的更新评分)保持不变，因此失败重试是幂等的
+    :param entries: {(用户id, 电影id): (评分, 评分时间)}
+    :return: (涉及的电影id列表, 涉及的用户id列表, 新增评分的电影id列表)
+    """
+    user_ids = {user_id for user_id, _ in entries}
+    movie_ids = {movie_id for _, movie_id in entries}
+    # 电影已被删除的评分直接丢弃
+    movie_ids &= set(Movie.objects.filter(pk__in=movie_ids).values_list('id', flat=True))
+    existing = {
+        (rating.user_id, rating.movie_id): rating
+        for rating in Rating.objects.select_for_update().filter(user_id__in=user_ids, movie_id__in=movie_ids)
+    }
+
+    created, updated = [], []
+    sum_deltas, count_deltas = defaultdict(float), defaultdict(int)
+    histogram_deltas = defaultdict(lambda: defaultdict(int))
+    rollup_deltas = defaultdict(lambda: [0.0, 0])
+    for (user_id, movie_id), (value, rated_at) in entries.items():
+        if movie_id not in movie_ids:
+            continue
+        rating = existing.get((user_id, movie_id))
+        if rating is None:
+            created.append(Rating(user_id=user_id, movie_id=movie_id, rating=value, rating_time=rated_at))
+            sum_deltas[movie_id] += value
+            count_deltas[movie_id] += 1
+            histogram_deltas[movie_id][histogram_field(value)] += 1
+            _add_rollup(rollup_deltas, movie_id, rated_at, value, 1)
+        elif rating.rating_time >= rated_at:
+            continue
+        elif rating.rating != value:
+            sum_deltas[movie_id] += value - rating.rating
+            histogram_deltas[movie_id][histogram_field(rating.rating)] -= 1
+            histogram_deltas[movie_id][histogram_field(value)] += 1
+            _add_rollup(rollup_deltas, movie_id, rating.rating_time, -rating.rating, -1)
+            _add_rollup(rollup_deltas, movie_id, rated_at, value, 1)
+            rating.rating = value
+            rating.rating_time = rated_at
+            updated.append(rating)
+
+    created_times = {(rating.user_id, rating.movie_id): rating.rating_time for rating in created}
+    Rating.objects.bulk_create(created)
+    if created_times:
+        # bulk_create时auto_now会把评分时间改为写入时间，改回用户评分的时间，以便与之后缓冲的评分比较先后
+        Rating.objects.filter(
+            user_id__in={user_id for user_id, _ in created_times}, movie_id__in={movie_id for _, movie_id in created_times}
+        ).update(rating_time=Case(
+            *[When(user_id=user_id, movie_id=movie_id, then=Value(rated_at))
+              for (user_id, movie_id), rated_at in created_times.items()],
+            default=F('rating_time'), output_field=DateTimeField()
+        ))
+    Rating.objects.bulk_update(updated, ['rating', 'rating_time'])
+    changed_movie_ids = list(sum_deltas)
+    if changed_movie_ids:
+        Movie.objects.filter(pk__in=changed_movie_ids).update(
+            rating_sum=F('rating_sum') + Case(
+                *[When(pk=movie_id, then=Value(delta)) for movie_id, delta in sum_deltas.items()],
+                default=Value(0.0), output_field=FloatField()
+            ),
+            rating_count=F('rating_count') + Case(
+                *[When(pk=movie_id, then=Value(delta)) for movie_id, delta in count_deltas.items()],
+                default=Value(0), output_field=IntegerField()
+            ),
+        )
+        Movie.objects.filter(pk__in=changed_movie_ids).update(score=MOVIE_SCORE_EXPRESSION)
+        apply_histogram_deltas(histogram_deltas)
+        apply_rollup_deltas(rollup_deltas)
+    changed_user_ids = list({rating.user_id for rating in created + updated})
+    return changed_movie_ids, changed_user_ids, [rating.movie_id for rating in created]
+
+
+def flush_rating_buffer():
+    """
+    将缓冲区中的评分写入数据库，多个进程同时调用时只有一个进程执行
+    锁的值为本次持有者的令牌，释放时比较令牌后删除，写入超过锁的有效期时不会删除其他进程的锁
+    :return: 本次写入的评分数
+    """
+    redis_client = get_redis_instance()
+    lock = redis_client.lock(FLUSH_LOCK_KEY, timeout=FLUSH_LOCK_TTL)
+    if not lock.acquire(blocking=False):
+        return 0
+    try:
+        values = TAKE_BATCH_SCRIPT(keys=[PENDING_KEY, FLUSHING_KEY], client=redis_client)
+        if not values:
+            return 0
+        entries = {}
+        for field, value in zip(values[::2], values[1::2]):
+            user_id, movie_id = map(int, field.split(':'))
+            rating, rated_at = value.split('|')
+            entries[(user_id, movie_id)] = (float(rating), _rating_time(rated_at))
+
+        with transaction.atomic():
+            movie_ids, user_ids, created_movie_ids = _write_ratings(entries)
+            ratings_bulk_saved.send(sender=Rating, movie_ids=movie_ids, user_ids=user_ids,
+                                    created_movie_ids=created_movie_ids)
+        redis_client.delete(FLUSHING_KEY)
+        return len(entries)
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            logger.warning(f"写入缓冲评分超过 {FLUSH_LOCK_TTL} 秒，锁已过期")
+
+
+class RatingFlusher:
+    """
+    后台写入线程：缓冲区中有评分时每隔 FLUSH_INTERVAL 秒写入一批，缓冲区为空后退出，下次有新评分时再启动
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        interval = get_buffer_config()['flush_interval']
+        try:
+            while True:
+                time.sleep(interval)
+                try:
+                    flush_rating_buffer()
+                    # 持有锁时确认缓冲区为空再退出，期间写入的评分会由start()启动新的线程处理
+                    with self._lock:
+                        if not get_redis_instance().exists(PENDING_KEY, FLUSHING_KEY):
+                            self._running = False
+                            return
+                except Exception as e:
+                    logger.error(f"写入缓冲评分失败: {str(e)}")
+        finally:
+            connection.close()
+
+
+rating_flusher = RatingFlusher()
@@ -0,0 +1,129 @@
+import logging
+import time
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from bandou.models import Movie, Rating, User
+from bandou.utils.rating_aggregates import rebuild_movie_rating_aggregates, rebuild_rating_histograms, \
+    rebuild_rating_rollups
+from bandou.utils.signals import ratings_bulk_saved
+
+logger = logging.getLogger(__name__)
+
+
+def get_bulk_rating_config():
+    config = getattr(settings, 'BULK_RATINGS', {})
+    return {
+        'max_rows': config.get('MAX_ROWS', 5000),
+        'chunk_size': config.get('CHUNK_SIZE', 1000),
+    }
+
+
+def parse_rating(value):
+    """评分转换为0到5之间的浮点数，无效时返回None"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if 0 <= value <= 5 else None
+
+
+def _upsert_chunk(chunk, result):
+    """
+    在一个事务中写入一批评分：两条IN查询过滤不存在的用户和电影，一条加锁查询读取已有评分，再批量新增和按新评分分组修改
+    已有评分在读取时加行锁，读取之后其他请求才新增的评分由upsert改为修改，不会因唯一约束冲突导致整块失败
+    :param chunk: {(用户id, 电影id): 评分}
+    :return: (评分变化的电影id集合, 评分变化的用户id集合)
+    """
+    user_ids = set(User.objects.filter(pk__in={user_id for user_id, _ in chunk}).values_list('id', flat=True))
+    movie_ids = set(Movie.objects.filter(pk__in={movie_id for _, movie_id in chunk}).values_list('id', flat=True))
+    upsert_options = {'update_conflicts': True, 'update_fields': ['rating', 'rating_time']}
+    # MySQL的ON DUPLICATE KEY UPDATE不支持指定冲突字段，由用户和电影上的唯一索引触发
+    if connection.features.supports_update_conflicts_with_target:
+        upsert_options['unique_fields'] = ['user', 'movie']
+
+    with transaction.atomic():
+        # 按用户和电影两个IN条件查询会多读出块外的评分，只读取元组以减少开销
+        existing = {
+            (user_id, movie_id): (rating_id, rating)
+            for rating_id, user_id, movie_id, rating in Rating.objects.select_for_update().filter(
+                user_id__in=user_ids, movie_id__in=movie_ids).values_list('id', 'user_id', 'movie_id', 'rating')
+        }
+
+        created, updated = [], defaultdict(list)
+        for (user_id, movie_id), value in chunk.items():
+            if user_id not in user_ids or movie_id not in movie_ids:
+                result['skipped'] += 1
+                continue
+            rating_id, rating = existing.get((user_id, movie_id), (None, None))
+            if rating_id is None:
+                created.append(Rating(user_id=user_id, movie_id=movie_id, rating=value))
+            elif rating != value:
+                updated[value].append((rating_id, user_id, movie_id))
+            else:
+                result['unchanged'] += 1
+
+        # 评分只有有限的几种取值，修改的评分按新评分分组，每组一条UPDATE，避免bulk_update逐行拼接CASE语句
+        now = timezone.now()
+        Rating.objects.bulk_create(created, **upsert_options)
+        for value, rows in updated.items():
+            Rating.objects.filter(pk__in=[rating_id for rating_id, _, _ in rows]).update(rating=value, rating_time=now)
+    changed = [(rating.user_id, rating.movie_id) for rating in created]
+    changed += [(user_id, movie_id) for rows in updated.values() for _, user_id, movie_id in rows]
+    result['created'] += len(created)
+    result['updated'] += len(changed) - len(created)
+    return {movie_id for _, movie_id in changed}, {user_id for user_id, _ in changed}
+
+
+def import_ratings(rows, chunk_size=None):
+    """
+    批量导入评分：按块新增或修改，批量写入不触发逐条评分的信号，
+    全部写入后对涉及的电影各重新统计一次评分、评分分布和每日汇总，并发送 ratings_bulk_saved 通知索引、榜单和缓存
+    每块在各自的事务中提交，中途失败时已写入的评分保留，可重新导入或执行 rebuild_movie_scores 修正评分统计
+    :param rows: 可迭代的 (用户id, 电影id, 评分)，同一用户对同一电影以最后一条为准
+    :return: 导入结果统计
+    """
+    started_at = time.monotonic()
+    chunk_size = chunk_size or get_bulk_rating_config()['chunk_size']
+    result = {'created': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+    changed_movie_ids, changed_user_ids = set(), set()
+
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, chunk_size))
+        if not batch:
+            break
+        chunk = {}
+        for user_id, movie_id, value in batch:
+            value = parse_rating(value)
+            try:
+                key = (int(user_id), int(movie_id))
+            except (TypeError, ValueError):
+                key = None
+            if key is None or value is None:
+                result['skipped'] += 1
+                continue
+            chunk[key] = value
+        if chunk:
+            movie_ids, user_ids = _upsert_chunk(chunk, result)
+            changed_movie_ids |= movie_ids
+            changed_user_ids |= user_ids
+
+    if changed_movie_ids:
+        rebuild_movie_rating_aggregates(changed_movie_ids)
+        rebuild_rating_histograms(changed_movie_ids)
+        rebuild_rating_rollups(changed_movie_ids)
+        # 导入的多为历史评分，不计入近期热度
+        ratings_bulk_saved.send(sender=Rating, movie_ids=list(changed_movie_ids), user_ids=list(changed_user_ids),
+                                created_movie_ids=[])
+
+    result['movies'] = len(changed_movie_ids)
+    logger.info(
+        f"评分导入完成：新增 {result['created']} 条，修改 {result['updated']} 条，未变化 {result['unchanged']} 条，"
+        f"跳过 {result['skipped']} 条，涉及 {result['movies']} 部电影，耗时 {time.monotonic() - started_at:.1f} 秒"
+    )
+    return result
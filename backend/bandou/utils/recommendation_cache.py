@@ -0,0 +1,126 @@
+import json
+import logging
+
+import redis
+from django.conf import settings
+
+from bandou.utils.get_redis_instance import get_redis_instance, register_script
+
+logger = logging.getLogger(__name__)
+
+USER_KEY = "recommend:user:{}"  # 用户的推荐列表(已序列化的电影数据)
+VERSION_KEY = "recommend:user:{}:version"  # 用户推荐缓存的版本号，用户评分变化时递增
+SHARED_KEY = "recommend:shared"  # 匿名用户和没有评分的用户共用的推荐列表
+REQUESTS_KEY = "recommend:stats:requests"  # 读取缓存的请求数
+MISSES_KEY = "recommend:stats:misses"  # 未命中、重新计算推荐的请求数
+COLD_START = "cold_start"  # 用户缓存的取值，表示该用户没有评分，使用共享列表
+
+# 版本号与计算推荐前读取的一致时才写入用户缓存，计算期间评分发生变化时丢弃按旧评分计算的结果
+# KEYS: 用户缓存、版本号；ARGV: 读取时的版本号, 缓存值, 过期秒数
+STORE_USER_SCRIPT = register_script("""
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SETEX', KEYS[1], ARGV[3], ARGV[2])
+return 1
+""")
+
+
+def get_cache_config():
+    config = getattr(settings, 'RECOMMENDATION_CACHE', {})
+    return {
+        'user_ttl': config.get('USER_TTL', 1800),
+        'shared_ttl': config.get('SHARED_TTL', 600),
+    }
+
+
+def get_cached_recommendations(user_id=None):
+    """
+    一次往返读取推荐缓存并计数：登录用户同时读取其个人缓存、共享缓存和缓存版本号，个人缓存标记为冷启动时使用共享列表
+    :param user_id: 匿名用户为None
+    :return: (缓存的推荐列表, 版本号)，未命中或redis不可用时推荐列表为None；未命中时计算后将版本号传给写入缓存的函数
+    """
+    keys = [SHARED_KEY] if user_id is None else [USER_KEY.format(user_id), SHARED_KEY, VERSION_KEY.format(user_id)]
+    try:
+        pipe = get_redis_instance().pipeline(transaction=False)
+        pipe.mget(keys)
+        pipe.incr(REQUESTS_KEY)
+        values, _ = pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"读取推荐缓存失败: {str(e)}")
+        return None, None
+
+    if user_id is None:
+        return (json.loads(values[0]) if values[0] is not None else None), None
+    value, shared, version = values
+    if value == COLD_START:
+        value = shared
+    return (json.loads(value) if value is not None else None), version or ''
+
+
+def cache_user_recommendations(user_id, data, version):
+    """缓存用户的个性化推荐列表，并记一次未命中；version为计算前读取的版本号"""
+    _store(user_entry=(user_id, version, json.dumps(data)))
+
+
+def cache_shared_recommendations(data, user_id=None, version=None):
+    """缓存共享推荐列表，并记一次未命中；user_id不为空时把该用户标记为使用共享列表"""
+    _store(
+        shared=json.dumps(data),
+        user_entry=(user_id, version, COLD_START) if user_id is not None else None
+    )
+
+
+def _store(shared=None, user_entry=None):
+    config = get_cache_config()
+    try:
+        pipe = get_redis_instance().pipeline(transaction=False)
+        if shared is not None:
+            pipe.setex(SHARED_KEY, config['shared_ttl'], shared)
+        if user_entry is not None:
+            user_id, version, value = user_entry
+            STORE_USER_SCRIPT(
+                keys=[USER_KEY.format(user_id), VERSION_KEY.format(user_id)],
+                args=[version or '', value, config['user_ttl']],
+                client=pipe
+            )
+        pipe.incr(MISSES_KEY)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"写入推荐缓存失败: {str(e)}")
+
+
+def invalidate_user_recommendations(user_id):
+    """
+    用户的评分变化后删除其推荐缓存并递增版本号，下次请求时重新计算，正在按旧评分计算的结果不再写入缓存
+    删除失败时旧缓存最多保留 USER_TTL 秒
+    """
+    try:
+        pipe = get_redis_instance().pipeline()
+        pipe.incr(VERSION_KEY.format(user_id))
+        # 版本号比缓存多保留一个有效期，覆盖计算推荐期间的写入
+        pipe.expire(VERSION_KEY.format(user_id), get_cache_config()['user_ttl'] * 2)
+        pipe.delete(USER_KEY.format(user_id))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"删除推荐缓存失败: {str(e)}")
+
+
+def get_cache_stats():
+    """
+    推荐缓存的请求数、命中数、未命中数和命中率
+    :return: 统计字典，redis不可用时返回None
+    """
+    try:
+        requests, misses = get_redis_instance().mget(REQUESTS_KEY, MISSES_KEY)
+    except redis.RedisError as e:
+        logger.error(f"读取推荐缓存统计失败: {str(e)}")
+        return None
+    requests, misses = int(requests or 0), int(misses or 0)
+    hits = max(requests - misses, 0)
+    return {
+        'requests': requests,
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / requests, 4) if requests else None,
+    }
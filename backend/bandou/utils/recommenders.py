@@ -0,0 +1,67 @@
+import heapq
+from collections import defaultdict
+
+from django.conf import settings
+
+from bandou.models import Rating, MovieNeighbor
+from bandou.utils.als import als_model_store
+
+NEUTRAL_RATING = 2.5  # 评分高于该值视为喜欢，低于该值视为不喜欢
+MAX_HISTORY = 200  # 参与计算的用户最近评分数
+
+BACKEND_ITEM_CF = 'item_cf'
+BACKEND_ALS = 'als'
+
+
+def load_user_ratings(user_id):
+    """用户的全部评分 [(电影id, 评分)]，最近的在前"""
+    return list(Rating.objects.filter(user_id=user_id).order_by('-rating_time').values_list('movie_id', 'rating'))
+
+
+def recommend_from_item_neighbors(user_ratings, limit=10):
+    """
+    基于离线计算的电影近邻表为用户推荐电影
+    候选电影的得分为 Σ 相似度 × (用户对近邻电影的评分 - NEUTRAL_RATING)，
+    与用户喜欢的电影相似则加分，与不喜欢的电影相似则减分；只查询一次近邻表
+    :return: 按得分降序排列的电影id列表(不含用户已评分的电影)，近邻表为空时返回空列表
+    """
+    if not user_ratings:
+        return []
+    rated = {movie_id for movie_id, _ in user_ratings}
+    ratings = dict(user_ratings[:MAX_HISTORY])
+
+    scores = defaultdict(float)
+    neighbors = MovieNeighbor.objects.filter(movie_id__in=list(ratings)).values_list(
+        'movie_id', 'neighbor_id', 'similarity'
+    )
+    for movie_id, neighbor_id, similarity in neighbors:
+        if neighbor_id not in rated:
+            scores[neighbor_id] += similarity * (ratings[movie_id] - NEUTRAL_RATING)
+
+    top = heapq.nlargest(limit, ((score, movie_id) for movie_id, score in scores.items() if score > 0))
+    return [movie_id for _, movie_id in top]
+
+
+def recommend_from_als(user_id, user_ratings, limit=10):
+    """
+    基于ALS矩阵分解模型推荐电影，不查询数据库
+    :return: 按预测评分降序排列的电影id列表，模型尚未训练时返回空列表
+    """
+    model = als_model_store.get_model()
+    if model is None or not user_ratings:
+        return []
+    return model.recommend(user_id, dict(user_ratings), limit)
+
+
+def recommend_for_user(user_id, limit=10):
+    """
+    按 RECOMMENDATION['BACKEND'] 配置的推荐后端为用户推荐电影，ALS模型不可用时退回电影近邻推荐
+    :return: 电影id列表，可能少于limit个
+    """
+    user_ratings = load_user_ratings(user_id)
+    backend = getattr(settings, 'RECOMMENDATION', {}).get('BACKEND', BACKEND_ITEM_CF)
+    if backend == BACKEND_ALS:
+        movie_ids = recommend_from_als(user_id, user_ratings, limit)
+        if movie_ids:
+            return movie_ids
+    return recommend_from_item_neighbors(user_ratings, limit)
@@ -0,0 +1,78 @@
+import logging
+
+import redis
+
+from bandou.utils.get_redis_instance import get_redis_instance, register_script
+
+logger = logging.getLogger(__name__)
+
+RESET_CODE_TTL = 300  # 验证码有效期5分钟
+RESET_COOLDOWN_TTL = 60  # 60秒内不允许重复发送
+
+# 冷却检查与验证码写入在同一个脚本中原子完成，只需一次往返
+# KEYS: 冷却key、验证码key、生成时间key；ARGV: 验证码、当前时间戳、验证码有效期、冷却时长
+STORE_RESET_CODE_SCRIPT = register_script("""
+if not redis.call('SET', KEYS[1], ARGV[2], 'NX', 'EX', ARGV[4]) then
+    return 0
+end
+redis.call('SETEX', KEYS[2], ARGV[3], ARGV[1])
+redis.call('SETEX', KEYS[3], ARGV[3], ARGV[2])
+return 1
+""")
+
+
+class ResetCodeUnavailable(Exception):
+    """redis不可用，无法保存、读取或删除验证码，调用方应提示稍后重试"""
+
+
+def _reset_keys(email):
+    return f"reset_cooldown:{email}", f"reset_code:{email}", f"reset_timestamp:{email}"
+
+
+def store_reset_code(email, code, timestamp):
+    """
+    保存密码重置验证码并开始发送冷却
+    :return: 处于冷却期内时返回False，否则返回True
+    :raises ResetCodeUnavailable: redis不可用
+    """
+    try:
+        stored = STORE_RESET_CODE_SCRIPT(keys=list(_reset_keys(email)),
+                                         args=[code, timestamp, RESET_CODE_TTL, RESET_COOLDOWN_TTL],
+                                         client=get_redis_instance())
+    except redis.RedisError as e:
+        logger.warning(f"保存密码重置验证码失败: {str(e)}")
+        raise ResetCodeUnavailable()
+    return bool(stored)
+
+
+def get_reset_code(email):
+    """
+    一次往返读取验证码及其生成时间
+    :return: (验证码, 生成时间戳)，不存在时对应项为None
+    :raises ResetCodeUnavailable: redis不可用
+    """
+    _, code_key, timestamp_key = _reset_keys(email)
+    try:
+        code, timestamp = get_redis_instance().mget(code_key, timestamp_key)
+    except redis.RedisError as e:
+        logger.warning(f"读取密码重置验证码失败: {str(e)}")
+        raise ResetCodeUnavailable()
+    return code, float(timestamp) if timestamp else None
+
+
+def clear_reset_code(email):
+    """
+    一次往返删除验证码及其生成时间，验证码使用后立即删除
+    :return: 是否删除了验证码，同一验证码被并发使用时只有一个请求返回True
+    :raises ResetCodeUnavailable: redis不可用
+    """
+    _, code_key, timestamp_key = _reset_keys(email)
+    try:
+        pipe = get_redis_instance().pipeline()
+        pipe.delete(code_key)
+        pipe.delete(timestamp_key)
+        deleted, _ = pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"删除密码重置验证码失败: {str(e)}")
+        raise ResetCodeUnavailable()
+    return bool(deleted)
@@ -0,0 +1,32 @@
+from django.db.models import Q
+
+# 评分区间(标签, 起点, 终点)，左闭右开，满分5分计入最后一个区间；搜索分面和后台评分分布共用
+SCORE_BUCKETS = [('0-1', 0, 1), ('1-2', 1, 2), ('2-3', 2, 3), ('3-4', 3, 4), ('4-5', 4, 5)]
+NO_SCORE_BUCKET = '无评分'
+
+
+def score_bucket(score):
+    """评分所在区间的标签"""
+    if score is None:
+        return NO_SCORE_BUCKET
+    for label, _, end in SCORE_BUCKETS:
+        if score < end:
+            return label
+    return SCORE_BUCKETS[-1][0]
+
+
+def score_bucket_filter(field, label):
+    """
+    与 score_bucket 划分一致的查询条件：第一个区间不设下限，最后一个区间不设上限
+    :param field: 评分字段，如 score、movie__score
+    """
+    if label == NO_SCORE_BUCKET:
+        return Q(**{f'{field}__isnull': True})
+    index = [bucket[0] for bucket in SCORE_BUCKETS].index(label)
+    _, start, end = SCORE_BUCKETS[index]
+    condition = Q()
+    if index > 0:
+        condition &= Q(**{f'{field}__gte': start})
+    if index < len(SCORE_BUCKETS) - 1:
+        condition &= Q(**{f'{field}__lt': end})
+    return condition
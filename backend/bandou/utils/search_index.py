@@ -0,0 +1,261 @@
+import heapq
+import math
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from dataclasses import dataclass
+from itertools import chain
+from operator import itemgetter
+
+from bandou.models import Movie
+from bandou.utils.genres import split_movie_type
+from bandou.utils.live_index import LiveMovieIndex
+from bandou.utils.score_buckets import SCORE_BUCKETS, NO_SCORE_BUCKET, score_bucket
+
+# 参与索引的字段：(字段名, 权重, 是否索引单字)
+# 简介较长，只索引双字词以控制内存，单字查询只在其余短字段中匹配
+SEARCH_FIELDS = [
+    ('title', 3.0, True),
+    ('director', 2.0, True),
+    ('starring', 2.0, True),
+    ('type', 1.0, True),
+    ('brief_introduction', 1.0, False),
+]
+
+MAX_DIRECTOR_FACETS = 20  # 导演分面只返回作品数最多的若干位
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 建索引时读取的字段：被索引的文本字段之后是分面用的上映时间和评分
+INDEX_COLUMNS = [field for field, _, _ in SEARCH_FIELDS] + ['release_time', 'score']
+
+TF_BITS = 3  # 每个字段的词频占用的位数，多个字段的词频压缩进一个无符号短整型
+TF_MAX = (1 << TF_BITS) - 1
+
+# 中日韩文字按字切分，其余按字母数字连续串切分
+_TOKEN_RE = re.compile(r'([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+)|([0-9a-z]+)')
+
+
+def tokenize(text, unigrams=True):
+    """
+    将文本切分为索引词：中文连续串生成相邻双字词(以及单字)，英文和数字按整词，统一转为小写半角
+    长度为1的中文串总是生成单字，保证单字查询能命中
+    """
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    for cjk, word in _TOKEN_RE.findall(text):
+        if word:
+            yield word
+            continue
+        if unigrams or len(cjk) == 1:
+            yield from cjk
+        yield from map(str.__add__, cjk, cjk[1:])
+
+
+def facet_attributes(movie_type, release_time, director, score):
+    """文档的分面属性：(类别, 上映年份, 导演, 评分区间)"""
+    directors = tuple(name.strip() for name in (director or '').split('/') if name.strip())
+    year = release_time.year if release_time else None
+    return tuple(split_movie_type(movie_type)), year, directors, score_bucket(score)
+
+
+@dataclass
+class SearchResult:
+    hits: list  # 按相关度降序的 [(电影id, 相关度)]，只包含请求的一页
+    total: int = 0  # 全部命中的电影数
+    facets: dict = None  # 全部命中电影的分面统计，未请求时为None
+
+
+def _hit_order(hit):
+    """命中的排序键：相关度降序，相同时id小的在前"""
+    return -hit[1], hit[0]
+
+
+def tokenize_query(text):
+    """查询切词：中文串只取双字词(单字串取单字)，去重"""
+    return list(dict.fromkeys(tokenize(text, unigrams=False)))
+
+
+class MovieSearchIndex(LiveMovieIndex):
+    """
+    电影全文搜索的进程内倒排索引
+    每个索引词对应两个紧凑数组：文档号(递增)和各字段词频的压缩值；文档号是索引内部的顺序编号，
+    电影更新时旧文档标记为失效并追加新文档，失效文档过多时整体重建。
+    查询时按BM25计算相关度，各字段按SEARCH_FIELDS中的权重加权，要求命中全部查询词。
+    每个文档同时记录类别、年份、导演和评分区间，分面统计只需遍历一次命中文档，不再逐个分面查询数据库
+    """
+    state_fields = ('_postings', '_doc_movie', '_live', '_field_lengths', '_length_totals', '_movie_doc', '_dead',
+                    '_doc_attributes', '_doc_text_hash')
+
+    def __init__(self):
+        super().__init__()
+        self._reset()
+
+    def _reset(self):
+        self._postings = {}
+        self._doc_movie = array('q')
+        self._live = bytearray()
+        self._field_lengths = [array('H') for _ in SEARCH_FIELDS]
+        self._length_totals = [0] * len(SEARCH_FIELDS)
+        self._movie_doc = {}
+        self._dead = 0
+        self._doc_attributes = []  # 文档号 -> 分面属性
+        self._doc_text_hash = []  # 文档号 -> 被索引文本的摘要，文本未变时只更新分面属性
+
+    def search(self, query, offset=0, limit=None, facets=False):
+        """
+        搜索电影
+        :param offset: 跳过按相关度排序的前offset部电影
+        :param limit: 最多返回的数量，为None时返回全部命中
+        :param facets: 是否统计全部命中电影(不受分页限制)的分面
+        :return: SearchResult，命中按相关度降序排列，相关度相同时id小的在前
+        """
+        terms = tokenize_query(query)
+        if not terms:
+            return SearchResult(hits=[], facets=self._facets([]) if facets else None)
+        self.refresh()
+        with self._lock:
+            scores = self._match(terms)
+            ranked = ((self._doc_movie[doc], score) for doc, score in scores.items())
+            if limit is None:
+                hits = sorted(ranked, key=_hit_order)[offset:]
+            else:
+                hits = heapq.nsmallest(offset + limit, ranked, key=_hit_order)[offset:]
+            return SearchResult(hits=hits, total=len(scores), facets=self._facets(scores) if facets else None)
+
+    def catalog_facets(self):
+        """全部电影的分面统计"""
+        self.refresh()
+        with self._lock:
+            return self._facets(self._movie_doc.values())
+
+    def _build(self):
+        for row in Movie.objects.values_list('id', *INDEX_COLUMNS).order_by('id').iterator(chunk_size=2000):
+            self._add(row[0], row[1:len(SEARCH_FIELDS) + 1], row[len(SEARCH_FIELDS) + 1:])
+
+    def _needs_rebuild(self):
+        return self._dead > max(1000, len(self._movie_doc))
+
+    def _apply_changes(self, movie_ids):
+        rows = {row[0]: row for row in Movie.objects.filter(id__in=movie_ids).values_list('id', *INDEX_COLUMNS)}
+        for movie_id in movie_ids:
+            row = rows.get(movie_id)
+            if row is None:
+                self._remove(movie_id)
+                continue
+            values, extra = row[1:len(SEARCH_FIELDS) + 1], row[len(SEARCH_FIELDS) + 1:]
+            doc = self._movie_doc.get(movie_id)
+            if doc is not None and self._doc_text_hash[doc] == hash(values):
+                # 只有评分等非文本字段变化(如用户评分)，无需重新切词
+                self._doc_attributes[doc] = self._attributes(values, extra)
+                continue
+            self._remove(movie_id)
+            self._add(movie_id, values, extra)
+
+    @staticmethod
+    def _attributes(values, extra):
+        fields = dict(zip((field for field, _, _ in SEARCH_FIELDS), values))
+        release_time, score = extra
+        return facet_attributes(fields['type'], release_time, fields['director'], score)
+
+    def _add(self, movie_id, values, extra):
+        doc = len(self._doc_movie)
+        self._doc_movie.append(movie_id)
+        self._live.append(1)
+        self._movie_doc[movie_id] = doc
+        self._doc_attributes.append(self._attributes(values, extra))
+        self._doc_text_hash.append(hash(values))
+
+        packed_freqs = {}
+        for index, (value, (_, _, unigrams)) in enumerate(zip(values, SEARCH_FIELDS)):
+            term_freqs = Counter(tokenize(value, unigrams))
+            length = min(sum(term_freqs.values()), 0xFFFF)
+            self._field_lengths[index].append(length)
+            self._length_totals[index] += length
+            shift = index * TF_BITS
+            for term, freq in term_freqs.items():
+                packed_freqs[term] = packed_freqs.get(term, 0) | (min(freq, TF_MAX) << shift)
+
+        for term, packed in packed_freqs.items():
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = self._postings[term] = (array('I'), array('H'))
+            posting[0].append(doc)
+            posting[1].append(packed)
+
+    def _remove(self, movie_id):
+        doc = self._movie_doc.pop(movie_id, None)
+        if doc is None:
+            return
+        self._live[doc] = 0
+        self._dead += 1
+        self._doc_attributes[doc] = None
+        for index in range(len(SEARCH_FIELDS)):
+            self._length_totals[index] -= self._field_lengths[index][doc]
+
+    def _match(self, terms):
+        """命中全部查询词的文档及其相关度"""
+        postings = [self._postings.get(term) for term in terms]
+        if any(posting is None for posting in postings):
+            return {}
+        # 从最稀有的词开始求交集，后续的词只需在已有候选中查找
+        postings.sort(key=lambda posting: len(posting[0]))
+
+        live_count = len(self._movie_doc) or 1
+        average_lengths = [max(total / live_count, 1.0) for total in self._length_totals]
+        scores = None
+        for docs, freqs in postings:
+            idf = math.log(1 + (live_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            if scores is None:
+                scores = {
+                    doc: self._score(doc, packed, idf, average_lengths)
+                    for doc, packed in zip(docs, freqs) if self._live[doc]
+                }
+            elif len(scores) * 16 < len(docs):
+                # 候选很少时在有序的文档号数组中二分查找
+                matched = {}
+                for doc, score in scores.items():
+                    position = bisect_left(docs, doc)
+                    if position < len(docs) and docs[position] == doc:
+                        matched[doc] = score + self._score(doc, freqs[position], idf, average_lengths)
+                scores = matched
+            else:
+                scores = {
+                    doc: scores[doc] + self._score(doc, packed, idf, average_lengths)
+                    for doc, packed in zip(docs, freqs) if doc in scores
+                }
+            if not scores:
+                return {}
+        return scores
+
+    def _facets(self, docs):
+        """遍历一次命中文档取出分面属性，再分别计数类别、评分区间、年份和导演"""
+        attributes = [self._doc_attributes[doc] for doc in docs]
+        genres = Counter(chain.from_iterable(map(itemgetter(0), attributes)))
+        years = Counter(map(itemgetter(1), attributes))
+        years.pop(None, None)
+        directors = Counter(chain.from_iterable(map(itemgetter(2), attributes)))
+        buckets = Counter(map(itemgetter(3), attributes))
+
+        bucket_labels = [label for label, _, _ in SCORE_BUCKETS] + [NO_SCORE_BUCKET]
+        return {
+            'genre': [{'value': name, 'count': count} for name, count in genres.most_common()],
+            'score': [{'value': label, 'count': buckets[label]} for label in bucket_labels],
+            'year': [{'value': year, 'count': years[year]} for year in sorted(years, reverse=True)],
+            'director': [{'value': name, 'count': count} for name, count in directors.most_common(MAX_DIRECTOR_FACETS)],
+        }
+
+    def _score(self, doc, packed, idf, average_lengths):
+        score = 0.0
+        for index, (_, boost, _) in enumerate(SEARCH_FIELDS):
+            freq = (packed >> (index * TF_BITS)) & TF_MAX
+            if not freq:
+                continue
+            norm = 1 - BM25_B + BM25_B * self._field_lengths[index][doc] / average_lengths[index]
+            score += boost * freq * (BM25_K1 + 1) / (freq + BM25_K1 * norm)
+        return idf * score
+
+
+movie_search_index = MovieSearchIndex()
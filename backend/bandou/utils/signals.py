@@ -1,21 +1,248 @@
-from django.db.models import Avg
-from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
-from bandou.models import Rating
+from collections import Counter, defaultdict
 
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.db import transaction
+from django.dispatch import receiver, Signal
+from bandou.models import Rating, Movie, Comments
+from bandou.utils.content_similarity import CONTENT_FIELDS, similar_movies_updater
+from bandou.utils.genres import sync_movie_genres, sync_genres_for_movies
+from bandou.utils.movie_change_feed import mark_movies_changed
+from bandou.utils.movie_ranking import update_movie_rankings
+from bandou.utils.rating_aggregates import apply_rating_delta, apply_histogram_deltas, histogram_field, \
+    apply_rollup_deltas, rating_day
+from bandou.utils.recommendation_cache import invalidate_user_recommendations
+from bandou.utils.search_index import movie_search_index
+from bandou.utils.suggest_index import movie_suggest_index
+from bandou.utils.trending import record_movie_event, remove_trending_movies, EVENT_RATING, EVENT_COMMENT
+from bandou.utils.user_rating_cache import set_cached_rating, invalidate_user_ratings
 
-@receiver([post_save, post_delete], sender=Rating)
-def update_movie_score(sender, instance, **kwargs):
+# 批量写入电影(bulk_create/bulk_update，不触发post_save)后发送，参数movie_ids为受影响的电影id列表，
+# 可选参数content_changed_ids为其中新增或 CONTENT_FIELDS 有变化的电影id列表，未提供时视为全部电影
+movies_bulk_saved = Signal()
+
+# 批量写入评分(不触发post_save)并已更新电影评分统计后，在同一事务中发送
+# 参数movie_ids为评分统计变化的电影id列表，user_ids为评分变化的用户id列表，created_movie_ids为每条新增评分对应的电影id
+ratings_bulk_saved = Signal()
+
+
+@receiver(pre_save, sender=Rating)
+def remember_previous_rating(sender, instance, **kwargs):
+    """
+    评分更新前记录数据库中的旧评分和评分时间，用于计算增量
+    """
+    if instance._state.adding:
+        instance._previous_rating, instance._previous_rating_time = None, None
+    else:
+        instance._previous_rating, instance._previous_rating_time = Rating.objects.filter(pk=instance.pk).values_list(
+            'rating', 'rating_time').first() or (None, None)
+
+
+@receiver(post_save, sender=Rating)
+def update_movie_score(sender, instance, created, **kwargs):
+    """
+    当评分创建或更新时，增量更新对应电影的评分总和、人数、评分分布和 score 字段，并通知索引评分已变化
+    """
+    previous = getattr(instance, '_previous_rating', None)
+    rating = float(instance.rating)  # 表单提交的评分在写入后仍是字符串
+    histogram = Counter({histogram_field(rating): 1})
+    if created or previous is None:
+        apply_rating_delta(instance.movie_id, rating, 1)
+    elif rating != previous:
+        apply_rating_delta(instance.movie_id, rating - previous, 0)
+        histogram[histogram_field(previous)] -= 1
+    else:
+        return
+    apply_histogram_deltas({instance.movie_id: histogram})
+    publish_movie_changes([instance.movie_id])
+
+
+def _deleting_movie(origin):
+    """评分是否因电影被删除而级联删除，此时电影的评分统计、分布和每日汇总随电影一起删除，无需更新"""
+    return isinstance(origin, Movie) or getattr(origin, 'model', None) is Movie
+
+
+@receiver(post_delete, sender=Rating)
+def revert_movie_score(sender, instance, origin=None, **kwargs):
+    """
+    当评分删除时，从对应电影的评分统计和评分分布中扣除该评分，并通知索引评分已变化
+    """
+    if _deleting_movie(origin):
+        return
+    apply_rating_delta(instance.movie_id, -instance.rating, -1)
+    apply_histogram_deltas({instance.movie_id: {histogram_field(instance.rating): -1}})
+    publish_movie_changes([instance.movie_id])
+
+
+@receiver(post_save, sender=Rating)
+def update_rating_rollup(sender, instance, created, **kwargs):
+    """
+    评分创建或更新后，将评分计入评分时间所在日期的每日汇总；更新时评分时间随之变化，旧评分从原日期的汇总中扣除
+    """
+    deltas = defaultdict(lambda: [0.0, 0])
+    previous = getattr(instance, '_previous_rating', None)
+    previous_time = getattr(instance, '_previous_rating_time', None)
+    if not created and previous is not None:
+        old = deltas[(instance.movie_id, rating_day(previous_time))]
+        old[0] -= previous
+        old[1] -= 1
+    new = deltas[(instance.movie_id, rating_day(instance.rating_time))]
+    new[0] += float(instance.rating)
+    new[1] += 1
+    apply_rollup_deltas(deltas)
+
+
+@receiver(post_delete, sender=Rating)
+def revert_rating_rollup(sender, instance, origin=None, **kwargs):
+    """
+    评分删除后，从评分时间所在日期的每日汇总中扣除
+    """
+    if _deleting_movie(origin):
+        return
+    apply_rollup_deltas({(instance.movie_id, rating_day(instance.rating_time)): (-instance.rating, -1)})
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_recommendation_cache(sender, instance, **kwargs):
+    """
+    用户的评分创建、修改或删除后，事务提交时删除其推荐缓存
+    """
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_user_recommendations(user_id))
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def sync_user_rating_cache(sender, instance, created=False, **kwargs):
+    """
+    用户的评分创建、修改或删除后，事务提交时同步其评分缓存
+    """
+    user_id, movie_id = instance.user_id, instance.movie_id
+    rating = None if kwargs['signal'] is post_delete else instance.rating
+    transaction.on_commit(lambda: set_cached_rating(user_id, movie_id, rating))
+
+
+@receiver(post_save, sender=Movie)
+def update_movie_genres(sender, instance, update_fields=None, **kwargs):
+    """
+    当电影创建或其type字段修改时，同步电影与类别的关联
+    """
+    if update_fields is not None and 'type' not in update_fields:
+        return
+    sync_movie_genres(instance)
+
+
+@receiver(movies_bulk_saved, sender=Movie)
+def update_bulk_movie_genres(sender, movie_ids, **kwargs):
+    """
+    批量写入电影后，同步这些电影与类别的关联
+    """
+    sync_genres_for_movies(movie_ids)
+
+
+def publish_movie_changes(movie_ids):
+    """
+    事务提交后通知搜索和补全索引：本进程直接标记，其他进程通过redis变更记录同步；同时更新redis中的电影榜单
+    """
+    movie_ids = list(movie_ids)
+
+    def publish():
+        movie_search_index.mark_changed(movie_ids)
+        movie_suggest_index.mark_changed(movie_ids)
+        mark_movies_changed(movie_ids)
+        update_movie_rankings(movie_ids)
+
+    transaction.on_commit(publish)
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def update_movie_search_index(sender, instance, **kwargs):
+    """
+    电影创建、修改或删除后，刷新其搜索索引
+    """
+    publish_movie_changes([instance.pk])
+
+
+@receiver(movies_bulk_saved, sender=Movie)
+def update_bulk_movie_search_index(sender, movie_ids, **kwargs):
+    """
+    批量写入电影后，刷新这些电影的搜索索引
+    """
+    publish_movie_changes(movie_ids)
+
+
+@receiver(pre_save, sender=Movie)
+def remember_previous_content(sender, instance, update_fields=None, **kwargs):
+    """
+    电影更新前记录数据库中参与内容相似度计算的字段，保存后比较是否真的发生变化
+    """
+    instance._previous_content = None
+    if instance._state.adding or (update_fields is not None and not set(update_fields) & set(CONTENT_FIELDS)):
+        return
+    instance._previous_content = Movie.objects.filter(pk=instance.pk).values_list(*CONTENT_FIELDS).first()
+
+
+@receiver(post_save, sender=Movie)
+def update_similar_movies_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """
+    电影创建或其简介、导演、主演、类别的值发生变化后，在后台增量更新相似电影
+    """
+    if not created:
+        if update_fields is not None and not set(update_fields) & set(CONTENT_FIELDS):
+            return
+        previous = getattr(instance, '_previous_content', None)
+        if previous is not None and previous == tuple(getattr(instance, field) for field in CONTENT_FIELDS):
+            return
+    movie_id = instance.pk
+    transaction.on_commit(lambda: similar_movies_updater.schedule([movie_id]))
+
+
+@receiver(movies_bulk_saved, sender=Movie)
+def update_bulk_similar_movies(sender, movie_ids, content_changed_ids=None, **kwargs):
+    """
+    批量写入电影后，在后台增量更新其中新增或内容有变化的电影的相似电影
+    """
+    movie_ids = list(movie_ids if content_changed_ids is None else content_changed_ids)
+    if movie_ids:
+        transaction.on_commit(lambda: similar_movies_updater.schedule(movie_ids))
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_save, sender=Comments)
+def record_trending_event(sender, instance, created, **kwargs):
+    """
+    新的评分或评论提交后，为对应电影累计热度
+    """
+    if not created:
+        return
+    movie_id = instance.movie_id
+    event = EVENT_RATING if sender is Rating else EVENT_COMMENT
+    transaction.on_commit(lambda: record_movie_event(movie_id, event))
+
+
+@receiver(post_delete, sender=Movie)
+def remove_deleted_movie_from_trending(sender, instance, **kwargs):
+    """
+    电影删除后，将其移出热门榜
+    """
+    movie_id = instance.pk
+    transaction.on_commit(lambda: remove_trending_movies([movie_id]))
+
+
+@receiver(ratings_bulk_saved, sender=Rating)
+def publish_bulk_rating_changes(sender, movie_ids, user_ids, created_movie_ids, **kwargs):
     """
-    当评分创建、更新或删除时，自动更新对应电影的 score 字段
+    批量写入评分后，通知索引和榜单评分已变化，删除相关用户的推荐缓存和评分缓存，并为新增评分累计电影热度
     """
-    movie = instance.movie
+    publish_movie_changes(movie_ids)
+    user_ids, created = list(user_ids), Counter(created_movie_ids)
 
-    # 计算最新平均分
-    avg_rating = Rating.objects.filter(
-        movie=movie
-    ).aggregate(avg=Avg('rating'))['avg']
+    def publish():
+        for user_id in user_ids:
+            invalidate_user_recommendations(user_id)
+        invalidate_user_ratings(user_ids)
+        for movie_id, count in created.items():
+            record_movie_event(movie_id, EVENT_RATING, count)
 
-    # 更新 score 字段
-    movie.score = round(avg_rating, 1) if avg_rating else None
-    movie.save(update_fields=['score'])
+    transaction.on_commit(publish)
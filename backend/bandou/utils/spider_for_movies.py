@@ -1,4 +1,8 @@
+import asyncio
+import re
 import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
 
 import requests
 import random
@@ -18,7 +22,17 @@ from apscheduler.schedulers.blocking import BlockingScheduler
 # 配置Django环境
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BanDou_Movie.settings')
 django.setup()
+from django.db import connection, transaction
+from django.db.models import Q
 from bandou.models import Movie
+from bandou.utils.als import train_als_model
+from bandou.utils.content_similarity import CONTENT_FIELDS, build_similar_movies
+from bandou.utils.item_cf import build_movie_neighbors
+from bandou.utils.movie_ranking import rebuild_movie_rankings
+from bandou.utils.rating_aggregates import MOVIE_SCORE_EXPRESSION
+from bandou.utils.rating_buffer import flush_rating_buffer, rating_buffer_enabled
+from bandou.utils.signals import movies_bulk_saved
+from bandou.utils.trending import renormalize_trending
 
 # User-Agent列表
 USER_AGENTS = [
@@ -47,105 +61,388 @@ CITIES = [
     "nanjing", "chengdu", "wuhan", "xian", "chongqing"
 ]
 
+# 并发抓取配置
+ASYNC_CONCURRENCY = 5  # 同时进行的详情页请求数
+ASYNC_RATE_PER_HOST = 1.0  # 每个域名每秒补充的请求令牌数
+ASYNC_BURST_PER_HOST = 3  # 每个域名允许的突发请求数
+ASYNC_MAX_PER_PROXY = 2  # 每个代理同时承载的请求数
+ASYNC_PROXY_BAN_SECONDS = 300  # 代理连接失败或被限流后暂停使用的时长(秒)
+ASYNC_MAX_RETRIES = 3  # 失败重试次数
+ASYNC_BACKOFF_BASE = 1.0  # 重试退避基数(秒)
+ASYNC_REQUEST_TIMEOUT = (5, 15)  # 连接/读取超时(秒)
 
-def fetch_movies():
-    headers = {
+# 批量入库配置
+SAVE_BATCH_SIZE = 100  # 每条upsert语句包含的电影数
+UPSERT_FIELDS = ["title", "brief_introduction", "cover_url", "score", "release_time", "director", "starring", "type"]
+
+
+def get_request_headers():
+    return {
         "User-Agent": random.choice(USER_AGENTS),
         "Cookie": 'bid=qbLX4HJaR2A; ll="118305"; push_noty_num=0; push_doumail_num=0; dbcl2="261504977:WbuJe+GqX+E"; ck=ZFwx; _ck_desktop_mode=1; vmode=pc; frodotk_db="9ae4195bca28ca43d0ac4c135e7a5ec9"',
         "Referer": "https://movie.douban.com/"
     }
+
+
+def get_request_proxies(proxy=None):
+    """requests按目标url的协议选择代理，豆瓣为https，需要同时配置http和https"""
+    proxy = proxy or random.choice(PROXY_POOL)
+    return {"http": proxy, "https": proxy}
+
+
+def fetch_movie_detail_urls(headers):
+    """抓取正在热映列表页，返回每个电影详情页的url"""
     movie_html_url = f"https://movie.douban.com/cinema/nowplaying/{random.choice(CITIES)}/"
     flag = False  # 是否需要进行人机验证
-    try:
-        movie_resp = requests.get(movie_html_url, headers=headers, proxies={"http": random.choice(PROXY_POOL)})
+    movie_resp = requests.get(movie_html_url, headers=headers, proxies=get_request_proxies())
+
+    # 需要进行人机验证时进行提示
+    if "证明你是人类" in movie_resp.text:
+        input("请手动前往网页进行验证后回车继续...")  # 输入阻塞，等待人工验证
+        flag = True
+
+    # 若进行了人机验证，则重新请求
+    if flag:
+        movie_resp = requests.get(movie_html_url, headers=headers, proxies=get_request_proxies())
+
+    movie_et = etree.HTML(movie_resp.text)
+    # print(movie_resp.text)
+    # 获取每个电影详情页的url
+    return movie_et.xpath("//li[@class='poster']/a[@class='ticket-btn']/@href")
+
+
+def parse_movie_detail(html):
+    """
+    解析电影详情页
+    :return: 电影字段字典；主演信息过长等不予收录的电影返回None
+    """
+    movie_detail_et = etree.HTML(html)
+    # html页面提取对应数据
+    title = movie_detail_et.xpath("//span[@property='v:itemreviewed']/text()")
+    cover_url = movie_detail_et.xpath("//img[@rel='v:image']/@src")
+    score = movie_detail_et.xpath("//strong[@property='v:average']/text()")
+    director = movie_detail_et.xpath("//a[@rel='v:directedBy']/text()")
+    starring = movie_detail_et.xpath("//a[@rel='v:starring']/text()")
+    type_name = movie_detail_et.xpath("//span[@property='v:genre']/text()")
+    release_time = movie_detail_et.xpath("//span[@property='v:initialReleaseDate']/text()")[0]
+    brief_introduction = movie_detail_et.xpath("//span[@property='v:summary']/text()")
+    # 将提取到的数据列表转为字符串
+    type_name = " / ".join(type_name)
+    director = "".join(director)
+    title = "".join(title)
+    cover_url = "".join(cover_url)
+    release_time = datetime.fromisoformat(release_time[:10]).date()
+
+    if not starring:
+        starring = "无"
+    else:
+        starred_actors = " / ".join(starring)
+        if len(starred_actors) > 255:
+            print(f"跳过电影《{''.join(title)}》：主演信息过长")
+            return None
+        starring = starred_actors
+
+    if score:
+        score = round(float("".join(score)) / 2, 1)
+    else:
+        score = None
+
+    brief_introduction = "".join(brief_introduction).strip().replace('\n', '').replace(' ', '').replace(
+        '<br/>',
+        '').replace(
+        '<br />', '')
+    return {
+        "title": title,
+        "brief_introduction": brief_introduction,
+        "cover_url": cover_url,
+        "score": score,
+        "release_time": release_time,
+        "director": director,
+        "starring": starring,
+        "type": type_name
+    }
 
-        # 需要进行人机验证时进行提示
-        if "证明你是人类" in movie_resp.text:
-            input("请手动前往网页进行验证后回车继续...")  # 输入阻塞，等待人工验证
-            flag = True
 
-        # 若进行了人机验证，则重新请求
-        if flag:
-            movie_resp = requests.get(movie_html_url, headers=headers, proxies={"http": random.choice(PROXY_POOL)})
+def extract_douban_id(detail_url):
+    """从详情页url(https://movie.douban.com/subject/<id>/)中提取豆瓣id"""
+    match = re.search(r"/subject/(\d+)", detail_url or "")
+    return match.group(1) if match else None
 
-        movie_et = etree.HTML(movie_resp.text)
-        # print(movie_resp.text)
-        # 获取每个电影详情页的url
-        movies_detail_url_list = movie_et.xpath("//li[@class='poster']/a[@class='ticket-btn']/@href")
+
+def save_movies(movies):
+    """
+    批量入库：按豆瓣id去重，新电影插入、已有电影更新评分和元数据，
+    语句数与电影数量基本无关(查询已有电影1次 + 每批1次upsert + 类别同步)
+    """
+    records = {}
+    dropped = []
+    for movie in movies:
+        if movie.get("douban_id"):
+            records[movie["douban_id"]] = movie  # 同一电影出现多次时以最后一次为准
+        else:
+            dropped.append(movie.get("title", "未知电影"))
+    if dropped:
+        logger.warning(f"{len(dropped)} 部电影缺少豆瓣id，未入库: {', '.join(dropped)}")
+    if not records:
+        return
+
+    douban_ids = list(records)
+    titles = [movie["title"] for movie in records.values()]
+    existing = list(
+        Movie.objects.filter(Q(douban_id__in=douban_ids) | Q(douban_id__isnull=True, title__in=titles))
+        .values("id", "douban_id", "title", "rating_count", "score", *CONTENT_FIELDS)
+    )
+    by_douban_id = {row["douban_id"]: row for row in existing if row["douban_id"]}
+    by_title = {row["title"]: row for row in existing if not row["douban_id"]}
+
+    legacy_movies = []  # 引入豆瓣id之前按片名入库的电影，补上豆瓣id以便参与upsert
+    for douban_id, movie in records.items():
+        if douban_id not in by_douban_id and movie["title"] in by_title:
+            row = by_title.pop(movie["title"])
+            row["douban_id"] = douban_id
+            by_douban_id[douban_id] = row
+            legacy_movies.append(Movie(id=row["id"], douban_id=douban_id))
+
+    # 已有用户评分的电影，score由用户评分维护，单独upsert且不更新score，避免写回读取时的旧评分
+    rated_objs, objs = [], []
+    for douban_id, movie in records.items():
+        row = by_douban_id.get(douban_id)
+        (rated_objs if row and row["rating_count"] > 0 else objs).append(Movie(**movie))
+
+    upsert_options = {
+        "update_conflicts": True,
+        "batch_size": SAVE_BATCH_SIZE,
+    }
+    # MySQL的ON DUPLICATE KEY UPDATE不支持指定冲突字段，由douban_id上的唯一索引触发
+    if connection.features.supports_update_conflicts_with_target:
+        upsert_options["unique_fields"] = ["douban_id"]
+
+    with transaction.atomic():
+        if legacy_movies:
+            Movie.objects.bulk_update(legacy_movies, ["douban_id"])
+        if rated_objs:
+            Movie.objects.bulk_create(
+                rated_objs, update_fields=[field for field in UPSERT_FIELDS if field != "score"], **upsert_options
+            )
+        if objs:
+            Movie.objects.bulk_create(objs, update_fields=UPSERT_FIELDS, **upsert_options)
+            # 读取之后才收到首个用户评分的电影会被写入豆瓣评分，按评分统计恢复为用户评分
+            Movie.objects.filter(douban_id__in=[obj.douban_id for obj in objs], rating_count__gt=0) \
+                .update(score=MOVIE_SCORE_EXPRESSION)
+
+    # 新增或简介、导演、主演、类别有变化的电影才需要重新计算相似电影
+    content_changed = {
+        douban_id for douban_id, movie in records.items()
+        if douban_id not in by_douban_id
+        or any(movie.get(field) != by_douban_id[douban_id][field] for field in CONTENT_FIELDS)
+    }
+    saved = dict(Movie.objects.filter(douban_id__in=douban_ids).values_list("id", "douban_id"))
+    movies_bulk_saved.send(sender=Movie, movie_ids=list(saved), content_changed_ids=[
+        movie_id for movie_id, douban_id in saved.items() if douban_id in content_changed
+    ])
+
+    created_count = len(records) - len(by_douban_id)
+    logger.info(f"入库完成：新增 {created_count} 部电影，更新 {len(by_douban_id)} 部电影")
+
+
+def fetch_movies():
+    """逐个顺序抓取电影详情页(每次请求间随机延时)"""
+    headers = get_request_headers()
+    try:
+        movies_detail_url_list = fetch_movie_detail_urls(headers)
 
         logger.info(f"找到 {len(movies_detail_url_list)} 部电影，开始抓取...")
 
+        movies = []
         for movie_detail_url in movies_detail_url_list:
             title = "未知电影"  # 初始化title，防止异常处理中引用未定义变量
             try:
                 time.sleep(random.uniform(1, 3))  # 随机延时，避免请求过于频繁
 
                 movie_detail_resp = requests.get(movie_detail_url, headers=headers)
-                movie_detail_et = etree.HTML(movie_detail_resp.text)
-                # html页面提取对应数据
-                title = movie_detail_et.xpath("//span[@property='v:itemreviewed']/text()")
-                cover_url = movie_detail_et.xpath("//img[@rel='v:image']/@src")
-                score = movie_detail_et.xpath("//strong[@property='v:average']/text()")
-                director = movie_detail_et.xpath("//a[@rel='v:directedBy']/text()")
-                starring = movie_detail_et.xpath("//a[@rel='v:starring']/text()")
-                type_name = movie_detail_et.xpath("//span[@property='v:genre']/text()")
-                release_time = movie_detail_et.xpath("//span[@property='v:initialReleaseDate']/text()")[0]
-                brief_introduction = movie_detail_et.xpath("//span[@property='v:summary']/text()")
-                # 将提取到的数据列表转为字符串
-                type_name = " / ".join(type_name)
-                director = "".join(director)
-                title = "".join(title)
-                cover_url = "".join(cover_url)
-                release_time = datetime.fromisoformat(release_time[:10]).date()
-
-                if not starring:
-                    starring = "无"
-                else:
-                    starred_actors = " / ".join(starring)
-                    if len(starred_actors) > 255:
-                        print(f"跳过电影《{''.join(title)}》：主演信息过长")
-                        continue
-                    starring = starred_actors
-
-                if score:
-                    score = round(float("".join(score)) / 2, 1)
-                else:
-                    score = None
-
-                brief_introduction = "".join(brief_introduction).strip().replace('\n', '').replace(' ', '').replace(
-                    '<br/>',
-                    '').replace(
-                    '<br />', '')
-                # 存入数据库（防止重复存入）
-                movie_obj, created = Movie.objects.get_or_create(
-                    title=title,
-                    defaults={
-                        "brief_introduction": brief_introduction,
-                        "cover_url": cover_url,
-                        "score": score,
-                        "release_time": release_time,
-                        "director": director,
-                        "starring": starring,
-                        "type": type_name
-                    }
-                )
-                if created:
-                    print(f"电影《{title}》已添加到数据库！")
-                else:
-                    print(f"电影《{title}》已存在，跳过。")
+                movie = parse_movie_detail(movie_detail_resp.text)
+                if movie is None:
+                    continue
+                title = movie["title"]
+                movie["douban_id"] = extract_douban_id(movie_detail_url)
+                movies.append(movie)
             except Exception as e:
                 logger.error(f"抓取电影《{title}》失败：{str(e)}")
+
+        save_movies(movies)
+    except Exception as e:
+        logger.error(f"抓取电影列表失败：{str(e)}")
+
+
+class TokenBucket:
+    """
+    令牌桶限速器：以rate个/秒的速度补充令牌，最多积攒capacity个，每次请求消耗一个
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                # 持有锁等待，保证令牌按请求到达顺序发放
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostRateLimiter:
+    """按域名分别限速，每个域名一个令牌桶"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.buckets = {}
+
+    async def acquire(self, url):
+        host = urlparse(url).netloc
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = self.buckets[host] = TokenBucket(self.rate, self.capacity)
+        await bucket.acquire()
+
+
+class ProxyAllocator:
+    """
+    代理并发计数：每次请求选择当前并发数最少的代理，
+    所有代理都达到并发上限时等待有代理空闲；连接失败或被限流的代理暂停使用ban_seconds秒
+    """
+
+    def __init__(self, proxies, max_per_proxy, ban_seconds=ASYNC_PROXY_BAN_SECONDS):
+        self.max_per_proxy = max_per_proxy
+        self.ban_seconds = ban_seconds
+        self.in_flight = {proxy: 0 for proxy in proxies}
+        self.banned_until = {}
+        self.condition = asyncio.Condition()
+
+    def _candidates(self):
+        """未达到并发上限的代理，优先使用未被暂停的；全部被暂停时不等待解除，仍在其中选择"""
+        now = time.monotonic()
+        idle = [proxy for proxy, count in self.in_flight.items() if count < self.max_per_proxy]
+        return [proxy for proxy in idle if self.banned_until.get(proxy, 0) <= now] or idle
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: min(self.in_flight.values()) < self.max_per_proxy)
+            candidates = self._candidates()
+            least = min(self.in_flight[proxy] for proxy in candidates)
+            proxy = random.choice([p for p in candidates if self.in_flight[p] == least])
+            self.in_flight[proxy] += 1
+        try:
+            yield proxy
+        finally:
+            async with self.condition:
+                self.in_flight[proxy] -= 1
+                self.condition.notify()
+
+    def ban(self, proxy):
+        """暂停使用代理，之后的请求(包括重试)换用其他代理"""
+        self.banned_until[proxy] = time.monotonic() + self.ban_seconds
+        logger.warning(f"代理 {proxy} 请求失败，暂停使用 {self.ban_seconds} 秒")
+
+
+async def fetch_with_retry(url, headers, rate_limiter, proxies):
+    """限速后通过代理请求页面，失败时按带随机抖动的指数退避重试，连接失败或被限流的代理暂停使用"""
+    for attempt in range(ASYNC_MAX_RETRIES + 1):
+        await rate_limiter.acquire(url)
+        async with proxies.acquire() as proxy:
+            try:
+                # requests为同步库，放到线程池中执行，不阻塞事件循环
+                resp = await asyncio.to_thread(
+                    requests.get, url, headers=headers, proxies=get_request_proxies(proxy),
+                    timeout=ASYNC_REQUEST_TIMEOUT
+                )
+            except requests.RequestException as e:
+                resp, error = None, e
+        if resp is not None:
+            if resp.status_code == 200:
+                return resp.text
+            error = requests.HTTPError(f"HTTP {resp.status_code}")
+            # 仅对限流和服务端错误重试
+            if resp.status_code != 429 and resp.status_code < 500:
+                raise error
+        if resp is None or resp.status_code == 429:
+            proxies.ban(proxy)
+        if attempt == ASYNC_MAX_RETRIES:
+            raise error
+        await asyncio.sleep(random.uniform(0, ASYNC_BACKOFF_BASE * 2 ** attempt))
+
+
+async def crawl_movie_details(urls, headers):
+    """
+    并发抓取并解析电影详情页，并发数受信号量限制，请求速度受每个域名的令牌桶限制
+    :return: 解析成功的电影字段字典列表
+    """
+    semaphore = asyncio.Semaphore(ASYNC_CONCURRENCY)
+    rate_limiter = HostRateLimiter(ASYNC_RATE_PER_HOST, ASYNC_BURST_PER_HOST)
+    proxies = ProxyAllocator(PROXY_POOL, ASYNC_MAX_PER_PROXY)
+
+    async def crawl_one(url):
+        async with semaphore:
+            try:
+                html = await fetch_with_retry(url, headers, rate_limiter, proxies)
+                movie = parse_movie_detail(html)
+                if movie is not None:
+                    movie["douban_id"] = extract_douban_id(url)
+                return movie
+            except Exception as e:
+                logger.error(f"抓取电影详情页 {url} 失败：{str(e)}")
+                return None
+
+    results = await asyncio.gather(*(crawl_one(url) for url in urls))
+    return [movie for movie in results if movie is not None]
+
+
+def fetch_movies_async():
+    """并发抓取电影详情页，抓取完成后统一入库"""
+    headers = get_request_headers()
+    try:
+        movies_detail_url_list = fetch_movie_detail_urls(headers)
     except Exception as e:
         logger.error(f"抓取电影列表失败：{str(e)}")
+        return
+
+    logger.info(f"找到 {len(movies_detail_url_list)} 部电影，开始并发抓取...")
+    started_at = time.monotonic()
+    movies = asyncio.run(crawl_movie_details(movies_detail_url_list, headers))
+    logger.info(f"抓取完成，成功解析 {len(movies)} 部电影，耗时 {time.monotonic() - started_at:.1f} 秒")
+
+    # Django ORM为同步接口，在事件循环结束后再批量入库
+    try:
+        save_movies(movies)
+    except Exception as e:
+        logger.error(f"保存电影失败：{str(e)}")
 
 
 def start_scheduler():
     """
-    启动定时任务调度器，每天定期执行一次抓取任务
+    启动定时任务调度器，定期执行抓取任务、榜单维护和推荐模型的离线计算
     """
     scheduler = BlockingScheduler()
-    scheduler.add_job(fetch_movies, 'cron', hour=6, minute=0, id='movie_spider_job')
-    logger.info("定时任务已设置，将在每天早上6:00执行电影数据抓取")
+    scheduler.add_job(fetch_movies_async, 'cron', hour=6, minute=0, id='movie_spider_job')
+    scheduler.add_job(rebuild_movie_rankings, 'cron', hour=3, minute=30, id='movie_ranking_job')
+    scheduler.add_job(renormalize_trending, 'cron', minute=15, id='trending_job')
+    scheduler.add_job(build_movie_neighbors, 'cron', hour=4, minute=0, id='movie_neighbors_job')
+    scheduler.add_job(train_als_model, 'cron', hour=4, minute=30, id='als_model_job')
+    scheduler.add_job(build_similar_movies, 'cron', hour=5, minute=0, id='similar_movies_job')
+    if rating_buffer_enabled():
+        # 兜底：写入线程所在进程退出时，缓冲区中剩余的评分由定时任务写入
+        scheduler.add_job(flush_rating_buffer, 'interval', minutes=1, id='rating_buffer_job')
+    logger.info("定时任务已设置，将在每天早上6:00执行电影数据抓取，3:30重建电影榜单，4:00重新计算电影近邻，4:30训练ALS推荐模型，5:00重新计算相似电影，每小时重新归一化热门榜")
     try:
         scheduler.start()
     except (KeyboardInterrupt, SystemExit):
@@ -159,5 +456,6 @@ if __name__ == '__main__':
     #     fetch_movies()
 
     # fetch_movies()  # 立即执行一次抓取
+    # fetch_movies_async()  # 立即执行一次并发抓取
 
     start_scheduler()
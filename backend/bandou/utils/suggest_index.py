@@ -0,0 +1,197 @@
+import heapq
+import re
+import unicodedata
+from bisect import bisect_left
+from functools import lru_cache
+
+from bandou.models import Movie
+from bandou.utils.live_index import LiveMovieIndex
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:  # 未安装pypinyin时不提供拼音补全
+    lazy_pinyin = None
+
+SUGGEST_TITLE = 'title'
+SUGGEST_DIRECTOR = 'director'
+SUGGEST_ACTOR = 'actor'
+SUGGEST_KIND_ORDER = {SUGGEST_TITLE: 0, SUGGEST_DIRECTOR: 1, SUGGEST_ACTOR: 2}
+
+MAX_DELTA_ENTRIES = 5000  # 增量条目超过该数量时整体重建
+HEAVY_PREFIX_RANGE = 1000  # 匹配条目超过该数量的前缀在构建时预先计算排名
+HEAVY_PREFIX_TOP = 50  # 预先计算的排名保留的建议数，不小于接口允许的最大limit
+
+_CJK_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+_SPACE_RE = re.compile(r'\s+')
+_KEY_END = '\U0010ffff'
+
+
+def normalize_key(text):
+    """补全键：统一为小写半角并去掉空白，便于 "spider man" 与 "spiderman" 互相匹配"""
+    return _SPACE_RE.sub('', unicodedata.normalize('NFKC', text or '').lower())
+
+
+@lru_cache(maxsize=200000)
+def pinyin_keys(title):
+    """中文片名的全拼和拼音首字母，如 星际穿越 -> xingjichuanyue、xjcy；转换较慢，结果在重建之间复用"""
+    if lazy_pinyin is None or not _CJK_RE.search(title):
+        return ()
+    return (
+        normalize_key(''.join(lazy_pinyin(title))),
+        normalize_key(''.join(lazy_pinyin(title, style=Style.FIRST_LETTER))),
+    )
+
+
+def split_names(value):
+    """拆分主演等以 / 分隔的人名，忽略占位的 "无" """
+    return [name.strip() for name in (value or '').split('/') if name.strip() and name.strip() != '无']
+
+
+def movie_entries(movie_id, title, director, starring):
+    """
+    生成一部电影的补全条目 (键, 电影id, 类型, 展示文本)
+    外文译名如 克里斯托弗·诺兰 额外以 诺兰 等各段作为键
+    """
+    entries = []
+    keys = {normalize_key(title), *pinyin_keys(title)}
+    entries.extend((key, movie_id, SUGGEST_TITLE, title) for key in keys if key)
+
+    people = [(name, SUGGEST_DIRECTOR) for name in split_names(director)]
+    people += [(name, SUGGEST_ACTOR) for name in split_names(starring)]
+    for name, kind in people:
+        keys = {normalize_key(name), *(normalize_key(part) for part in name.split('·'))}
+        entries.extend((key, movie_id, kind, name) for key in keys if key)
+    return entries
+
+
+class MovieSuggestIndex(LiveMovieIndex):
+    """
+    片名、导演、演员的前缀补全索引
+    全部条目按键排序存放在数组中，前缀查询通过二分定位到连续区间，再按电影评分取前k个。
+    电影变更时不改动已排序的基础数组，而是将其标记为已移除并把新条目放入较小的增量数组，
+    增量过多时整体重建。单字、常见姓氏等匹配条目很多的前缀在构建时预先计算好排名，查询时不再扫描整个区间
+    """
+    state_fields = ('_keys', '_entries', '_delta_keys', '_delta_entries', '_removed', '_scores', '_heavy_prefixes')
+
+    def __init__(self):
+        super().__init__()
+        self._reset()
+
+    def _reset(self):
+        self._keys = []
+        self._entries = []
+        self._delta_keys = []
+        self._delta_entries = []
+        self._removed = set()
+        self._scores = {}
+        self._heavy_prefixes = {}
+
+    def suggest(self, prefix, limit=10):
+        """
+        :return: [{'text', 'type', 'movie_id', 'score'}]，按电影评分降序；同一人名只出现一次，取其评分最高的电影
+        """
+        key = normalize_key(prefix)
+        if not key:
+            return []
+        self.refresh()
+        with self._lock:
+            best = {}
+            ranked = self._heavy_prefixes.get(key)
+            if ranked is not None:
+                ranked = [item for item in ranked if item[1] not in self._removed]
+            if ranked is not None and len(ranked) >= limit:
+                for item in ranked:
+                    self._merge(best, item)
+                self._collect(best, self._range_entries(self._delta_keys, self._delta_entries, key))
+            else:
+                self._collect(best, self._range_entries(self._keys, self._entries, key, self._removed))
+                self._collect(best, self._range_entries(self._delta_keys, self._delta_entries, key))
+            return [
+                {'text': text, 'type': kind, 'movie_id': movie_id, 'score': score}
+                for _, movie_id, kind, text, score in self._top(best, limit)
+            ]
+
+    def _collect(self, best, entries):
+        for movie_id, kind, text in entries:
+            score = self._scores.get(movie_id)
+            rank = (score if score is not None else -1, -movie_id)
+            self._merge(best, (rank, movie_id, kind, text, score))
+
+    @staticmethod
+    def _merge(best, item):
+        # 人名在多部电影中出现时合并为一条建议，片名则每部电影各一条
+        rank, movie_id, kind, text, _ = item
+        group = (kind, text) if kind != SUGGEST_TITLE else (kind, movie_id)
+        current = best.get(group)
+        if current is None or rank > current[0]:
+            best[group] = item
+
+    @staticmethod
+    def _top(best, limit):
+        return heapq.nsmallest(
+            limit, best.values(),
+            key=lambda item: (-item[0][0], SUGGEST_KIND_ORDER[item[2]], item[3], -item[0][1])
+        )
+
+    @staticmethod
+    def _range_entries(keys, entries, key, removed=None):
+        start = bisect_left(keys, key)
+        end = bisect_left(keys, key + _KEY_END, start)
+        if not removed:
+            return entries[start:end]
+        return [entry for entry in entries[start:end] if entry[0] not in removed]
+
+    def _rank_heavy_prefixes(self):
+        """逐层找出匹配条目超过 HEAVY_PREFIX_RANGE 的前缀，预先计算其排名"""
+        frontier = ['']
+        while frontier:
+            next_frontier = []
+            for prefix in frontier:
+                start = bisect_left(self._keys, prefix)
+                end = bisect_left(self._keys, prefix + _KEY_END, start)
+                position = start
+                while position < end:
+                    if len(self._keys[position]) == len(prefix):
+                        position += 1
+                        continue
+                    child = self._keys[position][:len(prefix) + 1]
+                    child_end = bisect_left(self._keys, child + _KEY_END, position, end)
+                    if child_end - position > HEAVY_PREFIX_RANGE:
+                        best = {}
+                        self._collect(best, self._entries[position:child_end])
+                        self._heavy_prefixes[child] = self._top(best, HEAVY_PREFIX_TOP)
+                        next_frontier.append(child)
+                    position = child_end
+            frontier = next_frontier
+
+    def _build(self):
+        entries = []
+        rows = Movie.objects.values_list('id', 'title', 'director', 'starring', 'score')
+        for movie_id, title, director, starring, score in rows.iterator(chunk_size=2000):
+            self._scores[movie_id] = score
+            entries.extend(movie_entries(movie_id, title, director, starring))
+        entries.sort()
+        self._keys = [entry[0] for entry in entries]
+        self._entries = [entry[1:] for entry in entries]
+        self._rank_heavy_prefixes()
+
+    def _apply_changes(self, movie_ids):
+        self._removed.update(movie_ids)
+        delta = [(key, *entry) for key, entry in zip(self._delta_keys, self._delta_entries)
+                 if entry[0] not in movie_ids]
+        for movie_id in movie_ids:
+            self._scores.pop(movie_id, None)
+
+        rows = Movie.objects.filter(id__in=movie_ids).values_list('id', 'title', 'director', 'starring', 'score')
+        for movie_id, title, director, starring, score in rows:
+            self._scores[movie_id] = score
+            delta.extend(movie_entries(movie_id, title, director, starring))
+        delta.sort()
+        self._delta_keys = [entry[0] for entry in delta]
+        self._delta_entries = [entry[1:] for entry in delta]
+
+    def _needs_rebuild(self):
+        return len(self._delta_keys) > MAX_DELTA_ENTRIES
+
+
+movie_suggest_index = MovieSuggestIndex()
@@ -0,0 +1,129 @@
+import logging
+import math
+import time
+
+import redis
+from django.conf import settings
+
+from bandou.utils.get_redis_instance import get_redis_instance, register_script
+
+logger = logging.getLogger(__name__)
+
+TRENDING_KEY = "movie_trending"  # 有序集合：成员为电影id，分值为以基准时间折算的热度
+EPOCH_KEY = "movie_trending:epoch"  # 基准时间(unix时间戳)
+
+EVENT_RATING = 'rating'
+EVENT_COMMENT = 'comment'
+EVENT_VIEW = 'view'
+
+# 热度按指数衰减：t时刻发生的权重为w的事件，在now时刻的热度为 w·e^(-(now-t)/τ)。
+# 所有电影的热度同比例衰减，因此只需存储 w·e^((t-基准时间)/τ)，各电影的排序与按当前时刻折算的热度一致，
+# 每次事件只需一次ZINCRBY；分值随时间指数增长，由定时任务折算到新的基准时间(重新归一化)
+# KEYS: 热度集合、基准时间；ARGV: 电影id、权重、当前时间、τ(秒)
+RECORD_EVENT_SCRIPT = register_script("""
+local epoch = tonumber(redis.call('GET', KEYS[2]))
+if not epoch then
+    epoch = tonumber(ARGV[3])
+    redis.call('SET', KEYS[2], ARGV[3])
+end
+local increment = tonumber(ARGV[2]) * math.exp((tonumber(ARGV[3]) - epoch) / tonumber(ARGV[4]))
+return redis.call('ZINCRBY', KEYS[1], increment, ARGV[1])
+""")
+
+# 把全部分值折算到当前时间为新的基准，并移除热度已衰减到阈值以下的电影
+# KEYS: 热度集合、基准时间；ARGV: 当前时间、τ(秒)、最小热度
+RENORMALIZE_SCRIPT = register_script("""
+local epoch = tonumber(redis.call('GET', KEYS[2]))
+if not epoch then
+    return 0
+end
+local factor = math.exp(-(tonumber(ARGV[1]) - epoch) / tonumber(ARGV[2]))
+local entries = redis.call('ZRANGE', KEYS[1], 0, -1, 'WITHSCORES')
+for i = 1, #entries, 2 do
+    redis.call('ZADD', KEYS[1], tonumber(entries[i + 1]) * factor, entries[i])
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[3])
+redis.call('SET', KEYS[2], ARGV[1])
+return redis.call('ZCARD', KEYS[1])
+""")
+
+
+def get_trending_config():
+    config = getattr(settings, 'TRENDING', {})
+    return {
+        'half_life': config.get('HALF_LIFE_HOURS', 72) * 3600,
+        'weights': {
+            EVENT_RATING: config.get('RATING_WEIGHT', 3),
+            EVENT_COMMENT: config.get('COMMENT_WEIGHT', 2),
+            EVENT_VIEW: config.get('VIEW_WEIGHT', 1),
+        },
+        'min_score': config.get('MIN_SCORE', 0.01),
+    }
+
+
+def _decay_seconds(config):
+    """半衰期换算为衰减时间常数τ"""
+    return config['half_life'] / math.log(2)
+
+
+def record_movie_event(movie_id, event, count=1):
+    """记录count次评分、评论或浏览详情，一次redis往返；redis不可用时只记录日志"""
+    config = get_trending_config()
+    try:
+        RECORD_EVENT_SCRIPT(
+            keys=[TRENDING_KEY, EPOCH_KEY],
+            args=[movie_id, config['weights'][event] * count, time.time(), _decay_seconds(config)],
+            client=get_redis_instance()
+        )
+    except redis.RedisError as e:
+        logger.warning(f"记录电影热度失败: {str(e)}")
+
+
+def remove_trending_movies(movie_ids):
+    """电影删除后从热度榜中移除"""
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return
+    try:
+        get_redis_instance().zrem(TRENDING_KEY, *movie_ids)
+    except redis.RedisError as e:
+        logger.warning(f"移除电影热度失败: {str(e)}")
+
+
+def renormalize_trending():
+    """
+    定时任务：把热度折算到当前时间，避免分值随基准时间推移无限增长，并清理已不再热门的电影
+    :return: 热度榜中剩余的电影数，redis不可用时返回None
+    """
+    config = get_trending_config()
+    try:
+        count = RENORMALIZE_SCRIPT(
+            keys=[TRENDING_KEY, EPOCH_KEY], args=[time.time(), _decay_seconds(config), config['min_score']],
+            client=get_redis_instance()
+        )
+    except redis.RedisError as e:
+        logger.warning(f"热度榜重新归一化失败: {str(e)}")
+        return None
+    logger.info(f"热度榜重新归一化完成，剩余 {count} 部电影")
+    return count
+
+
+def get_trending_page(offset, limit):
+    """
+    读取热度榜的一页，一次redis往返，耗时与电影总数和评分、评论数量无关
+    :return: ([(电影id, 当前热度)], 榜单总数)，redis不可用时返回None
+    """
+    config = get_trending_config()
+    try:
+        pipe = get_redis_instance().pipeline(transaction=False)
+        pipe.get(EPOCH_KEY)
+        pipe.zcard(TRENDING_KEY)
+        pipe.zrevrange(TRENDING_KEY, offset, offset + limit - 1, withscores=True)
+        epoch, total, entries = pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"读取热度榜失败: {str(e)}")
+        return None
+
+    # 折算为当前时刻的热度，便于展示
+    factor = math.exp(-(time.time() - float(epoch)) / _decay_seconds(config)) if epoch else 1.0
+    return [(int(movie_id), round(score * factor, 4)) for movie_id, score in entries], total
@@ -0,0 +1,104 @@
+import logging
+
+import redis
+from django.conf import settings
+
+from bandou.models import Rating
+from bandou.utils.get_redis_instance import get_redis_instance, register_script
+
+logger = logging.getLogger(__name__)
+
+USER_KEY = "user_ratings:{}"  # 哈希：字段为电影id，值为该用户的评分，未评分为 NOT_RATED
+VERSION_KEY = "user_ratings:{}:version"  # 用户评分缓存的版本号，删除缓存时递增
+NOT_RATED = ""
+
+# 版本号与读取数据库前一致时才写回，删除缓存后不会写回删除前读取的评分
+# KEYS: 评分哈希、版本号；ARGV: 读取时的版本号, 过期秒数, 电影id, 评分, ...
+BACKFILL_SCRIPT = register_script("""
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+for i = 3, #ARGV, 2 do
+    redis.call('HSETNX', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+""")
+
+
+def get_user_rating_config():
+    config = getattr(settings, 'MY_RATINGS', {})
+    return {
+        'max_ids': config.get('MAX_IDS', 500),
+        'ttl': config.get('CACHE_TTL', 86400),
+    }
+
+
+def get_user_ratings(user_id, movie_ids):
+    """
+    批量读取用户对多部电影的评分：先一次HMGET读取缓存，未缓存的电影再用一条IN查询读取并写回缓存
+    写回使用HSETNX，不会覆盖读取数据库期间评分信号写入的新评分；读取数据库期间缓存被删除(版本号变化)时不写回
+    :return: {电影id: 评分}，只包含已评分的电影
+    """
+    movie_ids = list(dict.fromkeys(movie_ids))
+    if not movie_ids:
+        return {}
+    key, version_key = USER_KEY.format(user_id), VERSION_KEY.format(user_id)
+    redis_client = get_redis_instance()
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(version_key)
+        pipe.hmget(key, movie_ids)
+        version, cached = pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"读取用户评分缓存失败: {str(e)}")
+        return dict(Rating.objects.filter(user_id=user_id, movie_id__in=movie_ids).values_list('movie_id', 'rating'))
+
+    ratings = {movie_id: float(value) for movie_id, value in zip(movie_ids, cached) if value}
+    missing = [movie_id for movie_id, value in zip(movie_ids, cached) if value is None]
+    if not missing:
+        return ratings
+
+    loaded = dict(Rating.objects.filter(user_id=user_id, movie_id__in=missing).values_list('movie_id', 'rating'))
+    ratings.update(loaded)
+    try:
+        values = [value for movie_id in missing for value in (movie_id, loaded.get(movie_id, NOT_RATED))]
+        BACKFILL_SCRIPT(
+            keys=[key, version_key], args=[version or '', get_user_rating_config()['ttl'], *values],
+            client=redis_client
+        )
+    except redis.RedisError as e:
+        logger.warning(f"写入用户评分缓存失败: {str(e)}")
+    return ratings
+
+
+def set_cached_rating(user_id, movie_id, rating):
+    """
+    评分创建、修改或删除(rating为None)后同步缓存中的对应字段
+    """
+    key = USER_KEY.format(user_id)
+    try:
+        pipe = get_redis_instance().pipeline(transaction=False)
+        pipe.hset(key, movie_id, NOT_RATED if rating is None else rating)
+        pipe.expire(key, get_user_rating_config()['ttl'])
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"更新用户评分缓存失败: {str(e)}")
+
+
+def invalidate_user_ratings(user_ids):
+    """批量写入评分后删除这些用户的评分缓存并递增版本号，下次读取时重新加载"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    ttl = get_user_rating_config()['ttl']
+    try:
+        pipe = get_redis_instance().pipeline()
+        pipe.delete(*[USER_KEY.format(user_id) for user_id in user_ids])
+        for user_id in user_ids:
+            # 版本号比缓存多保留一个有效期，覆盖读取数据库期间的写回
+            pipe.incr(VERSION_KEY.format(user_id))
+            pipe.expire(VERSION_KEY.format(user_id), ttl * 2)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"删除用户评分缓存失败: {str(e)}")
@@ -1,13 +1,12 @@
 import urllib.parse
 from datetime import timedelta
-import requests
 import random
 import logging
 
 logger = logging.getLogger(__name__)  # 获取日志记录器
 
 from django.db import transaction
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified, FileResponse, StreamingHttpResponse
 from django.conf import settings
 from django.core.mail import send_mail
 from django.utils import timezone
@@ -17,9 +16,11 @@ from rest_framework.decorators import action
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import SearchFilter
 from rest_framework.response import Response
-from django.db.models import Value, Case, When, FloatField, Avg, Count, Q
+from rest_framework.utils.urls import replace_query_param
+from django.db.models import Count, Q, F, Window
+from django.db.models.functions import RowNumber
 from django.core.files.storage import default_storage
 from rest_framework import generics, status
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
@@ -27,9 +28,27 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django.contrib.auth import get_user_model
-from bandou.utils.get_redis_instance import get_redis_instance
+from bandou.utils.comment_thread import load_movie_comment_thread
+from bandou.utils.reset_code_store import store_reset_code, clear_reset_code, ResetCodeUnavailable
+from bandou.utils.image_cache import image_cache
+from bandou.utils.image_proxy import image_flights, get_proxy_config, open_upstream_image, UpstreamImageError, \
+    CachingImageStream
+from bandou.utils.movie_ranking import get_ranking_page, start_background_rebuild, RankingUnavailable
+from bandou.utils.pagination import MovieCursorPagination
+from bandou.utils.rating_aggregates import HISTOGRAM_FIELDS, rating_day
+from bandou.utils.rating_buffer import rating_buffer_enabled, buffer_rating, get_buffered_rating, get_buffered_ratings
+from bandou.utils.rating_import import import_ratings, get_bulk_rating_config, parse_rating
+from bandou.utils.recommendation_cache import get_cached_recommendations, cache_user_recommendations, \
+    cache_shared_recommendations, get_cache_stats
+from bandou.utils.recommenders import recommend_for_user
+from bandou.utils.score_buckets import SCORE_BUCKETS, NO_SCORE_BUCKET, score_bucket_filter
+from bandou.utils.search_index import movie_search_index
+from bandou.utils.suggest_index import movie_suggest_index
+from bandou.utils.trending import record_movie_event, get_trending_page, EVENT_VIEW
+from bandou.utils.user_rating_cache import get_user_ratings, get_user_rating_config
 from bandou.utils.user_auth import get_tokens_for_user
-from bandou.models import Movie, Rating, Comments, User, LoginRecord
+from bandou.models import Movie, Rating, Comments, User, LoginRecord, Genre, MovieGenre, SimilarMovie, \
+    RatingDailyRollup
 from bandou.serializers import MovieModelSerializer, UserModelSerializer, UserLoginSerializer, UserProfileSerializer, \
     UserAvatarUploadSerializer, UserPasswordChangeSerializer, RatingSerializer, CommentSerializer, \
     PasswordResetRequestSerializer, PasswordResetConfirmSerializer
@@ -45,25 +64,76 @@ CATEGORY_MAPPING = {
 }
 
 
+def _cached_image_response(request, cached):
+    """
+    由缓存的图片构造响应，客户端携带的ETag未变化时返回304
+    图片文件在读取元数据之后被淘汰时返回None，由调用方改为请求上游
+    """
+    if request.headers.get('If-None-Match') == cached.etag:
+        img_response = HttpResponseNotModified()
+    else:
+        try:
+            image_file = open(cached.path, 'rb')
+        except FileNotFoundError:
+            return None
+        img_response = FileResponse(image_file, content_type=cached.content_type)
+    img_response["ETag"] = cached.etag
+    img_response["Cache-Control"] = "public, max-age=86400"  # 缓存 1 天
+    return img_response
+
+
 @csrf_exempt
 def proxy_bouban_movie_image(request):
     """
     根据cover_url获取电影封面图片
+    优先从服务端磁盘缓存读取；未命中时同一图片的并发请求只由一个请求访问豆瓣，
+    其余请求等待其写入缓存后直接读取
     """
     image_url = request.GET.get("url")
     if not image_url:
         return HttpResponse("URL 参数缺失", status=400)
 
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36 Edg/133.0.0.0"}
-    response = requests.get(image_url, headers=headers)
-
-    if response.status_code == 200:
-        img_response = HttpResponse(response.content, content_type="image/jpeg")
-        img_response["Cache-Control"] = "public, max-age=86400"  # 缓存 1 天
+    cached = image_cache.get(image_url)
+    img_response = _cached_image_response(request, cached) if cached else None
+    if img_response is not None:
         return img_response
-    else:
-        return HttpResponse("获取图片失败", status=response.status_code)
+
+    # 近期获取失败过的图片直接返回失败，不再请求上游
+    if image_cache.is_failed(image_url):
+        return HttpResponse("获取图片失败", status=502)
+
+    done, is_leader = image_flights.begin(image_url)
+    if not is_leader:
+        # 等待正在进行的同一图片请求完成后读取缓存，未能缓存时再自行请求
+        done.wait(get_proxy_config()['wait_timeout'])
+        cached = image_cache.get(image_url)
+        img_response = _cached_image_response(request, cached) if cached else None
+        if img_response is not None:
+            return img_response
+        if image_cache.is_failed(image_url):
+            return HttpResponse("获取图片失败", status=502)
+        return _stream_upstream_image(image_url)
+
+    return _stream_upstream_image(image_url, on_finish=lambda: image_flights.end(image_url))
+
+
+def _stream_upstream_image(image_url, on_finish=None):
+    """从上游流式获取图片并边转发边缓存"""
+    try:
+        upstream = open_upstream_image(image_url)
+    except UpstreamImageError as e:
+        image_cache.mark_failed(image_url)
+        if on_finish is not None:
+            on_finish()
+        return HttpResponse("获取图片失败", status=e.status_code)
+
+    stream = CachingImageStream(image_url, upstream, on_finish=on_finish)
+    img_response = StreamingHttpResponse(stream, content_type=stream.content_type)
+    # 不转发上游的Content-Length：iter_content会解压gzip等编码，实际转发的字节数可能与之不同
+    if upstream.headers.get("ETag"):
+        img_response["ETag"] = upstream.headers["ETag"]
+    img_response["Cache-Control"] = "public, max-age=86400"  # 缓存 1 天
+    return img_response
 
 
 class MovieModelViewSet(ModelViewSet):
@@ -71,6 +141,7 @@ class MovieModelViewSet(ModelViewSet):
     serializer_class = MovieModelSerializer
     filter_backends = [SearchFilter]
     search_fields = ["type"]
+    pagination_class = MovieCursorPagination  # 游标分页，避免首页一次性拉取全部电影
 
     def get_queryset(self):
         """
@@ -82,55 +153,181 @@ class MovieModelViewSet(ModelViewSet):
         if category:
             if category == "other":
                 exclude_types = ["喜剧", "动作", "剧情"]
-                for exclude_type in exclude_types:
-                    queryset = queryset.exclude(type__contains=exclude_type)
+                queryset = queryset.exclude(genres__name__in=exclude_types)
             else:
                 chinese_category = CATEGORY_MAPPING.get(category)
                 if chinese_category:
-                    queryset = queryset.filter(type__contains=chinese_category)
+                    queryset = queryset.filter(genres__name=chinese_category)
 
         return queryset
 
+    def retrieve(self, request, *args, **kwargs):
+        """电影详情，同时为该电影记录一次浏览热度"""
+        response = super().retrieve(request, *args, **kwargs)
+        record_movie_event(response.data['id'], EVENT_VIEW)
+        return response
 
-class MovieSearchView(generics.ListAPIView):
-    """电影搜索"""
-    serializer_class = MovieModelSerializer
 
-    def get_queryset(self):
-        queryset = Movie.objects.all()
-        keyword = self.request.query_params.get('keyword', None)
+class PagedRankingMixin:
+    """按页码读取的榜单和搜索结果：解析page/page_size参数，返回 count/next/previous/results 格式的分页结果"""
+    page_config = None  # 分页配置在settings中的名称
+
+    def get_page(self, request):  # noqa
+        config = getattr(settings, self.page_config, {})
+        default_page_size = config.get('PAGE_SIZE', 20)
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        try:
+            page_size = int(request.query_params.get('page_size', default_page_size))
+        except ValueError:
+            page_size = default_page_size
+        if page_size <= 0:
+            page_size = default_page_size
+        return page, min(page_size, config.get('MAX_PAGE_SIZE', 100))
+
+    def get_paginated_response(self, request, page, page_size, count, results):  # noqa
+        base_url = request.build_absolute_uri()
+        return Response({
+            'count': count,
+            'next': replace_query_param(base_url, 'page', page + 1) if page * page_size < count else None,
+            'previous': replace_query_param(base_url, 'page', page - 1) if page > 1 else None,
+            'results': results,
+        })
+
+
+class MovieSearchView(PagedRankingMixin, APIView):
+    """
+    电影搜索，按页返回 count/next/previous/results，count为全部命中的电影数
+    (facets=1 时同时返回全部命中电影的类别、评分区间、年份、导演分面统计)
+    """
+    page_config = 'SEARCH_INDEX'
+
+    def get(self, request):
+        keyword = request.query_params.get('keyword', None)
+        with_facets = request.query_params.get('facets') in ('1', 'true')
+        page, page_size = self.get_page(request)
+        offset = (page - 1) * page_size
 
         if keyword:
-            queryset = queryset.filter(
-                Q(title__icontains=keyword) |
-                Q(brief_introduction__icontains=keyword) |
-                Q(director__icontains=keyword) |
-                Q(starring__icontains=keyword) |
-                Q(type__icontains=keyword)
-            )
+            # 通过倒排索引检索，按相关度排序，只读取当前页的电影
+            result = movie_search_index.search(keyword, offset=offset, limit=page_size, facets=with_facets)
+            movie_ids = [movie_id for movie_id, _ in result.hits]
+            movies = Movie.objects.in_bulk(movie_ids)
+            results = [movies[movie_id] for movie_id in movie_ids if movie_id in movies]
+            count, facets = result.total, result.facets
+        else:
+            # 按评分排序
+            queryset = Movie.objects.all().order_by('-score', 'id')
+            count = queryset.count()
+            results = queryset[offset:offset + page_size]
+            facets = movie_search_index.catalog_facets() if with_facets else None
 
-        # 按评分排序
-        return queryset.order_by('-score')
+        data = MovieModelSerializer(results, many=True).data
+        response = self.get_paginated_response(request, page, page_size, count, data)
+        if facets is not None:
+            response.data['facets'] = facets
+        return response
 
 
-class MovieRankingView(generics.ListAPIView):
-    """电影榜单"""
-    queryset = Movie.objects.all()
-    serializer_class = MovieModelSerializer
-    filter_backends = [OrderingFilter]
+class MovieSuggestView(APIView):
+    """电影搜索补全(片名、导演、演员前缀，支持片名拼音)"""
+    default_limit = 10
+    max_limit = 20
+
+    def get(self, request):
+        prefix = request.query_params.get('q', '').strip()
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+        limit = min(max(limit, 1), self.max_limit)
+
+        if not prefix:
+            return Response([])
+        return Response(movie_suggest_index.suggest(prefix, limit))
+
+
+class SimilarMovieListView(APIView):
+    """相似电影(按简介、导演、主演和类别的内容相似度，读取预先计算的相似电影表)"""
+    default_limit = 10
+    max_limit = 20
+
+    def get(self, request, movie_id):  # noqa
+        get_object_or_404(Movie, pk=movie_id)
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+        limit = min(max(limit, 1), self.max_limit)
+
+        similar = SimilarMovie.objects.filter(movie_id=movie_id).select_related('similar').order_by(
+            '-similarity')[:limit]
+        serializer = MovieModelSerializer([item.similar for item in similar], many=True)
+        return Response(serializer.data)
+
+
+class MovieRankingView(PagedRankingMixin, APIView):
+    """
+    电影榜单(按评分或上映时间分页，无评分或无上映时间的电影排在最后)
+    从redis有序集合中读取一页电影id，redis不可用或榜单尚未构建时退回数据库排序查询
+    """
+    page_config = 'MOVIE_RANKING'
     ordering_fields = ['score', 'release_time']
-    ordering = ['-score']  # 默认按评分降序
+    default_ordering = '-score'
 
-    def get_queryset(self):
-        # 将无评分的电影放在最后
-        queryset = super().get_queryset()
-        return queryset.order_by('-score', 'id').annotate(
-            has_score=Case(
-                When(score__isnull=True, then=Value(0)),
-                default=Value(1),
-                output_field=FloatField()
-            )
-        ).order_by('-has_score', '-score')
+    def get(self, request):
+        ordering = request.query_params.get('ordering', self.default_ordering)
+        if ordering.lstrip('-') not in self.ordering_fields:
+            ordering = self.default_ordering
+        page, page_size = self.get_page(request)
+        offset = (page - 1) * page_size
+
+        try:
+            movie_ids, count = get_ranking_page(ordering, offset, page_size)
+            movies = Movie.objects.in_bulk(movie_ids)
+            results = [movies[movie_id] for movie_id in movie_ids if movie_id in movies]
+        except RankingUnavailable:
+            start_background_rebuild()
+            results, count = self.get_ranking_from_db(ordering, offset, page_size)
+
+        data = MovieModelSerializer(results, many=True).data
+        return self.get_paginated_response(request, page, page_size, count, data)
+
+    def get_ranking_from_db(self, ordering, offset, limit):  # noqa
+        """与redis榜单相同的排序：无评分或无上映时间的电影排在最后，同分时按id与排序方向一致"""
+        field = ordering.lstrip('-')
+        if ordering.startswith('-'):
+            order_by = [F(field).desc(nulls_last=True), F('id').desc()]
+        else:
+            order_by = [F(field).asc(nulls_last=True), F('id').asc()]
+        queryset = Movie.objects.order_by(*order_by)
+        return list(queryset[offset:offset + limit]), Movie.objects.count()
+
+
+class MovieTrendingView(PagedRankingMixin, APIView):
+    """
+    热门电影榜(近期评分、评论和浏览按时间指数衰减累计的热度，每条结果附带当前热度heat)
+    热度在事件发生时增量累计在redis有序集合中，读取一页的耗时与电影总数无关
+    """
+    page_config = 'TRENDING'
+
+    def get(self, request):
+        page, page_size = self.get_page(request)
+        trending = get_trending_page((page - 1) * page_size, page_size)
+        if trending is None:
+            return Response({'error': '热门榜单暂不可用'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        entries, count = trending
+        movies = Movie.objects.in_bulk([movie_id for movie_id, _ in entries])
+        data = []
+        for movie_id, heat in entries:
+            if movie_id in movies:
+                item = MovieModelSerializer(movies[movie_id]).data
+                item['heat'] = heat
+                data.append(item)
+        return self.get_paginated_response(request, page, page_size, count, data)
 
 
 class UserRegisterView(generics.CreateAPIView):
@@ -284,22 +481,20 @@ class PasswordResetRequestView(APIView):
         serializer = PasswordResetRequestSerializer(data=request.data)
         if serializer.is_valid():
             email = serializer.validated_data['email']
-            redis_client = get_redis_instance()
-            # 检查发送频率限制
-            last_sent = redis_client.get(f"reset_cooldown:{email}")
-            if last_sent and (timezone.now().timestamp() - float(last_sent)) < 60:
-                return Response(
-                    {'error': '请等待60秒后再试'},
-                    status=status.HTTP_429_TOO_MANY_REQUESTS
-                )
 
             # 生成6位随机验证码
             verification_code = str(random.randint(100000, 999999))
 
-            # 存储到 Redis，设置5分钟过期
-            redis_client.setex(f"reset_code:{email}", 300, verification_code)  # 300秒=5分钟
-            redis_client.setex(f"reset_timestamp:{email}", 300, timezone.now().timestamp())
-            redis_client.setex(f"reset_cooldown:{email}", 60, str(timezone.now().timestamp()))  # 设置60秒冷却
+            # 检查发送频率限制(60秒冷却)，并将验证码存储到 Redis，设置5分钟过期
+            try:
+                stored = store_reset_code(email, verification_code, timezone.now().timestamp())
+            except ResetCodeUnavailable:
+                return Response({'error': '服务暂不可用，请稍后再试'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            if not stored:
+                return Response(
+                    {'error': '请等待60秒后再试'},
+                    status=status.HTTP_429_TOO_MANY_REQUESTS
+                )
             # 发送邮件验证码
             subject = '密码重置验证码'
             message = f'您的密码重置验证码是: {verification_code},有效期为5分钟,请尽快验证!'
@@ -322,7 +517,14 @@ class PasswordResetConfirmView(APIView):
     def post(self, request):  # noqa
         """密码重置确认"""
         serializer = PasswordResetConfirmSerializer(data=request.data)
-        if serializer.is_valid():
+        try:
+            valid = serializer.is_valid()
+            # 先删除 Redis 中的验证码再修改密码，验证码只能使用一次，并发使用同一验证码时只有一个请求成功
+            if valid and not clear_reset_code(serializer.validated_data['email']):
+                return Response({'code': ['验证码无效或已过期']}, status=status.HTTP_400_BAD_REQUEST)
+        except ResetCodeUnavailable:
+            return Response({'error': '服务暂不可用，请稍后再试'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        if valid:
             email = serializer.validated_data['email']
             new_password = serializer.validated_data['new_password']
 
@@ -332,11 +534,6 @@ class PasswordResetConfirmView(APIView):
             user.set_password(new_password)
             user.save()
 
-            # 清理 Redis 中的验证码
-            redis_client = get_redis_instance()
-            redis_client.delete(f"reset_code:{email}")
-            redis_client.delete(f"reset_timestamp:{email}")
-
             return Response({'message': '密码重置成功'}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -346,7 +543,13 @@ class CurrentUserRatingView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, movie_id):  # noqa
-        """获取当前用户对电影的评分"""
+        """获取当前用户对电影的评分，评分写缓冲开启时优先返回尚未写入数据库的评分"""
+        if rating_buffer_enabled():
+            buffered = get_buffered_rating(request.user.id, movie_id)
+            if buffered is not None:
+                value, rated_at = buffered
+                return Response(self.pending_rating(request.user, movie_id, value, rated_at))
+
         rating = Rating.objects.filter(
             movie_id=movie_id,
             user=request.user
@@ -359,14 +562,96 @@ class CurrentUserRatingView(APIView):
 
     def post(self, request, movie_id):  # noqa
         """当前用户对电影创建或更新评分"""
+        value = parse_rating(request.data.get('rating'))
+        if value is None:
+            return Response({'rating': ['评分必须是0到5之间的数字']}, status=status.HTTP_400_BAD_REQUEST)
+
+        if rating_buffer_enabled():
+            response = self.buffer(request, movie_id, value)
+            if response is not None:
+                return response
+
         rating, created = Rating.objects.update_or_create(
             user=request.user,
             movie_id=movie_id,
-            defaults={'rating': request.data.get('rating')}
+            defaults={'rating': value}
         )
         serializer = RatingSerializer(rating)
         return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
+    def buffer(self, request, movie_id, value):
+        """
+        评分写入redis缓冲区后返回202，由后台线程批量写入数据库
+        :return: redis不可用时返回None，由调用方直接写入数据库
+        """
+        get_object_or_404(Movie.objects.only('id'), pk=movie_id)
+
+        rated_at = buffer_rating(request.user.id, movie_id, value)
+        if rated_at is None:
+            return None
+        return Response(self.pending_rating(request.user, movie_id, value, rated_at), status=status.HTTP_202_ACCEPTED)
+
+    @staticmethod
+    def pending_rating(user, movie_id, value, rated_at):
+        """尚未写入数据库的评分，字段与 RatingSerializer 一致，pending 表示评分正在写入"""
+        return {
+            'id': None,
+            'user': user.id,
+            'movie': int(movie_id),
+            'username': user.username,
+            'rating': value,
+            'rating_time': RatingSerializer().fields['rating_time'].to_representation(rated_at),
+            'pending': True,
+        }
+
+
+class MyRatingsView(APIView):
+    """批量获取当前用户对多部电影的评分，供电影列表一次请求显示用户自己的评分"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):  # noqa
+        """
+        ids参数为逗号分隔的电影id
+        返回 {电影id: 评分}，未评分的电影评分为0
+        """
+        ids = [movie_id for movie_id in request.query_params.get('ids', '').split(',') if movie_id.strip()]
+        try:
+            movie_ids = list(dict.fromkeys(map(int, ids)))
+        except ValueError:
+            return Response({'error': 'ids参数必须是逗号分隔的电影id'}, status=status.HTTP_400_BAD_REQUEST)
+        max_ids = get_user_rating_config()['max_ids']
+        if len(movie_ids) > max_ids:
+            return Response({'error': f'一次最多查询{max_ids}部电影'}, status=status.HTTP_400_BAD_REQUEST)
+
+        ratings = get_user_ratings(request.user.id, movie_ids)
+        if rating_buffer_enabled():
+            ratings.update(get_buffered_ratings(request.user.id, movie_ids))
+        return Response({movie_id: ratings.get(movie_id, 0) for movie_id in movie_ids})
+
+
+class BulkRatingView(APIView):
+    """
+    批量提交评分：请求体为 {"ratings": [{"movie": 电影id, "rating": 评分}, ...]}
+    普通用户只能提交自己的评分，管理员可通过 user 字段为其他用户导入评分
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):  # noqa
+        items = request.data.get('ratings')
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            return Response({'error': 'ratings必须是评分列表'}, status=status.HTTP_400_BAD_REQUEST)
+        max_rows = get_bulk_rating_config()['max_rows']
+        if len(items) > max_rows:
+            return Response({'error': f'一次最多提交{max_rows}条评分'}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = []
+        for item in items:
+            user_id = item.get('user', request.user.id)
+            if str(user_id) != str(request.user.id) and not request.user.is_staff:
+                return Response({'error': '只能提交自己的评分'}, status=status.HTTP_403_FORBIDDEN)
+            rows.append((user_id, item.get('movie'), item.get('rating')))
+        return Response(import_ratings(rows))
+
 
 class UserRatingListCreateView(generics.ListCreateAPIView):
     """暂时保留，用于后续实现‘我评分过的电影’"""
@@ -403,14 +688,21 @@ class MovieRatingStatsView(APIView):
     """电影评分统计"""
 
     def get(self, request, movie_id):  # noqa
-        """向下取整(1位小数)计算平均分"""
-        stats = Rating.objects.filter(movie_id=movie_id).aggregate(
-            avg_rating=Avg('rating'),
-            rating_count=Count('rating')
-        )
+        """
+        读取电影的评分总和、人数和评分分布(一条查询，耗时与评分数量无关)
+        平均分保留1位小数，distribution为0到5分每半星一档的人数
+        """
+        row = Movie.objects.filter(pk=movie_id).values(
+            'rating_sum', 'rating_count', *[f'rating_histogram__{field}' for field in HISTOGRAM_FIELDS]
+        ).first() or {}
+        rating_count = row.get('rating_count') or 0
         return Response({
-            'avg_rating': round(stats['avg_rating'], 1) if stats['avg_rating'] else None,
-            'rating_count': stats['rating_count']
+            'avg_rating': round(row['rating_sum'] / rating_count, 1) if rating_count else None,
+            'rating_count': rating_count,
+            'distribution': [
+                {'rating': bucket / 2, 'count': row.get(f'rating_histogram__{field}') or 0}
+                for bucket, field in enumerate(HISTOGRAM_FIELDS)
+            ],
         })
 
 
@@ -480,15 +772,13 @@ class MovieCommentListView(generics.ListAPIView):
         context['request'] = self.request
         return context
 
-    def get_queryset(self):
-        return Comments.objects.filter(
-            movie_id=self.kwargs['movie_id'],
-            parent_comment__isnull=True  # 先筛选出顶级评论
-        ).select_related(  # 关联预加载：外键字段和一对一字段
-            'user', 'movie', 'parent_comment__user'
-        ).prefetch_related(  # 关联预加载：多对多字段和反向外键关系
-            'replies__user'
-        ).order_by('comment_time')
+    def list(self, request, *args, **kwargs):
+        """一次性加载整棵评论树和评论用户的评分，查询次数不随评论数量增长"""
+        top_level_comments, ratings = load_movie_comment_thread(self.kwargs['movie_id'])
+        context = self.get_serializer_context()
+        context['ratings'] = ratings
+        serializer = self.get_serializer_class()(top_level_comments, many=True, context=context)
+        return Response(serializer.data)
 
 
 class MovieRecommendationView(APIView):
@@ -496,70 +786,99 @@ class MovieRecommendationView(APIView):
     permission_classes = []
 
     def get(self, request):
-        if request.user.is_authenticated:
-            user = request.user
-
-            # 检查用户是否有评分记录
-            user_ratings = Rating.objects.filter(user=user).exists()
+        user = request.user if request.user.is_authenticated else None
+        # 常见情况下只需一次redis读取，用户评分变化时其缓存会被删除
+        recommended, version = get_cached_recommendations(user.id if user else None)
+        if recommended is None:
+            recommended = self.compute_recommendations(user, version)
+
+        if user:
+            return Response(recommended)
+        return Response({
+            'movies': recommended,
+            'is_anonymous': True,
+            'message': '登录后可获得个性化推荐'
+        })
 
-            if user_ratings:
-                # 有评分记录 : 基于用户评分推荐
-                recommended_movies = self.get_recommendations_based_on_ratings(user)
-            else:
-                # 无评分记录 : 推荐各分类高分电影
-                recommended_movies = self.get_top_rated_by_category()
+    def compute_recommendations(self, user, version=None):
+        """
+        计算推荐列表并写入缓存：有评分记录的用户单独缓存，匿名用户和没有评分的用户共用一份
+        version为计算前读取的用户缓存版本号，计算期间用户评分发生变化时不写入用户缓存
+        """
+        # 有评分记录 : 基于协同过滤模型推荐，不足时以同类别高分电影补齐
+        if user and Rating.objects.filter(user=user).exists():
+            recommended = MovieModelSerializer(self.get_personalized_recommendations(user), many=True).data
+            cache_user_recommendations(user.id, recommended, version)
+            return recommended
+
+        # 无评分记录或匿名用户 : 推荐各分类高分电影
+        recommended = MovieModelSerializer(self.get_top_rated_by_category(), many=True).data
+        cache_shared_recommendations(recommended, user.id if user else None, version)
+        return recommended
 
-            serializer = MovieModelSerializer(recommended_movies, many=True)
-            return Response(serializer.data)
-        else:
-            recommended_movies = self.get_anonymous_recommendations()
-            serializer = MovieModelSerializer(recommended_movies, many=True)
-            return Response({
-                'movies': serializer.data,
-                'is_anonymous': True,
-                'message': '登录后可获得个性化推荐'
-            })
+    def get_personalized_recommendations(self, user, limit=10):
+        """基于用户评分和离线训练的推荐模型(电影近邻或ALS)推荐电影"""
+        movie_ids = recommend_for_user(user.id, limit)
+        movies = Movie.objects.in_bulk(movie_ids)
+        recommended = [movies[movie_id] for movie_id in movie_ids if movie_id in movies]
+        if len(recommended) < limit:
+            # 近邻表尚未计算或用户评分的电影缺少近邻时，以同类别高分电影补齐
+            for movie in self.get_recommendations_based_on_ratings(user):
+                if len(recommended) >= limit:
+                    break
+                if movie.id not in movies:
+                    recommended.append(movie)
+        return recommended
 
     def get_recommendations_based_on_ratings(self, user):  # noqa
         """基于用户评分推荐电影"""
-        # 获取用户评分过的电影类型
-        rated_types = Rating.objects.filter(
-            user=user
-        ).values_list('movie__type', flat=True).distinct()  # flat=True表示返回单值列表,不设置默认返回元组列表
+        # 获取用户评分过的电影类别
+        rated_genres = Genre.objects.filter(
+            movie_genres__movie__rating__user=user
+        ).values('id')
 
-        # 获取这些类型中评分高的电影(排除用户已评分的)
+        # 获取这些类别中评分高的电影(排除用户已评分的)
         recommended = Movie.objects.filter(
-            type__in=rated_types
+            genres__in=rated_genres
         ).exclude(
             rating__user=user
-        ).order_by('-score')[:10]
+        ).distinct().order_by('-score')[:10]
 
         return recommended
 
-    def get_top_rated_by_category(self):  # noqa
-        """推荐各分类高分电影"""
-        # 获取所有电影类型
-        movie_types = Movie.objects.values_list('type', flat=True).distinct()
-
-        recommended_movies = []
-
-        for movie_type in movie_types:
-            # 获取该类型评分最高的2部电影
-            top_movies = Movie.objects.filter(
-                type=movie_type
-            ).order_by('-score')[:2]
-
-            recommended_movies.extend(top_movies)
+    def get_top_rated_by_category(self, per_genre=2, limit=10):  # noqa
+        """
+        推荐各分类高分电影
+        一次窗口函数查询取出每个类别评分最高的per_genre部电影(同分按id)，
+        先取各类别的第1名、再取第2名，同一名次按评分降序，属于多个类别的电影只保留一次
+        """
+        ranked = MovieGenre.objects.annotate(
+            rank=Window(
+                expression=RowNumber(),
+                partition_by=F('genre_id'),
+                order_by=[F('movie__score').desc(nulls_last=True), F('movie_id').asc()]
+            )
+        ).filter(rank__lte=per_genre).select_related('movie').order_by(
+            'rank', F('movie__score').desc(nulls_last=True), 'movie_id'
+        )
 
-            # 如果已经收集到10部，提前结束
-            if len(recommended_movies) >= 10:
+        recommended_movies = {}
+        for item in ranked:
+            recommended_movies.setdefault(item.movie_id, item.movie)
+            if len(recommended_movies) >= limit:
                 break
+        return list(recommended_movies.values())
 
-        return recommended_movies[:10]
 
-    def get_anonymous_recommendations(self):
-        """为匿名用户生成推荐"""
-        return self.get_top_rated_by_category()
+class RecommendationCacheStatsView(APIView):
+    """推荐缓存命中率统计(仅管理员)"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):  # noqa
+        stats = get_cache_stats()
+        if stats is None:
+            return Response({'error': '推荐缓存统计暂不可用'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(stats)
 
 
 class StandardResultsSetPagination(PageNumberPagination):
@@ -578,6 +897,7 @@ class AdminMovieViewSet(ModelViewSet):
     permission_classes = [IsAdminUser]  # 限制只有管理员才能访问
     parser_classes = [MultiPartParser, FormParser, JSONParser]  # 支持表单和文件上传
     pagination_class = StandardResultsSetPagination
+    trend_windows = (7, 30, 90, 365)  # 评分趋势可选的天数
 
     # 过滤、搜索、排序
     filter_backends = [SearchFilter]
@@ -715,28 +1035,10 @@ class AdminMovieViewSet(ModelViewSet):
     @action(detail=False, methods=['get'])
     def category_stats(self, request):
         """获取各分类电影数量统计"""
-        stats = Movie.objects.values('type').annotate(count=Count('id')).order_by('-count')
-
-        # 处理多类型电影（如"动作/喜剧"）
-        categories = {}
-        for item in stats:
-            movie_type = item['type']
-            count = item['count']
-
-            # 处理包含多个类型的情况
-            if '/' in movie_type:
-                types = movie_type.split('/')
-                for t in types:
-                    t = t.strip()
-                    if t in categories:
-                        categories[t] += count
-                    else:
-                        categories[t] = count
-            else:
-                if movie_type in categories:
-                    categories[movie_type] += count
-                else:
-                    categories[movie_type] = count
+        stats = Genre.objects.annotate(
+            count=Count('movie_genres')
+        ).filter(count__gt=0).order_by('-count').values('name', 'count')
+        categories = {item['name']: item['count'] for item in stats}
 
         # 转换为字典列表给前端
         result = [{"category": k, "count": v} for k, v in categories.items()]
@@ -745,51 +1047,25 @@ class AdminMovieViewSet(ModelViewSet):
     @action(detail=False, methods=['get'])
     def rating_distribution(self, request):
         """各分类电影不同分数段占比"""
-        ranges = [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5)]
-        result = []
-        categories = set()
+        labels = [label for label, _, _ in SCORE_BUCKETS] + [NO_SCORE_BUCKET]
 
-        # 获取所有电影类型
-        for movie in Movie.objects.all():
-            if '/' in movie.type:
-                for t in movie.type.split('/'):
-                    categories.add(t.strip())
-            else:
-                categories.add(movie.type)
-
-        for category in categories:
-            distribution = []
-            movie_ids = set()
-            # 获取包含该类型的电影 ID
-            for movie in Movie.objects.all():
-                if '/' in movie.type:
-                    types = [t.strip() for t in movie.type.split('/')]
-                    if category in types:
-                        movie_ids.add(movie.id)
-                elif movie.type == category:
-                    movie_ids.add(movie.id)
-
-            rated_count = 0
-
-            # 按评分分段统计
-            for start, end in ranges:
-                count = Movie.objects.filter(id__in=movie_ids, score__gte=start, score__lt=end).count()
-                distribution.append({
-                    "range": f"{start}-{end}",
-                    "count": count
-                })
-                rated_count += count
-
-            # 添加无评分分段
-            unrated_count = Movie.objects.filter(id__in=movie_ids, score__isnull=True).count()
-            distribution.append({
-                "range": "无评分",
-                "count": unrated_count
-            })
+        # 基于类别关联表按类别分组，一次聚合查询统计出所有分数段(含无评分)的电影数量，分段与搜索分面一致
+        bucket_counts = {
+            f"bucket_{index}": Count('movie_id', filter=score_bucket_filter('movie__score', label))
+            for index, label in enumerate(labels)
+        }
+        stats = MovieGenre.objects.values('genre__name').annotate(**bucket_counts).order_by('genre__name')
+
+        result = []
+        for item in stats:
+            distribution = [
+                {"range": label, "count": item[f"bucket_{index}"]}
+                for index, label in enumerate(labels)
+            ]
 
             # 返回各个电影分类中各个分数段的电影数量，占比计算由前端完成
             result.append({
-                "category": category,
+                "category": item['genre__name'],
                 "distribution": distribution
             })
 
@@ -797,135 +1073,60 @@ class AdminMovieViewSet(ModelViewSet):
 
     @action(detail=True, methods=['get'])
     def rating_trend(self, request, pk=None):
-        """获取特定电影的评分趋势"""
-        movie = self.get_object()
+        """
+        获取特定电影最近days天(7/30/90/365，默认7)每天的平均评分
+        读取每日评分汇总表，最多读取days条记录，不扫描评分表；没有评分的日期沿用前一天的平均评分
+        """
+        try:
+            days = int(request.query_params.get('days', self.trend_windows[0]))
+        except ValueError:
+            days = None
+        if days not in self.trend_windows:
+            return Response({'error': f"days参数只能是 {'/'.join(map(str, self.trend_windows))}"},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        # 获取最近7天每天的平均评分
-        end_date = timezone.now()
-        start_date = end_date - timedelta(days=7)
-
-        # 按日期分组获取评分
-        daily_ratings = Rating.objects.filter(
-            movie=movie,
-            rating_time__gte=start_date,
-            rating_time__lte=end_date
-        ).extra(
-            select={'date': "DATE(rating_time)"}  # 提取评分时间的日期部分
-        ).values('date').annotate(avg_rating=Avg('rating')).order_by('date')
-
-        # 将查询结果转换为字典(将日期对象转换为字符串格式（'YYYY-MM-DD'）作为字典的键,将平均评分转换为浮点数作为字典的值)
-        ratings_dict = {
-            item['date'].strftime('%Y-%m-%d'): float(item['avg_rating'])
-            for item in daily_ratings
+        movie = self.get_object()
+        end_date = rating_day(timezone.now())
+        start_date = end_date - timedelta(days=days - 1)
+        rollups = {
+            day: (total, count)
+            for day, total, count in RatingDailyRollup.objects.filter(
+                movie=movie, day__gte=start_date, day__lte=end_date, rating_count__gt=0
+            ).values_list('day', 'rating_sum', 'rating_count')
         }
 
-        # 生成完整的7天日期序列
-        complete_trend_data = []
-        current_date = start_date.date()
-        end_date_only = end_date.date()
-
-        # 获取默认评分值 - 使用None表示暂无评分，区别于0分
-        default_rating = None
-
-        # 检查电影是否有评分（不管是最近7天内还是历史评分）
-        has_any_rating = False
-
-        # 先检查电影对象的score
+        # 窗口开始前的平均评分：优先使用电影当前评分，其次是窗口内第一天有评分的平均分，最后是窗口前最近一天的平均分
         if movie.score is not None:
-            default_rating = float(movie.score)
-            has_any_rating = True
+            last_rating = float(movie.score)
+        elif rollups:
+            total, count = rollups[min(rollups)]
+            last_rating = total / count
         else:
-            # 检查最近7天内的评分
-            if ratings_dict:
-                has_any_rating = True
-                sorted_dates = sorted(ratings_dict.keys())
-                default_rating = ratings_dict[sorted_dates[0]]
-            else:
-                # 检查历史评分
-                latest_rating = Rating.objects.filter(movie=movie).order_by('-rating_time').first()
-                if latest_rating:
-                    has_any_rating = True
-                    default_rating = float(Rating.objects.filter(
-                        movie=movie,
-                        rating_time__date=latest_rating.rating_time.date()
-                    ).aggregate(Avg('rating'))['rating__avg'])
-
-        # 填充每一天的数据，从最早日期开始
-        last_rating = default_rating
-        dates_to_process = []
-
-        # 先收集所有需要处理的日期
-        while current_date <= end_date_only:
-            dates_to_process.append(current_date)
-            current_date += timedelta(days=1)
-
-        # 如果电影完全没有任何评分记录，返回全部为null的数据
-        if not has_any_rating:
-            for date in dates_to_process:
-                date_str = date.strftime('%Y-%m-%d')
-                complete_trend_data.append({
-                    "date": date_str,
-                    "avg_rating": None  # 使用None表示暂无评分
-                })
-            return Response(complete_trend_data)
-
-        # 从第一天到倒数第二天，按时间顺序填充
-        for i in range(len(dates_to_process) - 1):
-            current_date = dates_to_process[i]
-            date_str = current_date.strftime('%Y-%m-%d')
-
-            if date_str in ratings_dict:
-                current_rating = ratings_dict[date_str]
-                last_rating = current_rating
-            else:
-                current_rating = last_rating
-
-            complete_trend_data.append({
-                "date": date_str,
-                "avg_rating": current_rating
-            })
-
-        # 最后一天（最新日期）特殊处理，使用电影的当前score
-        if dates_to_process:
-            last_date = dates_to_process[-1]
-            last_date_str = last_date.strftime('%Y-%m-%d')
-
-            # 优先使用电影当前评分作为最新日期的评分
-            if movie.score is not None:
-                last_date_rating = float(movie.score)
-            # 如果当天有评分数据，使用当天的评分
-            elif last_date_str in ratings_dict:
-                last_date_rating = ratings_dict[last_date_str]
-            # 否则使用前一天的评分
-            else:
-                last_date_rating = last_rating
-
-            complete_trend_data.append({
-                "date": last_date_str,
-                "avg_rating": last_date_rating
-            })
-
-        return Response(complete_trend_data)
+            previous = RatingDailyRollup.objects.filter(
+                movie=movie, day__lt=start_date, rating_count__gt=0
+            ).order_by('-day').values_list('rating_sum', 'rating_count').first()
+            last_rating = previous[0] / previous[1] if previous else None  # None表示暂无评分，区别于0分
+
+        trend = []
+        for offset in range(days):
+            day = start_date + timedelta(days=offset)
+            total, count = rollups.get(day, (0, 0))
+            if count:
+                last_rating = total / count
+            trend.append({"date": day.strftime('%Y-%m-%d'), "avg_rating": last_rating, "rating_count": count})
+
+        # 最后一天(今天)优先使用电影当前评分
+        if movie.score is not None:
+            trend[-1]["avg_rating"] = float(movie.score)
+        return Response(trend)
 
     @action(detail=False, methods=['get'])
     def movie_types(self, request):
         """获取所有唯一的电影类型列表"""
-        # 获取所有电影类型
-        all_types = set()
-
-        # 遍历所有电影，提取并分割类型
-        for movie in Movie.objects.all():
-            if not movie.type:
-                continue
-
-            if '/' in movie.type:
-                for t in movie.type.split('/'):
-                    t = t.strip()
-                    if t:
-                        all_types.add(t)
-            else:
-                if movie.type.strip():
-                    all_types.add(movie.type.strip())
+        # 获取所有关联了电影的类别
+        all_types = set(
+            Genre.objects.filter(movie_genres__isnull=False).values_list('name', flat=True)
+        )
 
         # 默认按字母顺序排序
         sorted_types = sorted(all_types)